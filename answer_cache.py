@@ -0,0 +1,112 @@
+import hashlib
+import threading
+
+from query_cache import LRUCache
+
+# Fixed configuration
+ANSWER_CACHE_MAX_BYTES = 16 * 1024 * 1024
+ANSWER_CACHE_TTL = 3600   # seconds (None = keep until evicted)
+
+
+def backend_name(backend):
+    """Identity of a generation backend in cache keys: its `name`, else its class name."""
+    return getattr(backend, "name", None) or type(backend).__name__
+
+
+def prompt_key(prompt, model_name, backend):
+    """Cache key of one LLM call: the full prompt (query + context), the model and the backend."""
+    return hashlib.sha256(f"{backend_name(backend)}\0{model_name}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution.
+
+    The first caller (the leader) runs fn; callers that arrive while it is
+    in flight wait for it and get the same result or exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+
+class AnswerCache:
+    """Response cache + single-flight coalescing in front of an LLM backend.
+
+    `backend.generate(prompt, model_name) -> str` is only called on a miss,
+    and at most once at a time per prompt: concurrent identical requests share
+    the in-flight call. Answers are keyed per backend, so one backend's answer
+    is never served for another's request. Failed calls are not cached.
+    """
+
+    def __init__(self, max_bytes=ANSWER_CACHE_MAX_BYTES, ttl=ANSWER_CACHE_TTL):
+        self.cache = LRUCache(max_bytes, ttl=ttl)
+        self.flight = SingleFlight()
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def lookup(self, prompt, model_name, backend):
+        """Cached answer or None (no backend call)."""
+        return self.cache.get(prompt_key(prompt, model_name, backend))
+
+    def store(self, prompt, model_name, backend, text):
+        self.cache.put(prompt_key(prompt, model_name, backend), text, 100 + len(text.encode("utf-8")))
+
+    def get_or_generate(self, prompt, model_name, backend):
+        key = prompt_key(prompt, model_name, backend)
+        hit = self.cache.get(key)
+        if hit is not None:
+            return hit
+
+        def call():
+            with self._lock:
+                self.calls += 1
+            text = backend.generate(prompt, model_name)
+            self.store(prompt, model_name, backend, text)
+            return text
+
+        return self.flight.do(key, call)
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        with self._lock:
+            calls = self.calls
+        return {**self.cache.stats(), "backend_calls": calls, "coalesced": self.flight.coalesced}
+
+
+# Process-wide cache shared by generator.generate_answer
+ANSWER_CACHE = AnswerCache()
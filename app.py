@@ -1,11 +1,12 @@
-import os
 import time
 import streamlit as st
-from dotenv import load_dotenv
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-import google.generativeai as genai
 
-from generator import load_index, search, generate_answer
+from generator import search, stream_answer
+from registry import REGISTRY
+from query_cache import QUERY_CACHE
+from answer_cache import ANSWER_CACHE
+from reranker import RERANKER, RERANK_CANDIDATES
+from telemetry import breakdown, trace
 
 
 # ---------- Streamlit App ----------
@@ -13,24 +14,15 @@ def main():
     st.set_page_config(page_title="RAG Demo", layout="wide")
     st.title("📚 RAG docs chat")
 
-    # Load API key
-    load_dotenv()
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        st.error("❌ GEMINI_API_KEY not found in .env file.")
-        return
-    genai.configure(api_key=api_key)
-
     # Hidden system configs
     model_name = "gemini-1.5-flash"  # fixed model
 
-    # Load index + embeddings once
-    if "index" not in st.session_state:
+    # Index + embedding model: loaded once per process and shared by all sessions
+    if not REGISTRY.stats()["index_loaded"]:
         with st.spinner("Loading index..."):
-            st.session_state.index, st.session_state.metadata = load_index()
-            st.session_state.embed_model = HuggingFaceEmbedding(
-                model_name="sentence-transformers/all-MiniLM-L6-v2"
-            )
+            REGISTRY.warm_up()
+    snapshot = REGISTRY.snapshot()   # picks up a rebuilt index without restarting the app
+    metadata = snapshot.metadata
 
     # User input
     query = st.text_input("🔍 Enter your query:")
@@ -41,26 +33,57 @@ def main():
     # Sidebar controls
     st.sidebar.header("⚙️ Settings")
     k = st.sidebar.slider("Top-k retrieved chunks", 1, 10, 5)
+    mode = st.sidebar.radio("Retrieval", ["dense", "hybrid"], index=0,
+                            help="hybrid = dense + BM25 keyword search, fused by rank")
+    rerank = st.sidebar.checkbox("Rerank with cross-encoder", value=False,
+                                 help=f"Score the top {RERANK_CANDIDATES} candidates and keep the best k")
+
+    # Metadata filters (applied inside the index, not by over-fetching)
+    st.sidebar.header("🔎 Filters")
+    filters = {}
+    if hasattr(metadata, "field_values"):
+        filters["source"] = st.sidebar.multiselect("Document", metadata.field_values("source"))
+        filters["file_type"] = st.sidebar.multiselect("File type", metadata.field_values("file_type"))
+        pages = st.sidebar.text_input("Pages (e.g. 1, 4)", "")
+        filters["page"] = [int(p) for p in pages.replace(",", " ").split() if p.isdigit()]
+    if st.sidebar.checkbox("Tables only"):
+        filters["strategy"] = "table_whole"
 
     if generate and query:
-        start_time = time.time()
-
-        # Retrieve
-        retrieved = search(
-            query,
-            st.session_state.index,
-            st.session_state.metadata,
-            st.session_state.embed_model,
-            k=k,
-        )
-
-        # Generate
-        answer, citation_map = generate_answer(query, retrieved, model_name=model_name)
-        latency = time.time() - start_time
-
-        # Display main answer
-        st.subheader("📝 Answer")
-        st.write(answer)
+        with trace() as spans:   # per-stage timings of this request, for the debug panel
+            start_time = time.time()
+
+            # Retrieve
+            retrieved = search(
+                query,
+                snapshot,
+                metadata,
+                REGISTRY.embed_model,
+                k=max(k, RERANK_CANDIDATES) if rerank else k,
+                mode=mode,
+                filters=filters,
+            )
+            rerank_timings = {}
+            if rerank:
+                retrieved = RERANKER.rerank(query, retrieved, k, timings=rerank_timings)
+
+            retrieval_time = time.time() - start_time
+
+            # Generate, rendering the answer as it streams in
+            st.subheader("📝 Answer")
+            placeholder = st.empty()
+            timings = {}
+            answer = ""
+            try:
+                for piece in stream_answer(query, retrieved, model_name=model_name, timings=timings):
+                    answer += piece
+                    placeholder.markdown(answer + "▌")
+            except ValueError as e:   # e.g. GEMINI_API_KEY missing (checked on the first LLM call)
+                st.error(str(e))
+                return
+            placeholder.markdown(answer)
+            citation_map = timings["citations"]   # from the prompt stream_answer built
+            latency = time.time() - start_time
 
         # Sources in sidebar
         st.sidebar.header("📚 Sources")
@@ -81,7 +104,9 @@ def main():
                     if meta.get("type"): anchor.append(f"type={meta['type']}")
                     if meta.get("table_index") is not None: anchor.append(f"table_index={meta['table_index']}")
                     if meta.get("section"): anchor.append(f"section={meta['section']}")
-                    if meta.get("pages"): anchor.append(f"pages={meta['pages']}")
+                    if meta.get("pages"):
+                        pages = meta["pages"]   # list of page numbers (a single value in older indexes)
+                        anchor.append(f"pages={', '.join(map(str, pages)) if isinstance(pages, list) else pages}")
                 anchor_text = ", ".join(anchor) if anchor else "no position info"
 
                 st.markdown(
@@ -92,12 +117,24 @@ def main():
 
         # Observability
         with st.expander("🔎 Debug Info"):
+            st.markdown("**Per-stage breakdown** (ms)")
+            st.table(breakdown(spans))
             st.json(
                 {
                     "query": query,
                     "top_k": k,
+                    "retrieval_mode": mode,
+                    "filters": {f: v for f, v in filters.items() if v},
                     "retrieved_count": len(retrieved),
                     "latency_sec": round(latency, 2),
+                    "retrieval_sec": round(retrieval_time, 3),
+                    "ttft_sec": round(retrieval_time + timings["ttft_sec"], 3),
+                    "generation_sec": round(timings["total_sec"], 2),
+                    "answer_cached": timings["cached"],
+                    "rerank": rerank_timings or None,
+                    "context": timings["context"],
+                    "query_cache": QUERY_CACHE.stats(),
+                    "answer_cache": ANSWER_CACHE.stats(),
                     "retrieved_chunks": [
                         {
                             "text": r["text"][:100],
@@ -0,0 +1,100 @@
+"""Recall / latency / memory of the FAISS index backends on synthetic corpora.
+
+Run from the project root:
+    python -m benchmarks.bench_ann [n_vectors ...]      (default: 10000 100000)
+
+Every backend is compared with an exact flat index over the same vectors.
+1M vectors works but needs a few GB of RAM and several minutes of training.
+"""
+import sys
+import time
+import faiss
+import numpy as np
+
+from embed_index import make_index, train_index, search_params
+
+DIM = 384          # all-MiniLM-L6-v2
+N_QUERIES = 500
+K = 10
+
+# (label, index_type, build opts, query-time params)
+CONFIGS = [
+    ("ivf_flat nprobe=1", "ivf_flat", {}, {"nprobe": 1}),
+    ("ivf_flat nprobe=8", "ivf_flat", {}, {"nprobe": 8}),
+    ("ivf_flat nprobe=32", "ivf_flat", {}, {"nprobe": 32}),
+    ("ivf_pq nprobe=8", "ivf_pq", {}, {"nprobe": 8}),
+    ("ivf_pq nprobe=32", "ivf_pq", {}, {"nprobe": 32}),
+    ("hnsw ef=16", "hnsw", {}, {"ef_search": 16}),
+    ("hnsw ef=64", "hnsw", {}, {"ef_search": 64}),
+    ("hnsw ef=256", "hnsw", {}, {"ef_search": 256}),
+]
+
+
+def synthetic_corpus(n, dim=DIM, n_clusters=200, seed=0):
+    """Clustered Gaussian vectors (closer to real embeddings than uniform noise)."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim)).astype("float32")
+    labels = rng.integers(0, n_clusters, n)
+    xb = centers[labels] + 0.5 * rng.standard_normal((n, dim)).astype("float32")
+    queries = xb[rng.choice(n, N_QUERIES, replace=False)] + 0.1 * rng.standard_normal((N_QUERIES, dim)).astype("float32")
+    return xb, queries.astype("float32")
+
+
+def query_latencies(index, queries, params):
+    """Single-query latencies in ms (the serving path searches one query at a time)."""
+    threads = faiss.omp_get_max_threads()
+    faiss.omp_set_num_threads(1)  # measure per-query cost, not parallel speedup
+    lat = []
+    for q in queries:
+        t0 = time.perf_counter()
+        index.search(q[None, :], K, params=params)
+        lat.append((time.perf_counter() - t0) * 1000)
+    faiss.omp_set_num_threads(threads)
+    return np.array(lat)
+
+
+def recall_at_k(found, truth):
+    return np.mean([len(set(f) & set(t)) / K for f, t in zip(found, truth)])
+
+
+def run(n):
+    xb, queries = synthetic_corpus(n)
+    ids = np.arange(n, dtype="int64")
+    rows = []
+
+    flat = make_index(DIM, "flat")
+    flat.add_with_ids(xb, ids)
+    _, truth = flat.search(queries, K)
+    lat = query_latencies(flat, queries, None)
+    rows.append(("flat (exact)", 0.0, 1.0, lat, faiss.serialize_index(flat).nbytes))
+
+    built = {}
+    for label, index_type, opts, params in CONFIGS:
+        key = (index_type, tuple(sorted(opts.items())))
+        if key not in built:
+            t0 = time.perf_counter()
+            index = make_index(DIM, index_type, n_vectors=n, **opts)
+            train_index(index, xb)
+            index.add_with_ids(xb, ids)
+            built[key] = (index, time.perf_counter() - t0)
+        index, build_sec = built[key]
+        p = search_params(index, **params)
+        _, found = index.search(queries, K, params=p)
+        lat = query_latencies(index, queries, p)
+        rows.append((label, build_sec, recall_at_k(found, truth), lat, faiss.serialize_index(index).nbytes))
+
+    print(f"\n=== {n:,} vectors, dim={DIM}, recall@{K} vs flat ===")
+    print(f"{'backend':<22}{'build s':>9}{'recall':>8}{'p50 ms':>9}{'p99 ms':>9}{'memory MB':>11}")
+    for label, build_sec, recall, lat, nbytes in rows:
+        print(f"{label:<22}{build_sec:>9.1f}{recall:>8.3f}{np.percentile(lat, 50):>9.3f}"
+              f"{np.percentile(lat, 99):>9.3f}{nbytes / 1e6:>11.1f}")
+
+
+def main():
+    sizes = [int(a) for a in sys.argv[1:]] or [10_000, 100_000]
+    for n in sizes:
+        run(n)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compare the old per-chunk embedding loop with the batched engine.
+
+Run from the project root:
+    python -m benchmarks.bench_embed [n_chunks]
+"""
+import sys
+import time
+import numpy as np
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+from embed_index import load_chunks, embed_texts, INPUT_FILE, EMBED_MODEL
+
+
+def per_chunk_loop(texts, embed_model_name):
+    """Baseline: the original list-comprehension over get_text_embedding."""
+    embed_model = HuggingFaceEmbedding(model_name=embed_model_name)
+    t0 = time.perf_counter()
+    embeddings = [embed_model.get_text_embedding(t) for t in texts]
+    embeddings = np.array(embeddings).astype("float32")
+    return embeddings, time.perf_counter() - t0
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    texts = [c["text"] for c in load_chunks(INPUT_FILE)][:n]
+    print(f"Benchmarking {len(texts)} chunks with {EMBED_MODEL}\n")
+
+    baseline, base_sec = per_chunk_loop(texts, EMBED_MODEL)
+    rows = [("per-chunk loop", base_sec, 0.0)]
+
+    configs = [
+        ("batch=32", dict(batch_size=32)),
+        ("batch=64", dict(batch_size=64)),
+        ("batch=128", dict(batch_size=128)),
+        ("batch=64 threads=4", dict(batch_size=64, workers=4)),
+        ("batch=64 procs=2", dict(batch_size=64, workers=2, use_processes=True)),
+    ]
+    for name, kwargs in configs:
+        t0 = time.perf_counter()
+        vectors = embed_texts(texts, EMBED_MODEL, use_cache=False, **kwargs)
+        elapsed = time.perf_counter() - t0
+        max_diff = float(np.abs(vectors - baseline).max())
+        rows.append((name, elapsed, max_diff))
+
+    # Second pass through the on-disk cache (first fills it, second is all hits)
+    embed_texts(texts, EMBED_MODEL, batch_size=64)
+    t0 = time.perf_counter()
+    vectors = embed_texts(texts, EMBED_MODEL, batch_size=64)
+    rows.append(("batch=64 cached", time.perf_counter() - t0, float(np.abs(vectors - baseline).max())))
+
+    print(f"\n{'config':<22}{'sec':>8}{'chunks/sec':>12}{'speedup':>9}{'max|Δ|':>10}")
+    for name, sec, diff in rows:
+        print(f"{name:<22}{sec:>8.2f}{len(texts) / sec:>12.1f}{base_sec / sec:>8.2f}x{diff:>10.1e}")
+
+
+if __name__ == "__main__":
+    main()
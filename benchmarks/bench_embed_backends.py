@@ -0,0 +1,79 @@
+"""Embedding backends (torch / int8 / onnx): throughput, latency and agreement.
+
+Run from the project root:
+    python -m benchmarks.bench_embed_backends [n_chunks] [threads]   (default: 1000, library default)
+
+For each backend of embed_backends.py (uncached, CPU) reports:
+  vec/s        chunks embedded per second (batch=64)
+  p50 / p99    single-query embedding latency in ms
+  cos vs torch mean cosine between the backend's and the torch vector of each chunk
+  top-k overlap  queries sampled from the chunks, searched in a flat index of
+               the backend's own vectors, compared with the torch top-k
+  query-only   backend query vectors against the torch-built index (switching
+               the query side only, without re-indexing)
+"""
+import sys
+import time
+import faiss
+import numpy as np
+
+from benchmarks.bench_hybrid import make_queries
+from embed_backends import BACKENDS, make_embed_backend
+from embed_index import load_chunks, INPUT_FILE, EMBED_MODEL
+
+K = 10
+
+
+def embed(model, texts):
+    return np.asarray(model.get_text_embedding_batch(texts), dtype="float32")
+
+
+def top_k(corpus, queries):
+    index = faiss.IndexFlatIP(corpus.shape[1])
+    index.add(corpus)
+    return index.search(queries, K)[1]
+
+
+def overlap(a, b):
+    return np.mean([len(set(x) & set(y)) / K for x, y in zip(a, b)])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    texts = [c["text"] for c in load_chunks(INPUT_FILE)][:n]
+    queries = [q for q, _, _ in make_queries({i: {"text": t} for i, t in enumerate(texts)}, 100)]
+    print(f"{len(texts)} chunks, {len(queries)} queries, {EMBED_MODEL}, threads={threads or 'default'}\n")
+
+    ref = None
+    rows = []
+    for backend in BACKENDS:
+        try:
+            model = make_embed_backend(EMBED_MODEL, backend, embed_batch_size=64, threads=threads)
+        except ImportError as e:
+            print(f"{backend}: skipped ({e})")
+            continue
+        embed(model, texts[:8])   # warm-up (ONNX export / first-call overhead)
+        t0 = time.perf_counter()
+        corpus = embed(model, texts)
+        vps = len(texts) / (time.perf_counter() - t0)
+        lat = []
+        for q in queries:
+            t0 = time.perf_counter()
+            model.get_query_embedding(q)
+            lat.append((time.perf_counter() - t0) * 1000)
+        qvecs = embed(model, queries)
+        if ref is None:
+            ref = (corpus, qvecs, top_k(corpus, qvecs))
+        cos = float(np.mean(np.sum(corpus * ref[0], axis=1)))
+        rows.append((backend, vps, np.percentile(lat, 50), np.percentile(lat, 99), cos,
+                     overlap(top_k(corpus, qvecs), ref[2]), overlap(top_k(ref[0], qvecs), ref[2])))
+
+    print(f"{'backend':<8}{'vec/s':>9}{'p50 ms':>9}{'p99 ms':>9}{'cos vs torch':>14}"
+          f"{f'top-{K} overlap':>16}{'query-only':>12}")
+    for backend, vps, p50, p99, cos, agree, query_only in rows:
+        print(f"{backend:<8}{vps:>9.1f}{p50:>9.2f}{p99:>9.2f}{cos:>14.4f}{agree:>16.3f}{query_only:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
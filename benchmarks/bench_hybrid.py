@@ -0,0 +1,92 @@
+"""Dense-only vs BM25-only vs hybrid (RRF) retrieval on the built index.
+
+Run from the project root after embed_index.py / pipeline.py:
+    python -m benchmarks.bench_hybrid [n_queries]
+
+Queries are generated from the indexed chunks, so no labels are needed:
+  identifier  a short span around a token with digits, dots, underscores or
+              inner capitals (API names, figures) — where dense models struggle
+  phrase      a random 8-word span of prose
+A hit is the chunk the span was taken from. Reports recall@k, MRR and
+per-query latency (p50/p99, embedding excluded) for each retriever.
+"""
+import random
+import re
+import sys
+import time
+import numpy as np
+
+from embed_index import current_manifest, current_sparse_index, hybrid_search, search_vectors
+from query_cache import QueryCache
+from retriver import load_index, embed_model, INDEX_DIR
+
+K = 10
+IDENT_RE = re.compile(r"\w*(?:\d|[._]\w|[a-z][A-Z])\w*")
+
+
+def make_queries(metadata, n, seed=0):
+    """(query, vector id, kind) triples sampled from the indexed chunk texts."""
+    rng = random.Random(seed)
+    ids = list(metadata.keys())
+    out = {"identifier": [], "phrase": []}
+    for vid in rng.sample(ids, min(len(ids), 20 * n)):
+        words = metadata[vid]["text"].split()
+        if len(words) < 8:
+            continue
+        idents = [i for i, w in enumerate(words) if IDENT_RE.fullmatch(w.strip(".,;:()[]\"'")) and len(w) > 3]
+        if idents and len(out["identifier"]) < n:
+            i = rng.choice(idents)
+            out["identifier"].append((" ".join(words[max(0, i - 1):i + 2]), vid, "identifier"))
+        elif len(out["phrase"]) < n:
+            i = rng.randrange(0, len(words) - 7)
+            out["phrase"].append((" ".join(words[i:i + 8]), vid, "phrase"))
+        if all(len(v) >= n for v in out.values()):
+            break
+    return out["identifier"] + out["phrase"]
+
+
+def score(found, truth):
+    hits, rr = 0, 0.0
+    for ids, vid in zip(found, truth):
+        ids = list(ids)
+        if vid in ids:
+            hits += 1
+            rr += 1.0 / (ids.index(vid) + 1)
+    return hits / len(truth), rr / len(truth)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    index, metadata = load_index()
+    manifest = current_manifest(INDEX_DIR)
+    sparse = current_sparse_index(INDEX_DIR)
+    if sparse is None:
+        sys.exit(f"No BM25 index in {INDEX_DIR}/ — rebuild the index first")
+    queries = make_queries(metadata, n)
+    vectors = QueryCache().query_embeddings(embed_model, [q for q, _, _ in queries])
+    print(f"{len(metadata)} chunks, {len(queries)} queries\n")
+
+    retrievers = {
+        "dense": lambda i: search_vectors(index, vectors[i:i + 1], K, manifest)[1][0],
+        "bm25": lambda i: sparse.search(queries[i][0], K)[1],
+        "hybrid (rrf)": lambda i: hybrid_search(index, sparse, vectors[i:i + 1], [queries[i][0]], K, manifest)[1][0],
+    }
+    print(f"{'retriever':<14}{'kind':<12}{f'R@{K}':>7}{'MRR':>7}{'p50 ms':>9}{'p99 ms':>9}")
+    for name, run in retrievers.items():
+        found, lat = [], []
+        for i in range(len(queries)):
+            t0 = time.perf_counter()
+            found.append(run(i))
+            lat.append((time.perf_counter() - t0) * 1000)
+        for kind in ("identifier", "phrase"):
+            rows = [i for i, q in enumerate(queries) if q[2] == kind]
+            if not rows:
+                continue
+            recall, mrr = score([found[i] for i in rows], [queries[i][1] for i in rows])
+            kind_lat = np.array([lat[i] for i in rows])
+            print(f"{name:<14}{kind:<12}{recall:>7.3f}{mrr:>7.3f}"
+                  f"{np.percentile(kind_lat, 50):>9.2f}{np.percentile(kind_lat, 99):>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
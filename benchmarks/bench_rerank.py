@@ -0,0 +1,60 @@
+"""Accuracy gained and latency added by the cross-encoder rerank stage.
+
+Run from the project root after embed_index.py / pipeline.py:
+    python -m benchmarks.bench_rerank [n_queries] [budget_ms]   (default: 100, no budget)
+
+Uses the same self-labelled queries as bench_hybrid (a hit is the chunk the
+query span was taken from). Compares dense top-k against dense top-N
+followed by a rerank to top-k. Reports recall@k, MRR and per-query
+latency p50/p99 (embedding excluded). The model is warmed up first and the
+rerank cache starts empty, so that the latency reflects cold pair scoring.
+"""
+import sys
+import time
+import numpy as np
+
+from benchmarks.bench_hybrid import make_queries, score
+from embed_index import current_manifest, search_vectors
+from query_cache import QueryCache
+from reranker import CrossEncoderReranker, RERANK_CANDIDATES
+from retriver import load_index, embed_model, INDEX_DIR
+
+K = 5
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    budget_ms = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    index, metadata = load_index()
+    manifest = current_manifest(INDEX_DIR)
+    queries = make_queries(metadata, n)
+    vectors = QueryCache().query_embeddings(embed_model, [q for q, _, _ in queries])
+    reranker = CrossEncoderReranker()
+    reranker.warm_up()
+    print(f"{len(metadata)} chunks, {len(queries)} queries, {RERANK_CANDIDATES} candidates, "
+          f"budget={budget_ms} ms\n")
+
+    rows = {"dense": ([], []), f"dense@{RERANK_CANDIDATES} + rerank": ([], [])}
+    for i, (query, _, _) in enumerate(queries):
+        t0 = time.perf_counter()
+        _, ids = search_vectors(index, vectors[i:i + 1], K, manifest)
+        rows["dense"][0].append(ids[0])
+        rows["dense"][1].append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        _, ids = search_vectors(index, vectors[i:i + 1], RERANK_CANDIDATES, manifest)
+        candidates = [{"id": int(vid), "text": metadata[int(vid)]["text"]} for vid in ids[0] if vid != -1]
+        top = reranker.rerank(query, candidates, K, budget_ms=budget_ms)
+        rows[f"dense@{RERANK_CANDIDATES} + rerank"][0].append([c["id"] for c in top])
+        rows[f"dense@{RERANK_CANDIDATES} + rerank"][1].append((time.perf_counter() - t0) * 1000)
+
+    truth = [vid for _, vid, _ in queries]
+    print(f"{'retriever':<24}{f'R@{K}':>7}{'MRR':>7}{'p50 ms':>9}{'p99 ms':>9}")
+    for name, (found, lat) in rows.items():
+        recall, mrr = score(found, truth)
+        print(f"{name:<24}{recall:>7.3f}{mrr:>7.3f}{np.percentile(lat, 50):>9.2f}{np.percentile(lat, 99):>9.2f}")
+    print(f"\nrerank timeouts: {reranker.timeouts} / {reranker.requests - 1}")
+
+
+if __name__ == "__main__":
+    main()
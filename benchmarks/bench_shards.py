@@ -0,0 +1,82 @@
+"""Build time, latency and throughput of a sharded index versus shard count.
+
+Run from the project root:
+    python -m benchmarks.bench_shards [n_vectors] [index_type]   (default: 200000 hnsw)
+
+The corpus is split round-robin into 1, 2, 4 and 8 shards. Shards are built
+in parallel threads and searched with the same fan-out + heap merge as
+sharded_index.ShardedIndex. Reports build seconds, single-query p50/p99,
+batch QPS and recall@k against the single-shard result.
+"""
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import faiss
+import numpy as np
+
+from embed_index import make_index, train_index, search_params
+from sharded_index import merge_topk
+from benchmarks.bench_ann import synthetic_corpus, DIM, K
+
+SHARD_COUNTS = (1, 2, 4, 8)
+BATCH = 64
+
+
+def build_shards(xb, n_shards, index_type):
+    parts = [np.arange(s, len(xb), n_shards) for s in range(n_shards)]
+
+    def build(ids):
+        index = make_index(DIM, index_type, n_vectors=len(ids))
+        train_index(index, xb[ids])
+        index.add_with_ids(xb[ids], ids.astype("int64"))
+        return index
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_shards) as pool:
+        shards = list(pool.map(build, parts))
+    return shards, time.perf_counter() - t0
+
+
+def fan_out(pool, shards, queries, params):
+    futures = [pool.submit(s.search, queries, K, params=p) for s, p in zip(shards, params)]
+    hits = merge_topk([f.result() for f in futures], K, higher_is_better=False)
+    return np.array([[vid for _, _, vid in row] + [-1] * (K - len(row)) for row in hits])
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    index_type = sys.argv[2] if len(sys.argv) > 2 else "hnsw"
+    xb, queries = synthetic_corpus(n)
+    print(f"{n:,} vectors, dim={DIM}, {index_type}, {faiss.omp_get_max_threads()} OpenMP threads\n")
+
+    rows, baseline = [], None
+    for n_shards in SHARD_COUNTS:
+        shards, build_sec = build_shards(xb, n_shards, index_type)
+        params = [search_params(s, nprobe=16, ef_search=64) for s in shards]
+        with ThreadPoolExecutor(max_workers=n_shards) as pool:
+            found = fan_out(pool, shards, queries, params)
+            # Single-query latency: OpenMP off so the gain comes from the shard fan-out alone
+            threads = faiss.omp_get_max_threads()
+            faiss.omp_set_num_threads(1)
+            lat = []
+            for q in queries[:200]:
+                t0 = time.perf_counter()
+                fan_out(pool, shards, q[None, :], params)
+                lat.append((time.perf_counter() - t0) * 1000)
+            faiss.omp_set_num_threads(threads)
+            t0 = time.perf_counter()
+            for start in range(0, len(queries), BATCH):
+                fan_out(pool, shards, queries[start:start + BATCH], params)
+            qps = len(queries) / (time.perf_counter() - t0)
+        if baseline is None:
+            baseline = found
+        recall = np.mean([len(set(a) & set(b)) / K for a, b in zip(found, baseline)])
+        rows.append((n_shards, build_sec, np.percentile(lat, 50), np.percentile(lat, 99), qps, recall))
+
+    print(f"{'shards':>6}{'build s':>9}{'p50 ms':>9}{'p99 ms':>9}{'QPS':>9}{'recall vs 1':>13}")
+    for n_shards, build_sec, p50, p99, qps, recall in rows:
+        print(f"{n_shards:>6}{build_sec:>9.1f}{p50:>9.2f}{p99:>9.2f}{qps:>9.0f}{recall:>13.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Chunking speed and retrieval quality per splitting strategy.
+
+Run from the project root:
+    python -m benchmarks.bench_split [n_records]
+
+Quality is measured without labels: sentences sampled from the ingested
+records are used as queries, and a hit is a retrieved chunk of the same
+parent record that contains the sentence. Reports recall@k and MRR.
+"""
+import random
+import sys
+import time
+import numpy as np
+
+from embed_cache import load_embed_model
+from embed_index import make_index, prepare_vectors, search_vectors, EMBED_MODEL
+from splitter import load_docs, iter_chunks, split_sentences, count_tokens, INPUT_FILE
+
+K = 5
+N_QUERIES = 200
+
+CONFIGS = [
+    ("semantic", dict(strategy="semantic")),
+    ("semantic + pooled vectors", dict(strategy="semantic", reuse_vectors=True)),
+    ("sentence_window 256/64", dict(strategy="sentence_window", chunk_size=256, overlap=64)),
+    ("sentence_window 800/200", dict(strategy="sentence_window", chunk_size=800, overlap=200)),
+    ("structure 256/64", dict(strategy="structure", chunk_size=256, overlap=64)),
+    ("structure 800/200", dict(strategy="structure", chunk_size=800, overlap=200)),
+]
+
+
+def norm(text):
+    return " ".join(text.split())
+
+
+def sample_queries(docs, n, seed=0):
+    rng = random.Random(seed)
+    candidates = []
+    for rec in docs:
+        if rec.get("metadata", {}).get("type") == "table":
+            continue
+        parent = rec.get("id") or rec.get("metadata", {}).get("doc_id")
+        for sent in split_sentences(rec["text"]):
+            if 8 <= count_tokens(sent) <= 60:
+                candidates.append((norm(sent), parent))
+    return rng.sample(candidates, min(n, len(candidates)))
+
+
+def evaluate(chunks, vectors, queries, embed_model):
+    manifest = {"metric": "cosine", "normalized": True}
+    index = make_index(vectors.shape[1], "flat", metric="cosine")
+    index.add_with_ids(prepare_vectors(vectors, manifest), np.arange(len(chunks), dtype="int64"))
+    q_vecs = np.asarray(embed_model.get_text_embedding_batch([q for q, _ in queries]), dtype="float32")
+    _, I = search_vectors(index, q_vecs, K, manifest)
+    hits, rr = 0, 0.0
+    for (query, parent), ids in zip(queries, I):
+        for rank, idx in enumerate(ids):
+            ch = chunks[idx]
+            if ch.get("parent_id") == parent and query in norm(ch["text"]):
+                hits += 1
+                rr += 1.0 / (rank + 1)
+                break
+    return hits / len(queries), rr / len(queries)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    docs = load_docs(INPUT_FILE)[:n]
+    queries = sample_queries(docs, N_QUERIES)
+    embed_model = load_embed_model(EMBED_MODEL, embed_batch_size=64)
+    print(f"{len(docs)} records, {len(queries)} sampled queries\n")
+
+    rows = []
+    for label, opts in CONFIGS:
+        opts = dict(opts)
+        chunk_size = opts.pop("chunk_size", 800)
+        t0 = time.perf_counter()
+        chunks = list(iter_chunks(docs, chunk_size, embed_model=embed_model, **opts))
+        split_sec = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        missing = [c["text"] for c in chunks if "embedding" not in c]
+        fresh = iter(embed_model.get_text_embedding_batch(missing) if missing else [])
+        vectors = np.asarray([c["embedding"] if "embedding" in c else next(fresh) for c in chunks], dtype="float32")
+        embed_sec = time.perf_counter() - t0
+
+        recall, mrr = evaluate(chunks, vectors, queries, embed_model)
+        avg_tokens = np.mean([count_tokens(c["text"]) for c in chunks])
+        rows.append((label, len(chunks), avg_tokens, len(chunks) / max(split_sec, 1e-9), embed_sec, recall, mrr))
+
+    print(f"{'strategy':<28}{'chunks':>8}{'avg tok':>9}{'chunks/s':>10}{'embed s':>9}{f'R@{K}':>7}{'MRR':>7}")
+    for label, count, avg_tokens, cps, embed_sec, recall, mrr in rows:
+        print(f"{label:<28}{count:>8}{avg_tokens:>9.0f}{cps:>10.1f}{embed_sec:>9.1f}{recall:>7.3f}{mrr:>7.3f}")
+    print("\nNote: sentence embeddings go through the shared cache, so strategies run later "
+          "(and repeated runs) pay less for semantic splitting.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Cold-start cost: module import, first query and second query, in fresh processes.
+
+Run from the project root after embed_index.py / pipeline.py:
+    python -m benchmarks.bench_startup [runs] [query]   (default: 3 "what is this document about?")
+
+Each run starts a new interpreter and times:
+  import         import generator (+ retriver, as app.py / service.py do)
+  first query    search() right after import: loads model + index lazily
+  second query   the same search again (a different query, so the cache is not hit)
+  eager total    import + REGISTRY.warm_up(): roughly what importing cost when
+                 generator.py / retriver.py loaded the model and index at
+                 import time (each module loaded its own model copy, so the
+                 old cost was higher still by one model load per module)
+Median over runs, in seconds.
+"""
+import json
+import subprocess
+import sys
+import numpy as np
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+import generator, retriver
+from registry import REGISTRY
+t_import = time.perf_counter() - t0
+if sys.argv[2] == "eager":
+    REGISTRY.warm_up()
+    print(json.dumps({"eager total": time.perf_counter() - t0}))
+    sys.exit()
+t1 = time.perf_counter()
+generator.search(sys.argv[1], *generator.load_index(), REGISTRY.embed_model)
+t_first = time.perf_counter() - t1
+t2 = time.perf_counter()
+generator.search(sys.argv[1] + " again", *generator.load_index(), REGISTRY.embed_model)
+print(json.dumps({"import": t_import, "first query": t_first, "second query": time.perf_counter() - t2}))
+"""
+
+
+def run(query, mode):
+    out = subprocess.run([sys.executable, "-c", CHILD, query, mode], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    query = sys.argv[2] if len(sys.argv) > 2 else "what is this document about?"
+    results = [run(query, "lazy") | run(query, "eager") for _ in range(runs)]
+    print(f"{runs} runs, median seconds\n")
+    for name in ("import", "first query", "second query", "eager total"):
+        print(f"{name:<14}{np.median([r[name] for r in results]):>9.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,378 @@
+"""Offline retrieval evaluation and performance regression suite.
+
+Run from the project root (no network or API key needed: the LLM is the
+offline FakeStreamingBackend):
+    python -m benchmarks.eval_suite [--scales 4 16] [-k 10] [--mode dense]
+                                    [--out eval_report.json] [--save-baseline]
+
+Each corpus goes through the real pipeline in a scratch directory —
+ingest → chunk_all_docs → embed_texts → build_index_from_vectors — with the
+settings configured in splitter.py / embed_index.py, then is queried
+(generator.search_batch on a registry.open_index snapshot, query cache off)
+and answered:
+  bundled   the files in ingestion_input/, with the labeled queries of
+            benchmarks/eval_queries.jsonl (a hit is a chunk of the labeled
+            source that contains the answer span)
+  synth_xN  every bundled record written N times as Markdown, each copy with
+            a different 10% of its words replaced; queries are 8-word spans
+            sampled from the indexed chunks
+Reported per corpus: records/chunks/vectors per second for ingestion,
+splitting and embedding, index build seconds and size, peak RSS, query
+p50/p99 and batch QPS, recall@k / MRR, and answer latency with the stub LLM.
+Each corpus runs in its own (spawned) process, so peak RSS is that corpus's
+alone rather than the high-water mark of every corpus before it.
+
+The report (JSON) is compared with BASELINE_FILE: a metric worse than the
+baseline by more than its tolerance (TOLERANCES) is listed as a regression
+and the exit status is 1. --save-baseline stores the current report as the
+new baseline; re-baseline on the machine that runs the comparison, since
+timings are only comparable on the same hardware. A run that finds no
+baseline saves its report as one (its settings are in "config") and exits
+with status 2, so a missing baseline is never mistaken for a passing check.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+import faiss
+import numpy as np
+
+import telemetry
+from embed_cache import load_embed_model
+from embed_index import (EMBED_BATCH_SIZE, EMBED_MODEL, INDEX_OPTS, INDEX_TYPE, METRIC, build_index_from_vectors,
+                         embed_texts)
+from generator import search_batch, stream_answer
+from index_stats import storage_stats
+from ingest import URL_MAP, ingest
+from llm_backends import FakeStreamingBackend
+from registry import open_index
+from splitter import (OTHER_CHUNK_SIZE, PDF_CHUNK_SIZE, PDF_OVERLAP, STRATEGY, chunk_all_docs, count_tokens,
+                      load_docs)
+
+CORPUS_DIR = "ingestion_input"
+LABELED_QUERIES = "benchmarks/eval_queries.jsonl"
+BASELINE_FILE = "benchmarks/eval_baseline.json"
+NO_BASELINE_EXIT = 2      # exit status of a run that found no baseline (and saved itself as one)
+SCALES = (4, 16)          # synthetic corpora: bundled records × N
+SYNTH_QUERIES = 200
+PERTURB = 0.1             # share of words replaced in each synthetic copy
+BATCH = 64                # queries per search call for the QPS figure
+ANSWER_QUERIES = 50       # queries answered through stream_answer with the stub LLM
+
+# Metric name suffix → (higher is better, relative tolerance, absolute tolerance).
+# A metric regresses when it is worse than the baseline by more than both.
+TOLERANCES = [
+    ("recall", True, 0.0, 0.02),
+    ("mrr", True, 0.0, 0.02),
+    ("_per_sec", True, 0.25, 0.0),
+    ("qps", True, 0.25, 0.0),
+    ("_ms", False, 0.25, 1.0),
+    ("_sec", False, 0.25, 0.5),
+    ("_mb", False, 0.10, 5.0),
+]
+
+
+def norm(text):
+    return " ".join(text.split()).lower()
+
+
+def peak_rss_mb():
+    """High-water RSS of this process (it never goes down: see run_corpus_isolated)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / (1024 if sys.platform == "darwin" else 1)   # bytes on macOS, KiB on Linux
+
+
+def percentiles(latencies):
+    return float(np.percentile(latencies, 50)), float(np.percentile(latencies, 99))
+
+
+# ---------- Corpora ----------
+def load_labeled_queries(path=LABELED_QUERIES):
+    """(query, source file, answer span) triples."""
+    with open(path, "r", encoding="utf-8") as f:
+        return [(q["query"], q["source"], q["answer"]) for q in map(json.loads, f) if q]
+
+
+def write_synthetic_corpus(records, scale, out_dir, seed=0):
+    """One Markdown file per (source, copy); each copy has a different PERTURB share of words replaced."""
+    rng = random.Random(seed)
+    by_source = {}
+    for rec in records:
+        by_source.setdefault(rec["source"], []).append(rec["text"])
+    vocab = sorted({w for texts in by_source.values() for t in texts for w in t.split() if w.isalpha()})
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    for copy in range(scale):
+        for n, (source, texts) in enumerate(sorted(by_source.items())):
+            paragraphs = []
+            for text in texts:
+                words = [rng.choice(vocab) if rng.random() < PERTURB else w for w in text.split()]
+                paragraphs.append(" ".join(words))
+            Path(out_dir, f"{copy:03d}_{n:02d}_{Path(source).stem}.md").write_text(
+                "\n\n".join(paragraphs), encoding="utf-8")
+
+
+def sample_span_queries(metadata, n, seed=0):
+    """(span, source, span) triples: 8 consecutive words of a random indexed chunk."""
+    rng = random.Random(seed)
+    ids = list(metadata.keys())
+    out = []
+    for vid in rng.sample(ids, min(len(ids), 4 * n)):
+        meta = metadata[vid]
+        words = meta["text"].split()
+        if len(words) < 16 or meta.get("strategy") == "table_whole":
+            continue
+        i = rng.randrange(0, len(words) - 8)
+        span = " ".join(words[i:i + 8])
+        out.append((span, meta["source"], span))
+        if len(out) >= n:
+            break
+    return out
+
+
+# ---------- Evaluation ----------
+def score(found, queries):
+    """recall@k and MRR: a hit is a result from the query's source that contains its answer span."""
+    hits, rr = 0, 0.0
+    for rows, (_, source, answer) in zip(found, queries):
+        answer = norm(answer)
+        sources = {source, URL_MAP.get(source)}   # results carry the source URL when there is one
+        for rank, hit in enumerate(rows, start=1):
+            if hit.get("source") in sources and answer in norm(hit["text"]):
+                hits += 1
+                rr += 1.0 / rank
+                break
+    return hits / len(queries), rr / len(queries)
+
+
+def searcher(snapshot, embed_model, args):
+    """search(queries) -> result lists, through generator.search_batch with the query cache off."""
+    def search(queries):
+        return search_batch(queries, snapshot, snapshot.metadata, embed_model, args.k, args.nprobe, args.ef_search,
+                            cache=None, mode=args.mode)
+    return search
+
+
+def evaluate_queries(search, queries, k):
+    texts = [q for q, _, _ in queries]
+    found, lat = [], []
+    for text in texts:
+        t0 = time.perf_counter()
+        found.append(search([text])[0])
+        lat.append((time.perf_counter() - t0) * 1000)
+    t0 = time.perf_counter()
+    for start in range(0, len(texts), BATCH):
+        search(texts[start:start + BATCH])
+    qps = len(texts) / (time.perf_counter() - t0)
+
+    recall, mrr = score(found, queries)
+    p50, p99 = percentiles(lat)
+    return {f"recall@{k}": recall, "mrr": mrr, "query_p50_ms": p50, "query_p99_ms": p99, "batch_qps": qps}
+
+
+def evaluate_answers(search, queries):
+    """End-to-end answer latency (search + prompt packing + stub LLM stream)."""
+    backend = FakeStreamingBackend(first_token_delay=0.0, token_delay=0.0)
+    total, ttft = [], []
+    for query, _, _ in queries[:ANSWER_QUERIES]:
+        t0 = time.perf_counter()
+        hits = search([query])[0]
+        search_sec = time.perf_counter() - t0
+        timings = {}
+        for _ in stream_answer(query, hits, backend=backend, cache=None, timings=timings):
+            pass
+        total.append((time.perf_counter() - t0) * 1000)
+        ttft.append((search_sec + timings["ttft_sec"]) * 1000)
+    p50, p99 = percentiles(total)
+    return {"answer_p50_ms": p50, "answer_p99_ms": p99, "answer_ttft_p50_ms": percentiles(ttft)[0]}
+
+
+def run_corpus(data_dir, work_dir, embed_model, args, queries=None):
+    """Build an index from data_dir and evaluate it; queries=None samples span queries from the index."""
+    telemetry.METRICS.clear()
+    docs_file = f"{work_dir}/docs.jsonl"
+    index_dir = f"{work_dir}/index"
+    out = {"files": sum(1 for p in Path(data_dir).iterdir() if p.is_file())}
+
+    t0 = time.perf_counter()
+    ingest(data_dir, docs_file, workers=1)
+    ingest_sec = time.perf_counter() - t0
+    docs = load_docs(docs_file)
+
+    t0 = time.perf_counter()
+    chunks = chunk_all_docs(docs, OTHER_CHUNK_SIZE, strategy=STRATEGY, pdf_chunk_size=PDF_CHUNK_SIZE,
+                            pdf_overlap=PDF_OVERLAP, embed_model=embed_model)
+    chunk_sec = time.perf_counter() - t0
+
+    texts = [c["text"] for c in chunks]
+    t0 = time.perf_counter()
+    vectors = embed_texts(texts, EMBED_MODEL, batch_size=EMBED_BATCH_SIZE, use_cache=False)
+    embed_sec = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    build_index_from_vectors(chunks, vectors, EMBED_MODEL, index_dir, INDEX_TYPE, METRIC, **INDEX_OPTS)
+    build_sec = time.perf_counter() - t0
+    size = storage_stats(index_dir)
+
+    snapshot = open_index(index_dir)
+    search = searcher(snapshot, embed_model, args)
+    if queries is None:
+        queries = sample_span_queries(snapshot.metadata, args.queries)
+    tokens = sum(count_tokens(t) for t in texts)
+    out.update(
+        records=len(docs),
+        chunks=len(chunks),
+        queries=len(queries),
+        ingest_files_per_sec=out["files"] / ingest_sec,
+        ingest_records_per_sec=len(docs) / ingest_sec,
+        chunk_records_per_sec=len(docs) / chunk_sec,
+        chunk_tokens_per_sec=tokens / chunk_sec,
+        embed_chunks_per_sec=len(chunks) / embed_sec,
+        index_build_sec=build_sec,
+        index_mb=sum(size[c] for c in ("vectors", "rescore", "metadata", "text", "bm25")) / 2 ** 20,
+        index_vectors_mb=size["vectors"] / 2 ** 20,
+    )
+    out.update(evaluate_queries(search, queries, args.k))
+    out.update(evaluate_answers(search, queries))
+    out["peak_rss_mb"] = peak_rss_mb()
+    out["telemetry"] = telemetry.METRICS.snapshot()["histograms"]   # per-stage p50/p95/p99, not compared
+    return out
+
+
+def _corpus_process(data_dir, work_dir, args, queries):
+    # One uncached model for splitting and queries, so reruns measure the model, not the embedding cache
+    embed_model = load_embed_model(EMBED_MODEL, embed_batch_size=EMBED_BATCH_SIZE, cache_path=None)
+    return run_corpus(data_dir, work_dir, embed_model, args, queries)
+
+
+def run_corpus_isolated(data_dir, work_dir, args, queries=None):
+    """run_corpus in a fresh spawned process, so its peak_rss_mb covers this corpus only."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(_corpus_process, data_dir, work_dir, args, queries).result()
+
+
+# ---------- Baseline comparison ----------
+def tolerance(metric):
+    for suffix, higher_is_better, rel, abs_ in TOLERANCES:
+        if metric.startswith(suffix) or metric.endswith(suffix):
+            return higher_is_better, rel, abs_
+    return None   # counts and other informational fields
+
+
+def compare(report, baseline):
+    """Rows (corpus, metric, baseline, current, status) for every metric both reports have."""
+    rows = []
+    for corpus, metrics in report["corpora"].items():
+        base = baseline.get("corpora", {}).get(corpus)
+        if base is None:
+            continue
+        for metric, value in metrics.items():
+            spec = tolerance(metric)
+            if spec is None or not isinstance(base.get(metric), (int, float)):
+                continue
+            higher_is_better, rel, abs_ = spec
+            old = base[metric]
+            worse = old - value if higher_is_better else value - old
+            status = "REGRESSION" if worse > max(rel * abs(old), abs_) else "ok"
+            if status == "ok" and -worse > max(rel * abs(old), abs_):
+                status = "improved"
+            rows.append((corpus, metric, old, value, status))
+    return rows
+
+
+def print_comparison(rows):
+    print(f"\n{'corpus':<12}{'metric':<26}{'baseline':>12}{'current':>12}{'change':>9}  status")
+    for corpus, metric, old, new, status in rows:
+        change = f"{(new - old) / abs(old) * 100:+.0f}%" if old else "n/a"
+        print(f"{corpus:<12}{metric:<26}{old:>12.3f}{new:>12.3f}{change:>9}  {status}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval evaluation and performance regression suite.")
+    parser.add_argument("--scales", type=int, nargs="*", default=list(SCALES),
+                        help="synthetic corpus sizes as multiples of the bundled corpus (none to skip)")
+    parser.add_argument("--queries", type=int, default=SYNTH_QUERIES, help="sampled queries per synthetic corpus")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--mode", default="dense", choices=["dense", "hybrid"])
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--out", default="eval_report.json")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the report to --baseline")
+    parser.add_argument("--keep", default=None, metavar="DIR", help="build in DIR and keep it (default: a temp dir)")
+    args = parser.parse_args()
+
+    report = {
+        "config": {
+            "strategy": STRATEGY, "chunk_size": OTHER_CHUNK_SIZE, "pdf_chunk_size": PDF_CHUNK_SIZE,
+            "pdf_overlap": PDF_OVERLAP, "embed_model": EMBED_MODEL, "index_type": INDEX_TYPE, "metric": METRIC,
+            "index_opts": INDEX_OPTS, "k": args.k, "mode": args.mode, "nprobe": args.nprobe,
+            "ef_search": args.ef_search,
+        },
+        "env": {
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "faiss": faiss.__version__, "faiss_threads": faiss.omp_get_max_threads(),
+        },
+        "corpora": {},
+    }
+    work = args.keep or tempfile.mkdtemp(prefix="rag_eval_")
+    try:
+        report["corpora"]["bundled"] = run_corpus_isolated(CORPUS_DIR, f"{work}/bundled", args,
+                                                           load_labeled_queries())
+        records = load_docs(f"{work}/bundled/docs.jsonl")
+        for scale in args.scales:
+            name = f"synth_x{scale}"
+            write_synthetic_corpus(records, scale, f"{work}/{name}/input")
+            report["corpora"][name] = run_corpus_isolated(f"{work}/{name}/input", f"{work}/{name}", args)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n{'corpus':<12}{'chunks':>8}{f'R@{args.k}':>8}{'MRR':>7}{'p50 ms':>9}{'p99 ms':>9}{'QPS':>8}"
+          f"{'embed/s':>9}{'build s':>9}{'RSS MB':>8}")
+    for name, m in report["corpora"].items():
+        print(f"{name:<12}{m['chunks']:>8}{m[f'recall@{args.k}']:>8.3f}{m['mrr']:>7.3f}{m['query_p50_ms']:>9.2f}"
+              f"{m['query_p99_ms']:>9.2f}{m['batch_qps']:>8.0f}{m['embed_chunks_per_sec']:>9.0f}"
+              f"{m['index_build_sec']:>9.1f}{m['peak_rss_mb']:>8.0f}")
+    print(f"\nReport written to {args.out}")
+
+    if args.save_baseline:
+        shutil.copyfile(args.out, args.baseline)
+        print(f"Saved as baseline {args.baseline}")
+        return
+    if not Path(args.baseline).exists():
+        # Nothing to compare with: this run becomes the baseline, and the exit status says so
+        Path(args.baseline).parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(args.out, args.baseline)
+        settings = ", ".join(f"{key}={value!r}" for key, value in report["config"].items())
+        print(f"\nNo baseline at {args.baseline}: this report was saved as the baseline ({settings}).")
+        print(f"⚠️ Nothing was compared: commit {args.baseline} and re-run after a change to check for "
+              f"regressions", file=sys.stderr)
+        sys.exit(NO_BASELINE_EXIT)
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != report["config"]:
+        print("Note: the baseline was produced with different settings:")
+        for key, value in report["config"].items():
+            if baseline.get("config", {}).get(key) != value:
+                print(f"  {key}: {baseline.get('config', {}).get(key)!r} -> {value!r}")
+    rows = compare(report, baseline)
+    print_comparison(rows)
+    regressions = [r for r in rows if r[4] == "REGRESSION"]
+    if regressions:
+        sys.exit(f"\n❌ {len(regressions)} metrics regressed against {args.baseline}")
+    print(f"\n✅ No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
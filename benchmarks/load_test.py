@@ -0,0 +1,100 @@
+"""Closed-loop load test for service.py: QPS and latency percentiles.
+
+Start the service first (RAG_LLM_BACKEND=fake keeps /answer offline), then:
+    python -m benchmarks.load_test [--endpoint search] [--concurrency 32] [--requests 2000]
+                                   [--queries queries.jsonl] [--url http://127.0.0.1:8000]
+
+Each of `concurrency` clients sends its next request as soon as the previous
+one returns. Queries come from a JSONL file ("query" field per line) or a
+small built-in list. Repeated queries are served by the query cache, so
+use a large query file for uncached numbers. Run against different
+MAX_BATCH_SIZE / MAX_WAIT_MS settings to see the effect of micro-batching.
+"""
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+
+DEFAULT_QUERIES = [
+    "How do I install the package?",
+    "What file formats are supported?",
+    "How are documents split into chunks?",
+    "Which embedding model is used?",
+    "How is the FAISS index built?",
+    "How do I configure the API key?",
+    "What does the retriever return?",
+    "How are citations generated?",
+]
+
+
+def load_queries(path):
+    if not path:
+        return DEFAULT_QUERIES
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line)["query"] for line in f if line.strip()]
+
+
+def run(url, endpoint, queries, concurrency, n_requests, k):
+    session_local = threading.local()
+    counter = iter(range(n_requests))
+    lock = threading.Lock()
+    latencies, errors = [], 0
+
+    def client():
+        nonlocal errors
+        session = getattr(session_local, "s", None) or requests.Session()
+        session_local.s = session
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            payload = {"query": queries[i % len(queries)], "k": k}
+            t0 = time.perf_counter()
+            try:
+                resp = session.post(f"{url}/{endpoint}", json=payload, timeout=60)
+                ok = resp.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = (time.perf_counter() - t0) * 1000
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(client)
+    wall = time.perf_counter() - t0
+    return np.array(latencies), errors, wall
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", default="search", choices=["search", "answer"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--queries", default=None)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    queries = load_queries(args.queries)
+    lat, errors, wall = run(args.url, args.endpoint, queries, args.concurrency, args.requests, args.k)
+    print(f"/{args.endpoint}: {len(lat)} ok, {errors} errors, concurrency={args.concurrency}")
+    if len(lat):
+        print(f"QPS {len(lat) / wall:.1f}   p50 {np.percentile(lat, 50):.1f} ms   "
+              f"p99 {np.percentile(lat, 99):.1f} ms   max {lat.max():.1f} ms")
+    try:
+        print("server:", requests.get(f"{args.url}/stats", timeout=5).json()["batcher"])
+    except (requests.RequestException, KeyError, ValueError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import json
+import time
+from itertools import islice
+
+from retriver import search_batch
+from registry import REGISTRY
+
+
+def read_queries(path):
+    """Stream {"query": ..., ...} objects from a JSONL file (a bare string line is a query too)."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            yield item if isinstance(item, dict) else {"query": item}
+
+
+def bulk_search(in_file, out_file, k=5, batch_size=256, nprobe=None, ef_search=None, mode="dense",
+                report_every=10):
+    """Search every query of in_file and write one JSONL line per query to out_file.
+
+    Queries are read and written in batches of batch_size (one embedding call
+    and one FAISS call each), so memory does not grow with the file. Other
+    fields of the input lines (ids, labels) are copied to the output.
+    """
+    snapshot = REGISTRY.snapshot()
+    queries = read_queries(in_file)
+    n = 0
+    t0 = time.perf_counter()
+    with open(out_file, "w", encoding="utf-8") as out:
+        for n_batch, batch in enumerate(iter(lambda: list(islice(queries, batch_size)), []), start=1):
+            results = search_batch([item["query"] for item in batch], snapshot, snapshot.metadata,
+                                   REGISTRY.embed_model, k=k, nprobe=nprobe, ef_search=ef_search, cache=None,
+                                   mode=mode)
+            for item, hits in zip(batch, results):
+                out.write(json.dumps({**item, "results": hits}, ensure_ascii=False) + "\n")
+            n += len(batch)
+            if n_batch % report_every == 0:
+                elapsed = time.perf_counter() - t0
+                print(f"  {n} queries, {n / elapsed:.1f} queries/sec")
+    elapsed = time.perf_counter() - t0
+    print(f"✅ {n} queries searched in {elapsed:.1f}s ({n / max(elapsed, 1e-9):.1f} queries/sec) → {out_file}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many queries against the index (JSONL in, JSONL out).")
+    parser.add_argument("input", help='JSONL file with one {"query": ...} per line')
+    parser.add_argument("output", help="JSONL file to write results to")
+    parser.add_argument("-k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=256)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    parser.add_argument("--mode", choices=["dense", "hybrid"], default="dense")
+    args = parser.parse_args()
+    bulk_search(args.input, args.output, args.k, args.batch_size, args.nprobe, args.ef_search, args.mode)
@@ -0,0 +1,179 @@
+import re
+
+# Token estimate shared with the splitter (splitter.py imports it from here, so
+# the query path does not load the ingestion stack)
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Fixed configuration
+CONTEXT_TOKEN_BUDGET = 3000   # tokens of context snippets per prompt (None = no limit)
+DEDUP_THRESHOLD = 0.8         # word-shingle Jaccard (or containment) above which a chunk is a duplicate
+SHINGLE_SIZE = 5              # words per shingle
+TABLE_MAX_TOKENS = 400        # a table longer than this keeps its header + the most relevant rows
+MIN_SNIPPET_TOKENS = 50       # don't add a cut-down last snippet shorter than this
+
+
+def count_tokens(text):
+    """Cheap token estimate (words + punctuation), close to a WordPiece count for English."""
+    return len(TOKEN_RE.findall(text))
+
+
+def is_table(chunk):
+    return chunk.get("strategy") == "table_whole" or chunk.get("type") == "table"
+
+
+def shingles(text, size=SHINGLE_SIZE):
+    words = text.lower().split()
+    if len(words) <= size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def is_duplicate(a, b, threshold=DEDUP_THRESHOLD):
+    """Near-identical shingle sets, or one chunk (almost) contained in the other."""
+    if not a or not b:
+        return False
+    common = len(a & b)
+    return common / len(a | b) >= threshold or common / min(len(a), len(b)) >= threshold
+
+
+def join_overlapping(first, second):
+    """Concatenate two consecutive chunks, dropping the words the second repeats from the first."""
+    a, b = first.split(), second.split()
+    if not a or not b:
+        return f"{first} {second}".strip()
+    for i in range(max(0, len(a) - len(b)), len(a)):
+        if a[i] == b[0] and a[i:] == b[:len(a) - i]:
+            return " ".join(a + b[len(a) - i:])
+    return f"{first} {second}"
+
+
+def truncate_table(text, query, max_tokens=TABLE_MAX_TOKENS):
+    """Header row + the rows sharing most words with the query, in table order, within max_tokens."""
+    lines = [line for line in text.splitlines() if line.strip()]
+    if count_tokens(text) <= max_tokens or len(lines) < 2:
+        return text, False
+    header, rows = lines[0], lines[1:]
+    terms = {t.lower() for t in TOKEN_RE.findall(query) if t.isalnum()}
+    relevance = [len(terms & {t.lower() for t in TOKEN_RE.findall(row)}) for row in rows]
+    # Most relevant rows first; ties keep the leading rows of the table
+    order = sorted(range(len(rows)), key=lambda i: (-relevance[i], i))
+    used = count_tokens(header) + count_tokens(f"... ({len(rows)} of {len(rows)} rows omitted)")
+    keep = []
+    for i in order:
+        cost = count_tokens(rows[i])
+        if used + cost > max_tokens:
+            break
+        keep.append(i)
+        used += cost
+    kept = [rows[i] for i in sorted(keep)]
+    note = f"... ({len(rows) - len(kept)} of {len(rows)} rows omitted)"
+    return "\n".join([header, *kept, note]), True
+
+
+def cut_to_tokens(text, max_tokens):
+    """Leading words of text that fit in max_tokens, ending in "..."."""
+    out, used = [], count_tokens("...")
+    for word in text.split():
+        used += count_tokens(word)
+        if used > max_tokens:
+            break
+        out.append(word)
+    return " ".join(out) + " ..."
+
+
+def merge_adjacent(chunks):
+    """Merge chunks of the same parent with consecutive chunk_ids into one block.
+
+    A block takes the place (and fields) of its best-ranked member; its
+    text follows document order. Returns (blocks, number of chunks merged away).
+    """
+    by_parent = {}
+    for pos, ch in enumerate(chunks):
+        if ch.get("parent_id") is not None and ch.get("chunk_id") is not None and not is_table(ch):
+            by_parent.setdefault(ch["parent_id"], []).append(pos)
+    absorbed = {}   # position → position of the block it joins
+    texts = {}
+    for positions in by_parent.values():
+        positions.sort(key=lambda p: chunks[p]["chunk_id"])
+        run = [positions[0]]
+        for p in positions[1:] + [None]:
+            if p is not None and chunks[p]["chunk_id"] == chunks[run[-1]]["chunk_id"] + 1:
+                run.append(p)
+                continue
+            if len(run) > 1:
+                head = min(run)
+                text = chunks[run[0]]["text"]
+                for q in run[1:]:
+                    text = join_overlapping(text, chunks[q]["text"])
+                texts[head] = (text, [chunks[q]["chunk_id"] for q in run])
+                absorbed.update({q: head for q in run if q != head})
+            run = [p]
+
+    blocks = []
+    for pos, ch in enumerate(chunks):
+        if pos in absorbed:
+            continue
+        if pos in texts:
+            text, chunk_ids = texts[pos]
+            ch = {**ch, "text": text, "chunk_ids": chunk_ids}
+        blocks.append(ch)
+    return blocks, len(absorbed)
+
+
+def pack_context(query, chunks, token_budget=CONTEXT_TOKEN_BUDGET, report=None):
+    """Chunks to put in the prompt: merged, deduplicated, tables trimmed, within token_budget.
+
+    chunks are search() results in rank order. Adjacent chunks of one
+    parent are merged first (so their overlap is not sent twice), then
+    near-duplicates of a better-ranked block are dropped, long tables are
+    cut to their most query-relevant rows, and blocks are added in rank
+    order until the budget is spent. If `report` is a dict it receives the
+    token counts before/after, tokens_saved and what each step removed.
+    """
+    tokens_in = sum(count_tokens(ch["text"]) for ch in chunks)
+    blocks, merged = merge_adjacent(chunks)
+
+    kept, seen, duplicates = [], [], 0
+    for block in blocks:
+        sh = shingles(block["text"])
+        if any(is_duplicate(sh, other) for other in seen):
+            duplicates += 1
+            continue
+        seen.append(sh)
+        kept.append(block)
+
+    packed, used, tables_truncated, cut = [], 0, 0, 0
+    for block in kept:
+        remaining = token_budget - used if token_budget is not None else None
+        if is_table(block):
+            limit = TABLE_MAX_TOKENS if remaining is None else min(TABLE_MAX_TOKENS, remaining)
+            text, truncated = truncate_table(block["text"], query, limit)
+            if truncated:
+                tables_truncated += 1
+                block = {**block, "text": text, "truncated": True}
+        tokens = count_tokens(block["text"])
+        if remaining is not None and tokens > remaining:
+            if remaining < MIN_SNIPPET_TOKENS:
+                break
+            block = {**block, "text": cut_to_tokens(block["text"], remaining), "truncated": True}
+            tokens = count_tokens(block["text"])
+            cut += 1
+        packed.append(block)
+        used += tokens
+        if token_budget is not None and used >= token_budget:
+            break
+
+    if report is not None:
+        report.update(
+            tokens_in=tokens_in,
+            tokens_out=used,
+            tokens_saved=tokens_in - used,
+            chunks_in=len(chunks),
+            chunks_out=len(packed),
+            merged=merged,
+            duplicates=duplicates,
+            tables_truncated=tables_truncated,
+            cut=cut,
+            dropped=len(kept) - len(packed),
+        )
+    return packed
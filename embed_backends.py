@@ -0,0 +1,90 @@
+from typing import List
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+# Embedding backends. Each is a LlamaIndex BaseEmbedding, so anything that
+# takes an embed_model (splitter, indexer, search, the on-disk cache) works
+# with all of them:
+#   torch  full-precision PyTorch (HuggingFaceEmbedding), the reference
+#   int8   the same model with its Linear layers dynamically quantized to int8
+#   onnx   the model exported to ONNX and run by ONNX Runtime
+# int8 / onnx vectors differ slightly from torch, so their model_name (and
+# with it the embedding-cache key) carries the backend: "<model>#int8".
+# Check top-k agreement with benchmarks/bench_embed_backends.py before switching.
+
+# Fixed configuration
+EMBED_BACKEND = "torch"   # torch | int8 | onnx
+EMBED_THREADS = None      # intra-op CPU threads per process (None = library default)
+BACKENDS = ("torch", "int8", "onnx")
+
+
+def set_torch_threads(threads):
+    if threads:
+        import torch
+        torch.set_num_threads(threads)
+
+
+class SentenceTransformerEmbedding(BaseEmbedding):
+    """sentence-transformers model on CPU, int8-quantized or on ONNX Runtime.
+
+    Vectors are L2-normalized like HuggingFaceEmbedding's, so indexes built
+    with one backend can be searched with another.
+    """
+
+    _model = PrivateAttr()
+
+    def __init__(self, model_name: str, backend: str = "int8", embed_batch_size: int = 10, threads=None,
+                 **kwargs):
+        super().__init__(model_name=f"{model_name}#{backend}", embed_batch_size=embed_batch_size, **kwargs)
+        from sentence_transformers import SentenceTransformer
+        if backend == "onnx":
+            # Needs sentence-transformers >= 3.2 with optimum[onnxruntime]; exported on first load
+            import onnxruntime
+            options = onnxruntime.SessionOptions()
+            if threads:
+                options.intra_op_num_threads = threads
+            self._model = SentenceTransformer(model_name, device="cpu", backend="onnx",
+                                              model_kwargs={"session_options": options})
+        elif backend == "int8":
+            import torch
+            set_torch_threads(threads)
+            model = SentenceTransformer(model_name, device="cpu")
+            self._model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        else:
+            raise ValueError(f"Unknown backend {backend!r} (expected int8 or onnx)")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "SentenceTransformerEmbedding"
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        vectors = self._model.encode(texts, batch_size=self.embed_batch_size, normalize_embeddings=True,
+                                     convert_to_numpy=True, show_progress_bar=False)
+        return vectors.tolist()
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(texts)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._encode([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+def make_embed_backend(model_name, backend=EMBED_BACKEND, embed_batch_size=10, threads=EMBED_THREADS):
+    """Uncached embedding model for `backend` (see BACKENDS)."""
+    if backend == "torch":
+        # Imported here: pulls in torch/transformers, which importing this module should not
+        from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+        set_torch_threads(threads)
+        return HuggingFaceEmbedding(model_name=model_name, embed_batch_size=embed_batch_size)
+    if backend in BACKENDS:
+        return SentenceTransformerEmbedding(model_name, backend, embed_batch_size, threads)
+    raise ValueError(f"Unknown embedding backend {backend!r} (expected one of {', '.join(BACKENDS)})")
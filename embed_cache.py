@@ -0,0 +1,195 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+from embed_backends import EMBED_BACKEND, EMBED_THREADS, make_embed_backend
+
+# Fixed configuration
+EMBED_CACHE_FILE = "emb_cache/embeddings.sqlite"
+EMBED_CACHE_MAX_BYTES = 512 * 1024 * 1024   # size cap for stored vectors (LRU eviction above it)
+
+
+# ---------- On-disk store ----------
+class EmbeddingCache:
+    """Content-addressed embedding store: sha256(model + text) → float32 vector.
+
+    Vectors live in a single SQLite file so every pipeline stage (and every
+    worker process) shares them. Each read refreshes the entry's last_used
+    time; when the stored vectors exceed max_bytes the least recently used
+    entries are evicted. The byte total is kept in a one-row table updated
+    in the same transaction as every insert and eviction, so it is exact
+    across processes without summing the whole table on each write.
+    """
+
+    def __init__(self, path=EMBED_CACHE_FILE, max_bytes=EMBED_CACHE_MAX_BYTES):
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY, vector BLOB NOT NULL,"
+            " nbytes INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON embeddings(last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), nbytes INTEGER NOT NULL)"
+        )
+        # Caches created before cache_size existed are summed once
+        self._conn.execute(
+            "INSERT OR IGNORE INTO cache_size VALUES (0, (SELECT COALESCE(SUM(nbytes), 0) FROM embeddings))"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the cache."""
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLite caps the number of bound parameters, so look up in slices
+            for start in range(0, len(unique), 500):
+                part = unique[start:start + 500]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({marks})", part
+                ).fetchall()
+                for k, blob in rows:
+                    found[k] = np.frombuffer(blob, dtype="float32")
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self._conn.commit()
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += sum(1 for k in keys if k not in found)
+        return found
+
+    def put_many(self, keys, vectors):
+        now = time.time()
+        rows = []
+        for k, vec in zip(keys, vectors):
+            blob = np.asarray(vec, dtype="float32").tobytes()
+            rows.append((k, blob, len(blob), now))
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")   # replaced sizes and the total stay consistent across processes
+            try:
+                replaced = 0
+                unique = list({k: None for k, _, _, _ in rows})
+                for start in range(0, len(unique), 500):
+                    part = unique[start:start + 500]
+                    marks = ",".join("?" * len(part))
+                    replaced += self._conn.execute(
+                        f"SELECT COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({marks})", part
+                    ).fetchone()[0]
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, nbytes, last_used) VALUES (?, ?, ?, ?)", rows
+                )
+                added = sum({k: nbytes for k, _, nbytes, _ in rows}.values())
+                self._conn.execute("UPDATE cache_size SET nbytes = nbytes + ? WHERE id = 0", (added - replaced,))
+                self._evict()
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+    def _evict(self):
+        total = self._conn.execute("SELECT nbytes FROM cache_size WHERE id = 0").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        victims = []
+        freed = 0
+        for k, nbytes in self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_used"):
+            victims.append((k,))
+            freed += nbytes
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._conn.execute("UPDATE cache_size SET nbytes = nbytes - ? WHERE id = 0", (freed,))
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self._conn.execute("SELECT nbytes FROM cache_size WHERE id = 0").fetchone()[0]
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "entries": count,
+            "bytes": total,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+
+# ---------- LlamaIndex wrapper ----------
+class CachedEmbedding(BaseEmbedding):
+    """Drop-in BaseEmbedding that only calls the wrapped model on cache misses."""
+
+    _inner: BaseEmbedding = PrivateAttr()
+    _cache: EmbeddingCache = PrivateAttr()
+
+    def __init__(self, inner: BaseEmbedding, cache: EmbeddingCache, **kwargs):
+        super().__init__(model_name=inner.model_name, embed_batch_size=inner.embed_batch_size, **kwargs)
+        self._inner = inner
+        self._cache = cache
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "CachedEmbedding"
+
+    @property
+    def cache(self) -> EmbeddingCache:
+        return self._cache
+
+    def _cached(self, texts: List[str], kind: str, compute) -> List[List[float]]:
+        keys = [self._cache.key(f"{self.model_name}:{kind}", t) for t in texts]
+        found = self._cache.get_many(keys)
+        missing = {}
+        for k, t in zip(keys, texts):
+            if k not in found and k not in missing:
+                missing[k] = t
+        if missing:
+            vectors = compute(list(missing.values()))
+            self._cache.put_many(list(missing), vectors)
+            for k, vec in zip(missing, vectors):
+                found[k] = np.asarray(vec, dtype="float32")
+        return [found[k].tolist() for k in keys]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._cached(texts, "text", self._inner.get_text_embedding_batch)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._cached([query], "query", lambda qs: [self._inner.get_query_embedding(q) for q in qs])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    async def _aget_text_embedding(self, text: str) -> List[float]:
+        return self._get_text_embedding(text)
+
+
+def load_embed_model(model_name, embed_batch_size=10, cache_path=EMBED_CACHE_FILE,
+                     max_bytes=EMBED_CACHE_MAX_BYTES, backend=EMBED_BACKEND, threads=EMBED_THREADS):
+    """Embedding model (see embed_backends.py for the backends) backed by the shared on-disk cache."""
+    inner = make_embed_backend(model_name, backend, embed_batch_size, threads)
+    if not cache_path:
+        return inner
+    return CachedEmbedding(inner, EmbeddingCache(cache_path, max_bytes))
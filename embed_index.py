@@ -1,9 +1,17 @@
 import json
-import pickle
+import os
+import hashlib
+import shutil
+import zlib
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
 from pathlib import Path
 import faiss
 import numpy as np
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+import telemetry
+from telemetry import print_summary, span, traced
+from metadata_store import MetadataWriter, write_metadata_store, load_metadata, filter_bitmap
+from sparse_index import build_sparse_index, load_sparse_index, reciprocal_rank_fusion, update_sparse_index
 
 
 def load_chunks(jsonl_file):
@@ -15,59 +23,919 @@ def load_chunks(jsonl_file):
     return chunks
 
 
-def build_faiss_index(chunks, embed_model_name, out_dir):
-    """Create FAISS index + metadata.pkl (keeps source_url)."""
-    Path(out_dir).mkdir(parents=True, exist_ok=True)
+# ---------- Batched embedding engine ----------
+# embed_cache / embed_backends import llama_index, so they are imported on first
+# use: the search path (generator, registry, sharded_index) imports this module
+# without loading the embedding stack.
+def load_embed_model(*args, **kwargs):
+    """embed_cache.load_embed_model, imported on first call."""
+    from embed_cache import load_embed_model
+    return load_embed_model(*args, **kwargs)
+
+
+def embed_backend():
+    """The configured embedding backend (embed_backends.EMBED_BACKEND)."""
+    from embed_backends import EMBED_BACKEND
+    return EMBED_BACKEND
+
+
+# Model held by each process-pool worker (set by _init_worker)
+_worker_model = None
+
+
+def _init_worker(embed_model_name, batch_size, cache_opts):
+    """Load one embedding model per worker process."""
+    global _worker_model
+    _worker_model = load_embed_model(embed_model_name, embed_batch_size=batch_size, **cache_opts)
+
+
+def _embed_batch_in_worker(batch):
+    return _worker_model.get_text_embedding_batch(batch)
+
+
+def embed_texts(texts, embed_model_name, batch_size=64, workers=1, use_processes=False, out_file=None,
+                use_cache=True):
+    """Embed texts in batches straight into a preallocated float32 array.
+
+    With workers > 1 batches run on a thread pool (one shared model) or, with
+    use_processes=True, on a process pool (one model per worker). If out_file
+    is given the vectors are written to a memory-mapped .npy file instead of RAM.
+    With use_cache, texts already in the shared embedding cache are not re-encoded.
+    """
+    n = len(texts)
+    cache_opts = {} if use_cache else {"cache_path": None}   # default: embed_cache.EMBED_CACHE_FILE
+    batches = [(start, texts[start:start + batch_size]) for start in range(0, n, batch_size)]
+    out = None
+
+    def store(start, vectors):
+        nonlocal out
+        vectors = np.asarray(vectors, dtype="float32")
+        if out is None:
+            shape = (n, vectors.shape[1])
+            if out_file:
+                Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+                out = np.lib.format.open_memmap(out_file, mode="w+", dtype="float32", shape=shape)
+            else:
+                out = np.empty(shape, dtype="float32")
+        out[start:start + len(vectors)] = vectors
+
+    t0 = time.perf_counter()
+    with span("embed", chunks=n, workers=workers):
+        if workers > 1 and use_processes:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                     initargs=(embed_model_name, batch_size, cache_opts)) as pool:
+                futures = {pool.submit(_embed_batch_in_worker, batch): start for start, batch in batches}
+                for fut in as_completed(futures):
+                    store(futures[fut], fut.result())
+        else:
+            embed_model = load_embed_model(embed_model_name, embed_batch_size=batch_size, **cache_opts)
+            if workers > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    futures = {pool.submit(embed_model.get_text_embedding_batch, batch): start
+                               for start, batch in batches}
+                    for fut in as_completed(futures):
+                        store(futures[fut], fut.result())
+            else:
+                for start, batch in batches:
+                    store(start, embed_model.get_text_embedding_batch(batch))
+    elapsed = time.perf_counter() - t0
+    telemetry.METRICS.inc("chunks_embedded", n)
+
+    if out is None:
+        out = np.empty((0, 0), dtype="float32")
+    if out_file:
+        out.flush()
+    print(f"⚡ Embedded {n} chunks in {elapsed:.1f}s ({n / max(elapsed, 1e-9):.1f} chunks/sec)")
+    return out
+
+
+# ---------- Index backends ----------
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+METRICS = ("cosine", "l2")
+STORAGE_TYPES = ("float32", "fp16", "sq8", "pq")
+SCALAR_QUANTIZERS = {"fp16": faiss.ScalarQuantizer.QT_fp16, "sq8": faiss.ScalarQuantizer.QT_8bit}
+FULL_VECTORS_FILE = "vectors.f32"   # float32 copy of compressed vectors, for re-scoring
+RESCORE_FACTOR = 4                  # compressed indexes fetch k * RESCORE_FACTOR candidates
+
+
+def default_nlist(n_vectors):
+    """~4·sqrt(n) inverted lists, but keep >= 39 training points per list."""
+    return int(max(1, min(4 * np.sqrt(n_vectors), n_vectors // 39)))
+
+
+def make_index(dim, index_type="flat", n_vectors=0, metric="l2", nlist=None, pq_m=None, pq_nbits=8,
+               hnsw_m=32, storage="float32"):
+    """Create an (untrained) ID-mapped FAISS index of the requested type.
+
+    flat      exact brute-force scan
+    ivf_flat  inverted lists over raw vectors (tune nprobe at query time)
+    ivf_pq    inverted lists over product-quantized codes (tune nprobe)
+    hnsw      graph index (tune efSearch); does not support removing vectors
+
+    storage sets how flat / ivf_flat / hnsw keep the vectors: float32 (4
+    bytes per dimension), fp16 (2), sq8 (8-bit scalar quantization, 1) or
+    pq (pq_m bytes per vector). ivf_pq always stores PQ codes, so only
+    float32 (the default) and pq are accepted with it. Compressed indexes are re-scored at full
+    precision from a float32 side file (see search_vectors).
+
+    metric="cosine" builds an inner-product index; the vectors added to it
+    must be L2-normalized (see prepare_vectors).
+    """
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric: {metric} (expected one of {METRICS})")
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown storage: {storage} (expected one of {STORAGE_TYPES})")
+    if index_type == "ivf_pq" and storage not in ("float32", "pq"):
+        raise ValueError(f"storage={storage} is not supported with ivf_pq, which always stores PQ codes "
+                         f"(use ivf_flat with storage={storage} instead)")
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "cosine" else faiss.METRIC_L2
+    qtype = SCALAR_QUANTIZERS.get(storage)
+    pq_m = pq_m or max(1, dim // 8)
+    # Fewer bits per code when there is too little data to train 256 centroids
+    pq_nbits = min(pq_nbits, max(1, int(np.log2(max(n_vectors // 39, 2)))))
+    if index_type == "flat":
+        if qtype is not None:
+            base = faiss.IndexScalarQuantizer(dim, qtype, faiss_metric)
+        elif storage == "pq":
+            base = faiss.IndexPQ(dim, pq_m, pq_nbits, faiss_metric)
+        else:
+            base = faiss.IndexFlatIP(dim) if metric == "cosine" else faiss.IndexFlatL2(dim)
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = nlist or default_nlist(n_vectors)
+        quantizer = faiss.IndexFlatIP(dim) if metric == "cosine" else faiss.IndexFlatL2(dim)
+        if index_type == "ivf_pq" or storage == "pq":
+            base = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, pq_nbits, faiss_metric)
+        elif qtype is not None:
+            base = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, faiss_metric)
+        else:
+            base = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss_metric)
+    elif index_type == "hnsw":
+        if qtype is not None:
+            base = faiss.IndexHNSWSQ(dim, qtype, hnsw_m, faiss_metric)
+        elif storage == "pq":
+            base = faiss.IndexHNSWPQ(dim, pq_m, hnsw_m, pq_nbits, faiss_metric)
+        else:
+            base = faiss.IndexHNSWFlat(dim, hnsw_m, faiss_metric)
+    else:
+        raise ValueError(f"Unknown index type: {index_type} (expected one of {INDEX_TYPES})")
+    return faiss.IndexIDMap2(base)
+
+
+def train_index(index, embeddings, sample_size=100_000, seed=0):
+    """Train IVF/PQ indexes on a random sample of the vectors (no-op otherwise)."""
+    if index.is_trained:
+        return
+    if len(embeddings) > sample_size:
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(embeddings[np.sort(rng.choice(len(embeddings), sample_size, replace=False))])
+    else:
+        sample = np.asarray(embeddings)
+    index.train(sample)
+
+
+def search_params(index, nprobe=None, ef_search=None, sel=None):
+    """Per-query FAISS search parameters (thread-safe, unlike mutating the index).
+
+    sel is an optional IDSelector over external ids; IndexIDMap2 translates it.
+    """
+    base = faiss.downcast_index(index.index) if hasattr(index, "id_map") else faiss.downcast_index(index)
+    if isinstance(base, faiss.IndexIVF):
+        if nprobe or sel is not None:
+            return faiss.SearchParametersIVF(nprobe=nprobe or base.nprobe, sel=sel)
+        return None
+    if isinstance(base, faiss.IndexHNSW):
+        if ef_search or sel is not None:
+            return faiss.SearchParametersHNSW(efSearch=ef_search or base.hnsw.efSearch, sel=sel)
+        return None
+    return faiss.SearchParameters(sel=sel) if sel is not None else None
+
+
+def filter_selector(metadata, filters):
+    """IDSelector admitting only vectors whose metadata match normalized `filters`.
+
+    Backed by the store's cached per-filter bitmap, so building it is O(1)
+    after the first query with the same filters and membership is one bit test.
+    """
+    bitmap = filter_bitmap(metadata, filters)
+    sel = faiss.IDSelectorBitmap(len(bitmap) * 8, faiss.swig_ptr(bitmap))
+    sel.referenced_objects = [bitmap]  # keep the buffer alive as long as the selector
+    return sel
+
+
+def prepare_vectors(vectors, manifest):
+    """float32 copy of vectors, L2-normalized when the index stores normalized vectors."""
+    vectors = np.array(vectors, dtype="float32", copy=True)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    if manifest.get("normalized"):
+        faiss.normalize_L2(vectors)
+    return vectors
+
+
+def is_compressed(index_type, index_opts):
+    """Whether the index keeps lossy codes (and therefore a float32 side file for re-scoring)."""
+    return index_type == "ivf_pq" or index_opts.get("storage", "float32") != "float32"
+
+
+def write_full_vectors(gen_dir, vectors, start_id=0):
+    """Store prepared float32 vectors as rows start_id.. of <gen_dir>/vectors.f32 (row = vector id).
+
+    start_id=0 rewrites the file; otherwise rows are appended, zero-padded
+    up to start_id for ids that were never stored.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    path = Path(gen_dir) / FULL_VECTORS_FILE
+    if start_id == 0:
+        vectors.tofile(path)
+        return
+    row_bytes = vectors.shape[1] * 4
+    with open(path, "ab") as f:
+        rows = f.tell() // row_bytes
+        if rows < start_id:
+            f.write(bytes((start_id - rows) * row_bytes))
+        f.seek(start_id * row_bytes)
+        f.truncate()
+        f.write(vectors.tobytes())
+
+
+def carry_full_vectors(src_dir, gen_dir):
+    """Start gen_dir's side file from src_dir's, so an update only appends its new rows.
+
+    A hard link avoids copying: rows of committed ids are never rewritten,
+    and readers of the older generation never read past their own next_id.
+    """
+    src, dst = Path(src_dir) / FULL_VECTORS_FILE, Path(gen_dir) / FULL_VECTORS_FILE
+    if not src.exists():
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def load_full_vectors(data_dir, dim):
+    """Memory-mapped (n, dim) float32 side file in data_dir, or None if there is none."""
+    path = Path(data_dir) / FULL_VECTORS_FILE
+    if not path.exists() or path.stat().st_size == 0:
+        return None
+    return np.memmap(path, dtype="float32", mode="r").reshape(-1, dim)
+
+
+_full_vectors_cache = {}
+
+
+def current_full_vectors(index_dir, manifest):
+    """Re-scoring vectors of index_dir (None for uncompressed indexes), reopened when the index is saved."""
+    if not is_compressed(manifest.get("index_type", "flat"), manifest.get("index_opts", {})):
+        return None
+    version = index_version(index_dir)
+    cached = _full_vectors_cache.get(str(index_dir))
+    if cached is None or cached[0] != version:
+        cached = (version, load_full_vectors(data_dir(index_dir, manifest), manifest["dim"]))
+        _full_vectors_cache[str(index_dir)] = cached
+    return cached[1]
+
+
+def rescore(full_vectors, queries, I, k, metric):
+    """Exact (D, I) top-k of the candidate ids I, scored against their float32 vectors.
+
+    Only the candidate rows of the memory-mapped side file are read.
+    """
+    D_out = np.full((len(queries), k), -np.inf if metric == "cosine" else np.inf, dtype="float32")
+    I_out = np.full((len(queries), k), -1, dtype="int64")
+    for row, (q, ids) in enumerate(zip(queries, I)):
+        ids = np.sort(ids[(ids >= 0) & (ids < len(full_vectors))])   # sorted: sequential reads of the mmap
+        if not len(ids):
+            continue
+        cand = np.asarray(full_vectors[ids])
+        if metric == "cosine":
+            scores = cand @ q
+            order = np.argsort(-scores, kind="stable")[:k]
+        else:
+            scores = ((cand - q) ** 2).sum(axis=1)
+            order = np.argsort(scores, kind="stable")[:k]
+        D_out[row, :len(order)] = scores[order]
+        I_out[row, :len(order)] = ids[order]
+    return D_out, I_out
+
+
+def search_vectors(index, query_vectors, k, manifest, nprobe=None, ef_search=None, sel=None, full_vectors=None):
+    """Search the index with raw query embeddings, following its manifest.
+
+    Returns FAISS (D, I). For metric "cosine" D holds cosine similarities
+    (higher is better); for "l2" squared L2 distances (lower is better).
+    sel (see filter_selector) restricts the search to matching vectors.
+    With full_vectors (current_full_vectors of a compressed index) the index
+    returns k * RESCORE_FACTOR candidates, which are re-ranked with their
+    float32 vectors, so scores and order match an uncompressed index.
+    """
+    queries = prepare_vectors(query_vectors, manifest)
+    params = search_params(index, nprobe, ef_search, sel)
+    if full_vectors is None:
+        return index.search(queries, k, params=params)
+    _, I = index.search(queries, k * RESCORE_FACTOR, params=params)
+    return rescore(full_vectors, queries, I, k, manifest["metric"])
+
+
+_HYBRID_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="bm25")
+
+
+def hybrid_depth(k):
+    """Candidates each side (dense, BM25) contributes to reciprocal-rank fusion."""
+    return max(4 * k, 50)
+
+
+def hybrid_search(index, sparse, query_vectors, query_texts, k, manifest, nprobe=None, ef_search=None,
+                  depth=None, rrf_k=60, sel=None, row_mask=None, full_vectors=None):
+    """Dense + BM25 retrieval fused with reciprocal-rank fusion.
+
+    The BM25 side runs in a background thread while FAISS searches on the
+    calling thread (both release the GIL for their heavy parts). Each side
+    contributes its top `depth` (default hybrid_depth(k)) ids. Returns (D, I)
+    shaped like search_vectors, with fused RRF scores in D (higher is better)
+    and -1 padding. sel / row_mask restrict the dense / BM25 side to the
+    rows matching a filter. full_vectors re-scores the dense side (see search_vectors).
+    """
+    depth = depth or hybrid_depth(k)
+    lexical = _HYBRID_POOL.submit(sparse.search_many, query_texts, depth, row_mask)
+    _, dense_ids = search_vectors(index, query_vectors, depth, manifest, nprobe=nprobe, ef_search=ef_search,
+                                  sel=sel, full_vectors=full_vectors)
+    D = np.zeros((len(query_texts), k), dtype="float32")
+    I = np.full((len(query_texts), k), -1, dtype="int64")
+    for row, (dense, (_, sparse_ids)) in enumerate(zip(dense_ids, lexical.result())):
+        scores, ids = reciprocal_rank_fusion([dense, sparse_ids], k, rrf_k)
+        D[row, :len(ids)] = scores
+        I[row, :len(ids)] = ids
+    return D, I
+
+
+def metadata_entry(ch):
+    """Metadata kept per vector (idx → chunk info, with correct source_url)."""
+    entry = {
+        "text": ch["text"],
+        "source": ch.get("source"),           # local path or filename
+        "source_url": ch.get("source_url"),   # ✅ actual link
+        "title": ch.get("title"),
+        "page": ch.get("page"),
+        "paragraph_id": ch.get("paragraph_id"),
+        "chunk_id": ch.get("chunk_id"),
+        "strategy": ch.get("strategy"),
+        "parent_id": ch.get("parent_id"),
+        "text_hash": chunk_text_hash(ch),
+    }
+    # Add table metadata if present
+    if ch.get("strategy") == "table_whole":
+        entry["type"] = ch.get("type")
+        entry["table_index"] = ch.get("table_index")
+        entry["section"] = ch.get("section")
+        entry["pages"] = ch.get("pages")
+    return entry
+
+
+# ---------- Fingerprints + manifests ----------
+# manifest.json   index-level settings read at query time (model, metric, backend)
+#                 and the generation directory holding the files of the index
+# doc_state.json  per-document fingerprint + vector ids (only used for updates)
+def chunk_text_hash(ch):
+    return ch.get("text_hash") or hashlib.sha1(ch["text"].encode("utf-8")).hexdigest()
+
+
+def doc_key(ch):
+    """Source document a chunk belongs to."""
+    return ch.get("source") or ch.get("file_name") or ch.get("parent_id") or ""
+
+
+def group_docs(chunks):
+    """Group chunks by source document and fingerprint each document.
+
+    The fingerprint is the source file hash from ingest.py; chunks without one
+    fall back to a hash over their chunk text hashes.
+    """
+    docs = {}
+    for ch in chunks:
+        docs.setdefault(doc_key(ch), []).append(ch)
+    fingerprints = {}
+    for key, doc_chunks in docs.items():
+        file_hash = doc_chunks[0].get("file_hash")
+        if not file_hash:
+            joined = "".join(chunk_text_hash(ch) for ch in doc_chunks)
+            file_hash = hashlib.sha1(joined.encode("utf-8")).hexdigest()
+        fingerprints[key] = file_hash
+    return docs, fingerprints
 
-    # Init embedder
-    embed_model = HuggingFaceEmbedding(model_name=embed_model_name)
+
+# Indexes written before manifests existed: unnormalized vectors in IndexFlatL2
+LEGACY_MANIFEST = {"metric": "l2", "normalized": False, "index_type": "flat"}
+
+
+def load_manifest(out_dir):
+    path = Path(out_dir) / "manifest.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+_manifest_cache = {}
+
+
+def current_manifest(index_dir):
+    """manifest.json of index_dir, re-read only when the file changes on disk."""
+    path = Path(index_dir) / "manifest.json"
+    try:
+        mtime = path.stat().st_mtime_ns
+    except FileNotFoundError:
+        return LEGACY_MANIFEST
+    cached = _manifest_cache.get(str(path))
+    if cached is None or cached[0] != mtime:
+        cached = (mtime, load_manifest(index_dir))
+        _manifest_cache[str(path)] = cached
+    return cached[1]
+
+
+# Each save writes faiss.index, meta/, bm25/, vectors.f32 and doc_state.json
+# into a fresh <index_dir>/gen-<n>/ and then commits it by naming it in
+# manifest.json, which is replaced atomically. Readers resolve the manifest
+# once and open everything from that directory, so they never pair files of
+# two different saves, and nothing they might still be opening is deleted
+# until the save after next.
+GENERATION_PREFIX = "gen-"
+
+
+def new_generation(out_dir):
+    """Create an empty, not yet committed generation directory in out_dir."""
+    path = Path(out_dir) / f"{GENERATION_PREFIX}{time.time_ns()}"
+    path.mkdir(parents=True)
+    return path
+
+
+def data_dir(index_dir, manifest):
+    """Directory holding the files of the committed index (index_dir itself for pre-generation indexes)."""
+    generation = (manifest or {}).get("generation")
+    return Path(index_dir) / generation if generation else Path(index_dir)
+
+
+# Files of indexes saved before generations, superseded once a generation is committed
+LEGACY_FILES = ("faiss.index", "doc_state.json", "metadata.pkl", FULL_VECTORS_FILE, "meta", "meta.tmp", "bm25",
+                "bm25.tmp")
+
+
+def prune_generations(out_dir, keep, previous):
+    """Remove generations other than `keep` (the committed one and its predecessor).
+
+    Legacy top-level files go once the predecessor is itself a generation,
+    i.e. no reader can still be opening them.
+    """
+    for path in Path(out_dir).glob(f"{GENERATION_PREFIX}*"):
+        if path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+    if previous and previous.get("generation"):
+        for name in LEGACY_FILES:
+            path = Path(out_dir) / name
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+
+
+def index_version(index_dir):
+    """Changes whenever the index is saved (manifest.json / shards.json are always written last)."""
+    for name in (SHARDS_FILE, "manifest.json", "faiss.index"):
+        try:
+            return (Path(index_dir) / name).stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+    return 0
+
+
+_sparse_cache = {}
+
+
+def current_sparse_index(index_dir):
+    """BM25 index of index_dir (None if absent), reopened only when the index is saved again."""
+    version = index_version(index_dir)
+    cached = _sparse_cache.get(str(index_dir))
+    if cached is None or cached[0] != version:
+        cached = (version, load_sparse_index(data_dir(index_dir, current_manifest(index_dir))))
+        _sparse_cache[str(index_dir)] = cached
+    return cached[1]
+
+
+def load_doc_state(out_dir):
+    path = data_dir(out_dir, load_manifest(out_dir)) / "doc_state.json"
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def make_manifest(embed_model_name, dim, metric, index_type, index_opts, next_id):
+    return {
+        "embed_model": embed_model_name,
+        "embed_backend": embed_backend(),   # vectors from different backends differ slightly
+        "dim": dim,
+        "metric": metric,
+        "normalized": metric == "cosine",
+        "index_type": index_type,
+        "index_opts": index_opts,
+        "next_id": next_id,
+    }
+
+
+def save_index(index, metadata, manifest, doc_state, out_dir, gen_dir=None, sparse_base=None):
+    """Persist FAISS index, metadata store, doc_state.json and manifest.json as a new generation."""
+    with span("index.save", vectors=index.ntotal):
+        gen_dir = gen_dir or new_generation(out_dir)
+        write_metadata_store(metadata, gen_dir)
+        save_index_files(index, manifest, doc_state, out_dir, gen_dir, sparse_base)
+
+
+def save_index_files(index, manifest, doc_state, out_dir, gen_dir, sparse_base=None):
+    """Finish generation gen_dir (its metadata store is already written) and commit it.
+
+    The BM25 index for hybrid search is built from the metadata store here,
+    or, with sparse_base (the generation an incremental update started
+    from), derived from that one's postings for the added and removed
+    documents only. Nothing in out_dir changes for readers until
+    manifest.json is replaced.
+    """
+    gen_dir = Path(gen_dir)
+    faiss.write_index(index, str(gen_dir / "faiss.index"))
+    with span("index.bm25", incremental=sparse_base is not None):
+        if sparse_base is not None:
+            update_sparse_index(sparse_base, gen_dir)
+        else:
+            build_sparse_index(gen_dir)
+    with open(gen_dir / "doc_state.json", "w", encoding="utf-8") as f:
+        json.dump(doc_state, f)
+    previous = load_manifest(out_dir)
+    manifest["generation"] = gen_dir.name
+    Path(out_dir, SHARDS_FILE).unlink(missing_ok=True)  # a monolithic build replaces a sharded one
+    # Written last and renamed into place: readers treat the manifest as the index's commit marker
+    with open(f"{out_dir}/manifest.json.tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(f"{out_dir}/manifest.json.tmp", f"{out_dir}/manifest.json")
+    prune_generations(out_dir, {gen_dir.name, (previous or {}).get("generation")}, previous)
+
+
+@traced("index")
+def build_faiss_index(chunks, embed_model_name, out_dir, batch_size=64, workers=1,
+                      use_processes=False, mmap_embeddings=False, index_type="flat", metric="cosine",
+                      **index_opts):
+    """Create FAISS index + columnar metadata store (keeps source_url).
+
+    index_type selects the backend (see make_index); index_opts are passed on
+    to make_index (nlist, pq_m, pq_nbits, hnsw_m). With metric="cosine" the
+    vectors are normalized and stored in an inner-product index.
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
 
     # Compute embeddings
     texts = [c["text"] for c in chunks]
-    embeddings = [embed_model.get_text_embedding(t) for t in texts]
-    embeddings = np.array(embeddings).astype("float32")
+    embeddings = embed_texts(
+        texts,
+        embed_model_name,
+        batch_size=batch_size,
+        workers=workers,
+        use_processes=use_processes,
+        out_file=f"{out_dir}/embeddings.npy" if mmap_embeddings else None,
+    )
+
+    build_index_from_vectors(chunks, embeddings, embed_model_name, out_dir, index_type, metric, **index_opts)
 
-    # Build FAISS index
+
+def build_index_from_vectors(chunks, embeddings, embed_model_name, out_dir, index_type="flat", metric="cosine",
+                             **index_opts):
+    """Second half of build_faiss_index: index already-computed embeddings and save everything."""
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    # Build FAISS index (ID-mapped so vectors can later be removed per document)
     dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    print(f"✅ FAISS index built with {index.ntotal} vectors, dim={dim}")
+    if metric == "cosine":
+        faiss.normalize_L2(embeddings)  # in place, also works on the memmap
+    with span("index.build", index_type=index_type, vectors=len(chunks)):
+        index = make_index(dim, index_type, n_vectors=len(chunks), metric=metric, **index_opts)
+        train_index(index, embeddings)
+        index.add_with_ids(embeddings, np.arange(len(chunks), dtype="int64"))
+    gen_dir = new_generation(out_dir)
+    if is_compressed(index_type, index_opts):
+        write_full_vectors(gen_dir, embeddings)
+    print(f"✅ FAISS index ({index_type}, {metric}) built with {index.ntotal} vectors, dim={dim}")
 
-    # Save FAISS index
-    faiss.write_index(index, f"{out_dir}/faiss.index")
+    metadata = {i: metadata_entry(ch) for i, ch in enumerate(chunks)}
 
-    # Save metadata (idx → chunk info, with correct source_url)
-    metadata = {}
+    docs, fingerprints = group_docs(chunks)
+    ids_by_doc = {}
     for i, ch in enumerate(chunks):
-        entry = {
-            "text": ch["text"],
-            "source": ch.get("source"),           # local path or filename
-            "source_url": ch.get("source_url"),   # ✅ actual link
-            "title": ch.get("title"),
-            "page": ch.get("page"),
-            "paragraph_id": ch.get("paragraph_id"),
-            "chunk_id": ch.get("chunk_id"),
-            "strategy": ch.get("strategy"),
-            "parent_id": ch.get("parent_id"),
-        }
-        # Add table metadata if present
-        if ch.get("strategy") == "table_whole":
-            entry["type"] = ch.get("type")
-            entry["table_index"] = ch.get("table_index")
-            entry["section"] = ch.get("section")
-            entry["pages"] = ch.get("pages")
-        metadata[i] = entry
-
-    with open(f"{out_dir}/metadata.pkl", "wb") as f:
-        pickle.dump(metadata, f)
+        ids_by_doc.setdefault(doc_key(ch), []).append(i)
+    manifest = make_manifest(embed_model_name, dim, metric, index_type, index_opts, len(chunks))
+    doc_state = {key: {"hash": fingerprints[key], "ids": ids_by_doc[key]} for key in docs}
 
+    save_index(index, metadata, manifest, doc_state, out_dir, gen_dir)
     print(f"✅ Saved FAISS index + metadata to '{out_dir}'")
 
 
+# ---------- Sharding ----------
+SHARDS_FILE = "shards.json"
+
+
+def shard_of(key, n_shards):
+    """Stable shard number of a document key (all chunks of a document share a shard)."""
+    return zlib.crc32(key.encode("utf-8")) % n_shards
+
+
+def build_sharded_index(chunks, embed_model_name, out_dir, n_shards=4, batch_size=64, workers=1,
+                        use_processes=False, incremental=False, index_type="flat", metric="cosine",
+                        **index_opts):
+    """Split the corpus by document into n_shards regular index dirs (out_dir/shard_NNN).
+
+    A full build embeds everything once and then builds the shards in
+    parallel threads (FAISS training and adds release the GIL). With
+    incremental=True each shard is synced with update_faiss_index instead,
+    since a document always maps to the same shard. shards.json, written
+    last, lists the shards; sharded_index.load_sharded_index reads it.
+    """
+    parts = [[] for _ in range(n_shards)]
+    for ch in chunks:
+        parts[shard_of(doc_key(ch), n_shards)].append(ch)
+    names = [f"shard_{i:03d}" for i in range(n_shards) if parts[i]]
+    parts = [p for p in parts if p]
+    dirs = [str(Path(out_dir) / name) for name in names]
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    t0 = time.perf_counter()
+    if incremental:
+        for part, shard_dir in zip(parts, dirs):
+            update_faiss_index(part, embed_model_name, shard_dir, batch_size=batch_size, workers=workers,
+                               use_processes=use_processes, index_type=index_type, metric=metric, **index_opts)
+    else:
+        ordered = [ch for part in parts for ch in part]
+        embeddings = embed_texts([c["text"] for c in ordered], embed_model_name, batch_size=batch_size,
+                                 workers=workers, use_processes=use_processes)
+        bounds = np.cumsum([0] + [len(p) for p in parts])
+        with ThreadPoolExecutor(max_workers=len(parts)) as pool:
+            futures = [pool.submit(build_index_from_vectors, part, embeddings[bounds[i]:bounds[i + 1]],
+                                   embed_model_name, dirs[i], index_type, metric, **index_opts)
+                       for i, part in enumerate(parts)]
+            for fut in futures:
+                fut.result()
+
+    # Written last and renamed into place: readers treat shards.json as the sharded index's commit marker
+    layout = Path(out_dir) / SHARDS_FILE
+    with open(f"{layout}.tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "n_shards": n_shards,
+            "shards": names,
+            "sizes": [len(p) for p in parts],
+            "partition": "crc32(doc_key) % n_shards",
+            "embed_model": embed_model_name,
+            "embed_backend": embed_backend(),
+            "metric": metric,
+            "index_type": index_type,
+        }, f, indent=2)
+    os.replace(f"{layout}.tmp", layout)
+    # Shards of an earlier layout (e.g. with more shards), removed only once nothing new refers to them
+    for stale in Path(out_dir).glob("shard_*"):
+        if stale.name not in names:
+            shutil.rmtree(stale, ignore_errors=True)
+    print(f"✅ Sharded index: {len(chunks)} chunks in {len(names)} shards ({time.perf_counter() - t0:.1f}s) → '{out_dir}'")
+
+
+class IndexBuilder:
+    """Build a fresh index from a stream of (chunks, vectors) batches.
+
+    Used by pipeline.run_pipeline: metadata rows go straight to disk via
+    MetadataWriter, so only the FAISS index itself grows in memory. IVF/PQ
+    indexes buffer the first train_size vectors, train on them and then
+    add everything that follows directly. Compressed indexes also stream
+    their float32 vectors to the re-scoring side file.
+    """
+
+    def __init__(self, out_dir, embed_model_name, index_type="flat", metric="cosine", train_size=100_000,
+                 **index_opts):
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+        self.out_dir = out_dir
+        self.embed_model_name = embed_model_name
+        self.index_type = index_type
+        self.metric = metric
+        self.train_size = train_size
+        self.index_opts = index_opts
+        self.manifest = {"normalized": metric == "cosine"}
+        self.index = None
+        self.pending = []   # (ids, vectors) waiting for IVF training
+        self.n_pending = 0
+        self.next_id = 0
+        self.doc_state = {}
+        self._doc_hashes = {}
+        self.gen_dir = new_generation(out_dir)
+        self.writer = MetadataWriter(self.gen_dir)
+        self._full = (open(self.gen_dir / FULL_VECTORS_FILE, "wb") if is_compressed(index_type, index_opts)
+                      else None)
+
+    def add(self, chunks, vectors):
+        vectors = prepare_vectors(vectors, self.manifest)
+        ids = np.arange(self.next_id, self.next_id + len(chunks), dtype="int64")
+        self.next_id += len(chunks)
+        if self._full is not None:
+            self._full.write(vectors.tobytes())   # row = vector id
+        for vid, ch in zip(ids.tolist(), chunks):
+            self.writer.add(vid, metadata_entry(ch))
+            key = doc_key(ch)
+            state = self.doc_state.setdefault(key, {"hash": ch.get("file_hash"), "ids": []})
+            state["ids"].append(vid)
+            if not ch.get("file_hash"):
+                self._doc_hashes.setdefault(key, hashlib.sha1()).update(chunk_text_hash(ch).encode("utf-8"))
+
+        if self.index is None:
+            self.index = make_index(vectors.shape[1], self.index_type, n_vectors=self.train_size,
+                                    metric=self.metric, **self.index_opts)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self.pending.append((ids, vectors))
+        self.n_pending += len(ids)
+        if self.n_pending >= self.train_size:
+            self._train_and_flush()
+
+    def _train_and_flush(self):
+        ids = np.concatenate([i for i, _ in self.pending])
+        vectors = np.concatenate([v for _, v in self.pending])
+        if self.index_type.startswith("ivf") or self.index_opts.get("storage") == "pq":
+            # Size the IVF / PQ for what was actually seen if the stream was short
+            self.index = make_index(vectors.shape[1], self.index_type, n_vectors=len(vectors),
+                                    metric=self.metric, **self.index_opts)
+        train_index(self.index, vectors)
+        self.index.add_with_ids(vectors, ids)
+        self.pending, self.n_pending = [], 0
+
+    def finish(self):
+        if self.pending:
+            self._train_and_flush()
+        if self.index is None:
+            raise ValueError("No chunks were added to the index")
+        self.writer.close()
+        if self._full is not None:
+            self._full.close()
+        for key, h in self._doc_hashes.items():
+            self.doc_state[key]["hash"] = h.hexdigest()
+        manifest = make_manifest(self.embed_model_name, self.index.d, self.metric, self.index_type,
+                                 self.index_opts, self.next_id)
+        save_index_files(self.index, manifest, self.doc_state, self.out_dir, self.gen_dir)
+        print(f"✅ FAISS index ({self.index_type}, {self.metric}) built with {self.index.ntotal} vectors, "
+              f"saved to '{self.out_dir}'")
+        return self.index
+
+
+@traced("index.update")
+def update_faiss_index(chunks, embed_model_name, out_dir, batch_size=64, workers=1,
+                       use_processes=False, index_type="flat", metric="cosine", **index_opts):
+    """Incrementally sync the index in out_dir with chunks.
+
+    Unchanged documents are skipped, vectors of removed or modified documents
+    are deleted, and only chunks whose text was not indexed before are
+    embedded. Falls back to a full build when there is no compatible index
+    (different model, embedding backend, metric or index settings, or an HNSW
+    index that would need vectors removed). IVF centroids are not retrained on incremental runs.
+    """
+    def full_build(reason):
+        print(f"ℹ️ {reason}, running a full build")
+        return build_faiss_index(chunks, embed_model_name, out_dir, batch_size=batch_size, workers=workers,
+                                 use_processes=use_processes, index_type=index_type, metric=metric,
+                                 **index_opts)
+
+    manifest = load_manifest(out_dir)
+    old_docs = load_doc_state(out_dir)
+    src_dir = data_dir(out_dir, manifest)
+    index_path = src_dir / "faiss.index"
+    if manifest is None or old_docs is None or not index_path.exists():
+        return full_build("No existing index found")
+    if (manifest.get("embed_model") != embed_model_name or manifest.get("index_type") != index_type
+            or manifest.get("metric") != metric or manifest.get("index_opts", {}) != index_opts):
+        return full_build("Embedding model, metric or index settings changed")
+    backend = embed_backend()
+    if manifest.get("embed_backend", "torch") != backend:   # manifests without it were built with torch
+        return full_build(f"Embedding backend changed ({manifest.get('embed_backend', 'torch')} → {backend})")
+
+    docs, fingerprints = group_docs(chunks)
+    stale = [key for key, doc in old_docs.items() if fingerprints.get(key) != doc["hash"]]
+    fresh = [key for key in docs if key not in old_docs or old_docs[key]["hash"] != fingerprints[key]]
+    if stale and index_type == "hnsw":
+        return full_build("HNSW indexes cannot remove vectors")
+
+    index = faiss.read_index(str(index_path))
+    full_vectors = load_full_vectors(src_dir, manifest["dim"])
+    metadata = load_metadata(src_dir)
+    if not isinstance(metadata, dict):
+        metadata = metadata.to_dict()
+
+    # Keep vectors of stale chunks whose text survives in the new version
+    reusable = {}
+    stale_ids = []
+    for key in stale:
+        for vid in old_docs[key]["ids"]:
+            stale_ids.append(vid)
+            reusable[metadata[vid]["text_hash"]] = vid
+    new_chunks = [ch for key in fresh for ch in docs[key]]
+    kept_vectors = {}
+    for ch in new_chunks:
+        vid = reusable.get(chunk_text_hash(ch))
+        if vid is not None and chunk_text_hash(ch) not in kept_vectors:
+            if full_vectors is not None and vid < len(full_vectors):
+                kept_vectors[chunk_text_hash(ch)] = np.array(full_vectors[vid])   # exact, unlike reconstruct
+                continue
+            try:
+                kept_vectors[chunk_text_hash(ch)] = index.reconstruct(vid)
+            except RuntimeError:
+                pass  # IVF without a direct map: re-embed (usually an embedding-cache hit)
+
+    if stale_ids:
+        index.remove_ids(np.array(stale_ids, dtype="int64"))
+        for vid in stale_ids:
+            del metadata[vid]
+        for key in stale:
+            del old_docs[key]
+
+    to_embed = list({chunk_text_hash(ch): ch["text"] for ch in new_chunks
+                     if chunk_text_hash(ch) not in kept_vectors}.items())
+    if to_embed:
+        vectors = embed_texts([text for _, text in to_embed], embed_model_name, batch_size=batch_size,
+                              workers=workers, use_processes=use_processes)
+        for (h, _), vec in zip(to_embed, vectors):
+            kept_vectors[h] = vec
+
+    gen_dir = new_generation(out_dir)
+    if is_compressed(index_type, index_opts):
+        carry_full_vectors(src_dir, gen_dir)
+    if new_chunks:
+        next_id = manifest["next_id"]
+        ids = np.arange(next_id, next_id + len(new_chunks), dtype="int64")
+        vectors = prepare_vectors(np.stack([kept_vectors[chunk_text_hash(ch)] for ch in new_chunks]), manifest)
+        index.add_with_ids(vectors, ids)
+        if is_compressed(index_type, index_opts):
+            write_full_vectors(gen_dir, vectors, start_id=next_id)
+        for vid, ch in zip(ids.tolist(), new_chunks):
+            metadata[vid] = metadata_entry(ch)
+            old_docs.setdefault(doc_key(ch), {"hash": fingerprints[doc_key(ch)], "ids": []})["ids"].append(vid)
+        manifest["next_id"] = next_id + len(new_chunks)
+
+    save_index(index, metadata, manifest, old_docs, out_dir, gen_dir, sparse_base=src_dir)
+    print(f"✅ Incremental update: {len(docs) - len(fresh)} docs unchanged, {len(stale)} removed/replaced, "
+          f"{len(new_chunks)} chunks added ({len(to_embed)} embedded), {index.ntotal} vectors total")
+
+
 # Configuration + direct execution
 INPUT_FILE = "split_out_emd_in/docs.jsonl"
 OUTPUT_DIR = "emd_out_retr_in"
 EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBED_BATCH_SIZE = 64
+EMBED_WORKERS = 1          # >1 enables a thread (or process) pool
+EMBED_USE_PROCESSES = False
+EMBED_MMAP = False         # write vectors to emd_out_retr_in/embeddings.npy
+INCREMENTAL = True         # only re-embed new/changed documents
+INDEX_TYPE = "flat"        # flat | ivf_flat | ivf_pq | hnsw (see benchmarks/bench_ann.py)
+METRIC = "cosine"          # cosine (normalized vectors, inner product) | l2
+INDEX_OPTS = {}            # e.g. {"nlist": 256}, {"hnsw_m": 32} or {"storage": "sq8"} (fp16 | sq8 | pq)
+N_SHARDS = 1               # >1 writes a sharded index (shard_NNN/ dirs + shards.json)
 
-chunks = load_chunks(INPUT_FILE)
-build_faiss_index(chunks, embed_model_name=EMBED_MODEL, out_dir=OUTPUT_DIR)
\ No newline at end of file
+if __name__ == "__main__":
+    chunks = load_chunks(INPUT_FILE)
+    if N_SHARDS > 1:
+        build_sharded_index(
+            chunks,
+            embed_model_name=EMBED_MODEL,
+            out_dir=OUTPUT_DIR,
+            n_shards=N_SHARDS,
+            batch_size=EMBED_BATCH_SIZE,
+            workers=EMBED_WORKERS,
+            use_processes=EMBED_USE_PROCESSES,
+            incremental=INCREMENTAL,
+            index_type=INDEX_TYPE,
+            metric=METRIC,
+            **INDEX_OPTS,
+        )
+    elif INCREMENTAL:
+        update_faiss_index(
+            chunks,
+            embed_model_name=EMBED_MODEL,
+            out_dir=OUTPUT_DIR,
+            batch_size=EMBED_BATCH_SIZE,
+            workers=EMBED_WORKERS,
+            use_processes=EMBED_USE_PROCESSES,
+            index_type=INDEX_TYPE,
+            metric=METRIC,
+            **INDEX_OPTS,
+        )
+    else:
+        build_faiss_index(
+            chunks,
+            embed_model_name=EMBED_MODEL,
+            out_dir=OUTPUT_DIR,
+            batch_size=EMBED_BATCH_SIZE,
+            workers=EMBED_WORKERS,
+            use_processes=EMBED_USE_PROCESSES,
+            mmap_embeddings=EMBED_MMAP,
+            index_type=INDEX_TYPE,
+            metric=METRIC,
+            **INDEX_OPTS,
+        )
+    print_summary()
@@ -1,81 +1,179 @@
-import os
-import pickle
-import faiss
+import asyncio
+import threading
+import time
+import warnings
 import numpy as np
-from dotenv import load_dotenv
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-import google.generativeai as genai
+from embed_index import (current_full_vectors, current_manifest, current_sparse_index, filter_selector,
+                         hybrid_search, search_vectors)
+from metadata_store import format_hits, lookup_many, normalize_filters, row_mask
+from query_cache import QUERY_CACHE, normalize_query
+from sharded_index import ShardedIndex
+from answer_cache import ANSWER_CACHE
+from context_packer import CONTEXT_TOKEN_BUDGET, pack_context
+from registry import INDEX_DIR, REGISTRY, IndexSnapshot
+from telemetry import METRICS, SIZE_BUCKETS, record, span
 
 # Fixed configuration
-INDEX_DIR = "emd_out_retr_in"
-EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
 DEFAULT_MODEL = "gemini-1.5-flash-latest"
 
-# Initialize Gemini
-load_dotenv()
-api_key = os.getenv("GEMINI_API_KEY")
-if not api_key:
-    raise ValueError("❌ GEMINI_API_KEY not found in .env")
-genai.configure(api_key=api_key)
-
-# Initialize embedding model
-embed_model = HuggingFaceEmbedding(model_name=EMBED_MODEL)
-
 
 # ---------- Load Index ----------
 def load_index():
-    """Load FAISS index and metadata from the fixed index directory."""
-    index = faiss.read_index(f"{INDEX_DIR}/faiss.index")
-    with open(f"{INDEX_DIR}/metadata.pkl", "rb") as f:
-        metadata = pickle.load(f)
-    return index, metadata
+    """FAISS index and metadata of the fixed index directory, shared through the registry.
+
+    For a sharded index this returns (ShardedIndex, None); search() and
+    friends accept it in place of a FAISS index. The first call loads the
+    index; later calls return the same objects until a newer index is saved.
+    REGISTRY.snapshot() returns the same index together with the manifest,
+    BM25 index and re-scoring vectors it was opened with.
+    """
+    return REGISTRY.index()
 
 
 # ---------- Retriever ----------
-def search(query, index, metadata, embed_model, k=5, use_cosine=True):
-    """Search top-k results from FAISS index."""
-    query_emb = np.array([embed_model.get_text_embedding(query)]).astype("float32")
+def search_batch(queries, index, metadata, embed_model, k=5, nprobe=None, ef_search=None, manifest=None,
+                 cache=QUERY_CACHE, mode="dense", filters=None):
+    """search() for several queries at once: one embedding batch and one FAISS call.
+
+    Queries already in the results cache are answered from it; the rest
+    are embedded together (cached query vectors are reused) and searched
+    as a single matrix. Returns one result list per query, in order.
+    index may be an IndexSnapshot (REGISTRY.snapshot()); its manifest, BM25
+    index and re-scoring vectors are then used with it (and its metadata
+    instead of `metadata`). A bare index is matched to the registry's loaded
+    snapshot, or else paired with what is currently on disk in INDEX_DIR;
+    results of such an index, or of a search with a manifest other than
+    the snapshot's, are not cached.
+    """
+    if isinstance(nprobe, bool):   # search(query, ..., k, use_cosine) from before the manifest held the metric
+        raise TypeError("nprobe must be an int, not a bool; use_cosine is keyword-only and deprecated")
+    with span("search", queries=len(queries), k=k, mode=mode):
+        METRICS.inc("queries", len(queries))
+        if isinstance(index, IndexSnapshot):
+            snap = index
+        else:
+            snap = REGISTRY.snapshot_of(index, metadata) or _disk_snapshot(index, metadata)
+        return _search_batch(queries, snap, embed_model, k, nprobe, ef_search, manifest, cache, mode, filters)
+
+
+def _disk_snapshot(index, metadata):
+    """Snapshot for an index the caller opened itself (e.g. a benchmark's own index)."""
+    if isinstance(index, ShardedIndex):
+        return IndexSnapshot(index, metadata)
+    manifest = current_manifest(INDEX_DIR)
+    return IndexSnapshot(index, metadata, manifest, current_sparse_index(INDEX_DIR),
+                         current_full_vectors(INDEX_DIR, manifest))   # no version: results are not cached
+
 
-    if use_cosine:
-        faiss.normalize_L2(query_emb)
+def _search_batch(queries, snap, embed_model, k, nprobe, ef_search, manifest, cache, mode, filters):
+    index, metadata = snap.index, snap.metadata
+    sharded = isinstance(index, ShardedIndex)
+    snap_key = snap.cache_key if manifest is None or manifest == snap.manifest else None
+    manifest = manifest or snap.manifest
+    hybrid_ok = index.hybrid if sharded else snap.sparse is not None
+    mode = mode if mode == "hybrid" and hybrid_ok else "dense"   # indexes without bm25/ stay dense-only
+    raw_filters, filters = filters, normalize_filters(filters)
+    # Results are keyed by the save the snapshot was opened from, not by what is on disk now
+    keys = [(snap_key, normalize_query(q), k, nprobe, ef_search, mode, filters) for q in queries]
+    cache_results = cache is not None and snap_key is not None
+    out = [cache.get_results(key) if cache_results else None for key in keys]
+    todo = [i for i, r in enumerate(out) if r is None]
+    METRICS.inc("query_cache_hits", len(queries) - len(todo))
+    if not todo:
+        return out
 
-    D, I = index.search(query_emb, k)
+    texts = [queries[i] for i in todo]
+    if sharded:   # fan-out and merge happen in the ShardedIndex; results are cached here like any index's
+        fresh = index.search_batch(texts, embed_model, k, nprobe, ef_search, mode, raw_filters, cache)
+        for i, hits in zip(todo, fresh):
+            out[i] = hits
+            if cache_results:
+                cache.put_results(keys[i], hits)
+        return out
+    sparse = snap.sparse if mode == "hybrid" else None
+    with span("search.embed", queries=len(texts)):
+        if cache is not None:
+            query_embs = cache.query_embeddings(embed_model, texts)
+        else:
+            query_embs = np.asarray(embed_model.get_text_embedding_batch(texts), dtype="float32")
+    # Filters are applied inside FAISS (ID selector) and BM25 (row mask), not by over-fetching
+    sel = filter_selector(metadata, filters) if filters else None
+    full_vectors = snap.full_vectors   # compressed indexes: exact re-scoring
+    with span("search.faiss", mode=mode):
+        if sparse is not None:
+            D, I = hybrid_search(index, sparse, query_embs, texts, k, manifest, nprobe, ef_search, sel=sel,
+                                 row_mask=row_mask(metadata, filters) if filters else None,
+                                 full_vectors=full_vectors)
+        else:
+            D, I = search_vectors(index, query_embs, k, manifest, nprobe=nprobe, ef_search=ef_search,
+                                  sel=sel, full_vectors=full_vectors)  # D=scores, I=ids
+    with span("search.metadata"):
+        rows = lookup_many(metadata, I)  # every hit of the batch decoded in one pass
+        for row, i in enumerate(todo):
+            out[i] = format_hits(D[row], I[row], rows)
+            if cache_results:
+                cache.put_results(keys[i], out[i])
+    return out
 
+
+def search(query, index, metadata, embed_model, k=5, nprobe=None, ef_search=None, manifest=None,
+           cache=QUERY_CACHE, mode="dense", filters=None, *, use_cosine=None):
+    """Search top-k results from FAISS index.
+
+    The metric comes from the index manifest: "score" is a cosine similarity
+    for cosine indexes (higher is better) and an L2 distance otherwise.
+    nprobe (IVF indexes) and ef_search (HNSW) trade recall for latency.
+    Repeated queries are answered from `cache` (see query_cache.py); pass
+    cache=None to always hit the model and the index. mode="hybrid" fuses
+    the dense ranking with BM25 (exact names, numbers) by reciprocal-rank
+    fusion; "score" is then the fused RRF score. filters restricts results
+    to chunks whose metadata match, e.g. {"strategy": "table_whole"} or
+    {"source": [...], "page": 3} (see metadata_store.FILTER_FIELDS).
+    use_cosine is deprecated and ignored: the metric comes from the manifest.
+    """
+    if use_cosine is not None:
+        warnings.warn("search(use_cosine=...) is deprecated and ignored: the metric comes from the index "
+                      "manifest", DeprecationWarning, stacklevel=2)
+    return search_batch([query], index, metadata, embed_model, k, nprobe, ef_search, manifest, cache, mode,
+                        filters)[0]
+
+
+def search_many(queries, index, metadata, embed_model, k=5, batch_size=256, nprobe=None, ef_search=None,
+                manifest=None, cache=None, mode="dense", filters=None):
+    """Result lists for many queries (evaluation, backfills), batch_size at a time.
+
+    Each batch is one embedding call and one FAISS call. The query cache is
+    off by default so bulk runs do not flush it.
+    """
+    queries = list(queries)
     results = []
-    for rank, idx in enumerate(I[0]):
-        if idx == -1:
-            continue
-        meta = metadata[idx]
-
-        # ✅ Prefer URL if available, fallback to local source
-        source_link = meta.get("source_url") or meta.get("source")
-
-        result = {
-            "rank": rank + 1,
-            "score": float(D[0][rank]),
-            "text": meta["text"],
-            "source": source_link,   # unified source field
-            "title": meta.get("title"),
-            "page": meta.get("page"),
-            "paragraph_id": meta.get("paragraph_id"),
-            "strategy": meta.get("strategy")
-        }
-        # Add table metadata if present
-        if meta.get("strategy") == "table_whole":
-            result["type"] = meta.get("type")
-            result["table_index"] = meta.get("table_index")
-            result["section"] = meta.get("section")
-            result["pages"] = meta.get("pages")
-        results.append(result)
+    for start in range(0, len(queries), batch_size):
+        results.extend(search_batch(queries[start:start + batch_size], index, metadata, embed_model, k,
+                                    nprobe, ef_search, manifest, cache, mode, filters))
     return results
 
+
 # ---------- Generator ----------
-def generate_answer(query, retrieved_chunks, model_name=DEFAULT_MODEL):
-    """Call Gemini API with retrieved context and return answer + citations."""
+# Default backend (see llm_backends.py): the registry's Gemini client, configured on first use
+GEMINI = REGISTRY.llm
+
+
+def build_prompt(query, retrieved_chunks, token_budget=CONTEXT_TOKEN_BUDGET, report=None):
+    """Prompt with numbered context snippets, plus the citation number → chunk map.
+
+    The chunks are packed first (context_packer.pack_context): adjacent
+    chunks merged, near-duplicates dropped, tables trimmed, and the context
+    kept within token_budget tokens. `report` receives the packing stats.
+    """
     # Build context with citation anchors
     context = ""
     citation_map = {}
-    for i, ch in enumerate(retrieved_chunks, start=1):
+    report = report if report is not None else {}
+    with span("context", chunks=len(retrieved_chunks)):
+        packed = pack_context(query, retrieved_chunks, token_budget, report)
+    METRICS.observe("prompt_context_tokens", report["tokens_out"], SIZE_BUCKETS)
+    METRICS.inc("context_tokens_saved", report["tokens_saved"])
+    for i, ch in enumerate(packed, start=1):
         anchor = f"[{i}]"
         snippet = ch["text"].replace("\n", " ")
         context += f"{anchor} {snippet}\n"
@@ -95,10 +193,106 @@ Context:
 
 Answer:
 """
+    return prompt, citation_map
+
+
+def generate_answer(query, retrieved_chunks, model_name=DEFAULT_MODEL, backend=GEMINI,
+                    cache=ANSWER_CACHE, token_budget=CONTEXT_TOKEN_BUDGET, report=None):
+    """Call the LLM with retrieved context and return answer + citations.
+
+    backend does the actual call (Gemini by default; llm_backends.
+    FakeStreamingBackend or any object with the same methods works offline).
+    Identical prompts are answered from `cache`, and concurrent identical
+    requests share one in-flight call; pass cache=None to always call the backend.
+    token_budget and report are passed to build_prompt.
+    """
+    prompt, citation_map = build_prompt(query, retrieved_chunks, token_budget, report)
+    with span("llm.generate", model=model_name):
+        if cache is None:
+            return backend.generate(prompt, model_name), citation_map
+        return cache.get_or_generate(prompt, model_name, backend), citation_map
+
+
+def stream_answer(query, retrieved_chunks, model_name=DEFAULT_MODEL, backend=GEMINI,
+                  cache=ANSWER_CACHE, timings=None, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Yield the answer piece by piece as the backend produces it.
+
+    The prompt is built once, by build_prompt(query, retrieved_chunks). If
+    `timings` is a dict it receives ttft_sec (time to first piece),
+    total_sec, cached, context (build_prompt's packing report) and citations
+    (its citation number → chunk map, set before the first piece). A cached
+    answer is yielded in one piece; a completed stream is stored in the
+    cache (streams are not coalesced).
+    """
+    t0 = time.perf_counter()
+    timings = timings if timings is not None else {}
+    timings["context"] = {}
+    prompt, timings["citations"] = build_prompt(query, retrieved_chunks, token_budget, timings["context"])
+    hit = cache.lookup(prompt, model_name, backend) if cache is not None else None
+    timings["cached"] = hit is not None
+    pieces = [hit] if hit is not None else backend.stream(prompt, model_name)
+
+    parts = []
+    for piece in pieces:
+        if not parts:
+            timings["ttft_sec"] = time.perf_counter() - t0
+        parts.append(piece)
+        yield piece
+    timings.setdefault("ttft_sec", time.perf_counter() - t0)
+    timings["total_sec"] = time.perf_counter() - t0
+    METRICS.observe("llm_ttft_seconds", timings["ttft_sec"])
+    record("llm.stream", timings["total_sec"], t0, model=model_name, cached=timings["cached"])
+    if cache is not None and hit is None:
+        cache.store(prompt, model_name, backend, "".join(parts))
+
+
+async def astream_answer(query, retrieved_chunks, model_name=DEFAULT_MODEL, backend=GEMINI,
+                         cache=ANSWER_CACHE, timings=None, token_budget=CONTEXT_TOKEN_BUDGET):
+    """Async version of stream_answer for event-loop callers.
+
+    The blocking backend stream runs in the default executor and pieces are
+    handed to the loop as they arrive, so other requests keep being served.
+    If the consumer stops early (e.g. the client disconnects), the producer
+    stops reading the backend stream at the next piece. `timings` is filled
+    in as by stream_answer.
+    """
+    loop = asyncio.get_running_loop()
+    q = asyncio.Queue()
+    done = object()
+    stop = threading.Event()
+
+    def produce():
+        pieces = stream_answer(query, retrieved_chunks, model_name, backend, cache, timings, token_budget)
+        try:
+            for piece in pieces:
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(q.put_nowait, piece)
+        except BaseException as e:
+            loop.call_soon_threadsafe(q.put_nowait, e)
+        else:
+            loop.call_soon_threadsafe(q.put_nowait, done)
+        finally:
+            pieces.close()
 
-    response = genai.GenerativeModel(model_name).generate_content(prompt)
-    return response.text, citation_map
+    producer = loop.run_in_executor(None, produce)
+    try:
+        while True:
+            item = await q.get()
+            if item is done:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+    await producer
 
 
-# Load index and metadata at module level
-index, metadata = load_index()
+def __getattr__(name):
+    # Module attributes kept for existing callers; resolved lazily so importing stays cheap
+    if name == "embed_model":
+        return REGISTRY.embed_model
+    if name in ("index", "metadata"):
+        return REGISTRY.index()[name == "metadata"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
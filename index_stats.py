@@ -0,0 +1,124 @@
+import argparse
+from pathlib import Path
+import faiss
+import numpy as np
+
+from embed_index import (FULL_VECTORS_FILE, RESCORE_FACTOR, data_dir, is_compressed, load_full_vectors,
+                         load_manifest, rescore, search_params)
+from metadata_store import STORE_DIR, load_metadata
+from sharded_index import is_sharded
+from sparse_index import SPARSE_DIR
+
+INDEX_DIR = "emd_out_retr_in"
+
+
+def dir_bytes(path):
+    path = Path(path)
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file()) if path.exists() else 0
+
+
+def index_dirs(index_dir):
+    """The directories holding an index: the shards of a sharded index, else index_dir itself."""
+    if is_sharded(index_dir):
+        return sorted(p for p in Path(index_dir).glob("shard_*") if (p / "manifest.json").exists())
+    return [Path(index_dir)]
+
+
+def storage_stats(index_dir):
+    """Bytes per component of an index directory (summed over shards).
+
+    vectors     faiss.index (held in RAM when loaded)
+    rescore     float32 side file of compressed indexes (memory-mapped, pages read on demand)
+    metadata    columnar metadata store without the chunk texts (memory-mapped)
+    text        chunk texts (memory-mapped)
+    bm25        sparse index for hybrid search (memory-mapped)
+    """
+    out = {"chunks": 0, "vectors": 0, "rescore": 0, "metadata": 0, "text": 0, "bm25": 0, "storage": set()}
+    for d in index_dirs(index_dir):
+        manifest = load_manifest(d) or {}
+        opts = manifest.get("index_opts", {})
+        out["storage"].add(f"{manifest.get('index_type', 'flat')}/{opts.get('storage', 'float32')}")
+        root = data_dir(d, manifest)
+        out["chunks"] += len(load_metadata(root))
+        out["vectors"] += dir_bytes(root / "faiss.index")
+        out["rescore"] += dir_bytes(root / FULL_VECTORS_FILE)
+        text = dir_bytes(root / STORE_DIR / "text.bin")
+        out["text"] += text
+        out["metadata"] += dir_bytes(root / STORE_DIR) - text
+        out["bm25"] += dir_bytes(root / SPARSE_DIR)
+    out["storage"] = ", ".join(sorted(out["storage"]))
+    return out
+
+
+def recall_check(index_dir, n_queries=200, k=10, nprobe=None, ef_search=None, seed=0):
+    """recall@k of a compressed index against exact search over its float32 side file.
+
+    Queries are stored vectors plus a little noise. Returns (recall without
+    re-scoring, recall with re-scoring), or None for an uncompressed index.
+    """
+    manifest = load_manifest(index_dir)
+    if manifest is None or not is_compressed(manifest["index_type"], manifest.get("index_opts", {})):
+        return None
+    root = data_dir(index_dir, manifest)
+    full = load_full_vectors(root, manifest["dim"])
+    index = faiss.read_index(str(root / "faiss.index"))
+    ids = np.sort(faiss.vector_to_array(index.id_map))   # live ids (the side file keeps rows of removed ones)
+    base = np.asarray(full[ids])
+
+    rng = np.random.default_rng(seed)
+    queries = base[rng.choice(len(base), min(n_queries, len(base)), replace=False)]
+    queries = queries + rng.normal(0, 0.05, queries.shape).astype("float32")
+    metric = faiss.METRIC_INNER_PRODUCT if manifest["metric"] == "cosine" else faiss.METRIC_L2
+    if manifest.get("normalized"):
+        faiss.normalize_L2(queries)
+    _, truth = faiss.knn(queries, base, k, metric=metric)
+    truth = ids[truth]
+
+    params = search_params(index, nprobe, ef_search)
+    _, plain = index.search(queries, k, params=params)
+    _, cand = index.search(queries, k * RESCORE_FACTOR, params=params)
+    _, rescored = rescore(full, queries, cand, k, manifest["metric"])
+
+    def recall(found):
+        return float(np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)]))
+
+    return recall(plain), recall(rescored)
+
+
+def fmt_bytes(n):
+    for unit in ("B", "KB", "MB"):
+        if n < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} GB"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Storage used by an index, and recall of compressed vectors.")
+    parser.add_argument("index_dir", nargs="?", default=INDEX_DIR)
+    parser.add_argument("--recall", type=int, default=0, metavar="N",
+                        help="also compare recall@k of N queries against exact float32 search")
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=None)
+    parser.add_argument("--ef-search", type=int, default=None)
+    args = parser.parse_args()
+
+    stats = storage_stats(args.index_dir)
+    n = max(stats["chunks"], 1)
+    print(f"{args.index_dir}: {stats['chunks']} chunks, {stats['storage']}\n")
+    print(f"{'component':<10}{'bytes':>12}{'per chunk':>12}")
+    for name in ("vectors", "rescore", "metadata", "text", "bm25"):
+        print(f"{name:<10}{fmt_bytes(stats[name]):>12}{stats[name] / n:>12.1f}")
+    resident = stats["vectors"]
+    print(f"\nRAM for vectors: {fmt_bytes(resident)} ({resident / n:.1f} B/chunk); the rest is memory-mapped")
+
+    if args.recall:
+        print()
+        for d in index_dirs(args.index_dir):
+            result = recall_check(d, args.recall, args.k, args.nprobe, args.ef_search)
+            if result is None:
+                print(f"{d.name}: float32 vectors, nothing to compare")
+            else:
+                print(f"{d.name}: recall@{args.k} {result[0]:.3f} compressed, {result[1]:.3f} re-scored")
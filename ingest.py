@@ -2,9 +2,17 @@
 import os
 import re
 import json
-import uuid
+import hashlib
+import time
+import multiprocessing as mp
+import shutil
+import signal
+from multiprocessing import connection as mp_connection
 from pathlib import Path
-from pdfminer.high_level import extract_text as pdf_extract_text
+from concurrent.futures import ProcessPoolExecutor
+from pdfminer.high_level import extract_pages
+from pdfminer.layout import LTTextContainer
+from pdfminer.pdfpage import PDFPage
 from bs4 import BeautifulSoup
 import html2text
 from llama_index.core import Document
@@ -12,6 +20,30 @@ from docx import Document as DocxReader
 import tabula
 import pandas as pd
 
+from telemetry import METRICS, print_summary, span
+
+
+# -------- PDF extraction settings --------
+PDF_PAGE_CACHE_DIR = "pdf_page_cache"  # parsed pages keyed by file hash (None disables)
+PDF_PAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # least recently used files are evicted above it
+PDF_PAGE_WORKERS = 1                   # >1 extracts page ranges of large PDFs in parallel
+PDF_PAGES_PER_TASK = 16                # pages per parallel task
+
+# Version of the records each file type is extracted into. Bump it when an extractor's
+# output changes: the version is part of the file fingerprint, so incremental runs
+# re-extract (and re-split and re-index) files of that type. 2 = PDF page-range
+# extraction with per-page tables ("pages": [n]). Types not listed are at version 1.
+EXTRACTOR_VERSIONS = {".pdf": 2}
+
+# Ingest workers are never forked straight from this process, which may be running
+# threads (pipeline.prefetch, the embedding model): forkserver forks them from a
+# single-threaded server with this module preloaded; spawn where it is unavailable.
+if "forkserver" in mp.get_all_start_methods():
+    MP_CONTEXT = mp.get_context("forkserver")
+    MP_CONTEXT.set_forkserver_preload(["ingest"])
+else:
+    MP_CONTEXT = mp.get_context("spawn")
+
 
 # -------- Load URL mapping --------
 URL_MAP_FILE = "url_map.json"
@@ -28,31 +60,170 @@ def clean_text(text: str) -> str:
     return re.sub(r"\s+", " ", text).strip()
 
 
-def extract_text_with_pages(filepath: str):
+def extractor_version(filepath: str) -> int:
+    return EXTRACTOR_VERSIONS.get(Path(filepath).suffix.lower(), 1)
+
+
+def file_fingerprint(filepath: str) -> str:
+    """Content hash of a source file and its extractor version (stable ids + incremental runs).
+
+    Version 1 hashes the content alone, so fingerprints from before versions existed still match.
+    """
+    h = hashlib.sha256()
+    with open(filepath, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    version = extractor_version(filepath)
+    if version > 1:
+        h.update(f"\0extractor-v{version}".encode("ascii"))
+    return h.hexdigest()
+
+
+def record_id(file_hash: str, idx) -> str:
+    """Stable record id: same file content -> same ids on every run."""
+    return f"{file_hash[:16]}-{idx}"
+
+
+def record_source(rec) -> str:
+    """Source file name of a serialized record (top-level or in metadata)."""
+    return rec.get("source") or rec.get("metadata", {}).get("file_name", "")
+
+
+def record_file_hash(rec) -> str:
+    return rec.get("file_hash") or rec.get("metadata", {}).get("file_hash", "")
+
+
+# -------- PDF: page streaming --------
+def pdf_page_count(filepath: str) -> int:
+    with open(filepath, "rb") as f:
+        return sum(1 for _ in PDFPage.get_pages(f))
+
+
+def _page_cache_path(file_hash: str, page_no: int, cache_dir: str):
+    return Path(cache_dir) / file_hash / f"{page_no}.json"
+
+
+def prune_page_cache(cache_dir=PDF_PAGE_CACHE_DIR, max_bytes=PDF_PAGE_CACHE_MAX_BYTES):
+    """Evict whole files (<cache_dir>/<file hash>/) from the page cache, least recently used first,
+    until it holds at most max_bytes. extract_pdf_page_range marks a file as used."""
+    if not cache_dir or not Path(cache_dir).is_dir():
+        return
+    entries = []
+    for d in Path(cache_dir).iterdir():
+        if d.is_dir():
+            entries.append((d.stat().st_mtime, sum(f.stat().st_size for f in d.iterdir()), d))
+    total = sum(size for _, size, _ in entries)
+    for _, size, d in sorted(entries, key=lambda e: e[0]):
+        if total <= max_bytes:
+            break
+        shutil.rmtree(d, ignore_errors=True)
+        total -= size
+        METRICS.inc("pdf_page_cache_evictions")
+
+
+def extract_pdf_page_range(filepath: str, page_numbers, file_hash: str = None, cache_dir=PDF_PAGE_CACHE_DIR):
+    """Yield {"page", "text", "tables"} for the given 1-based pages, one page at a time.
+
+    Each page is laid out once by pdfminer, and the tables of each run of
+    uncached pages are read by a single tabula call. Parsed pages are cached
+    on disk by file hash, so re-ingestion (or a retry after a timeout) skips
+    pages already done; see prune_page_cache for the size limit.
+    """
+    file_hash = file_hash or file_fingerprint(filepath)
+    if cache_dir and Path(cache_dir, file_hash).is_dir():
+        os.utime(Path(cache_dir, file_hash))   # recently used: evicted last
+    pending = []  # run of uncached pages, parsed together so pdfminer opens the file once
+    for page_no in page_numbers:
+        cached = _page_cache_path(file_hash, page_no, cache_dir) if cache_dir else None
+        if cached is None or not cached.exists():
+            pending.append(page_no)
+            continue
+        yield from _parse_pages(filepath, pending, file_hash, cache_dir)
+        pending = []
+        with open(cached, "r", encoding="utf-8") as f:
+            yield json.load(f)
+    yield from _parse_pages(filepath, pending, file_hash, cache_dir)
+
+
+def _parse_pages(filepath: str, page_numbers, file_hash: str, cache_dir):
+    if not page_numbers:
+        return  # pdfminer reads every page when page_numbers is empty
+    tables = _read_tables(filepath, page_numbers)
+    layouts = extract_pages(filepath, page_numbers=[p - 1 for p in page_numbers])
+    for page_no, layout in zip(page_numbers, layouts):
+        text = "".join(el.get_text() for el in layout if isinstance(el, LTTextContainer))
+        page = {"page": page_no, "text": text, "tables": tables.get(page_no, [])}
+        if cache_dir:
+            path = _page_cache_path(file_hash, page_no, cache_dir)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = path.with_suffix(".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(page, f, ensure_ascii=False)
+            os.replace(tmp, path)
+        yield page
+
+
+def _read_tables(filepath: str, page_numbers):
+    """Page number -> table texts, from one tabula (JVM) run over all of page_numbers.
+
+    tabula's JSON output tags each table with its page_number; an older
+    tabula-java without it is read page by page instead.
+    """
+    tables = {}
+    try:
+        raw = tabula.read_pdf(filepath, pages=list(page_numbers), multiple_tables=True, output_format="json")
+    except Exception as e:
+        print(f"Table extraction failed for PDF {filepath} pages {page_numbers[0]}-{page_numbers[-1]}: {e}")
+        return tables
+    if len(page_numbers) > 1 and any("page_number" not in table for table in raw):
+        for page_no in page_numbers:
+            tables.update(_read_tables(filepath, [page_no]))
+        return tables
+    for table in raw:
+        rows = [[cell.get("text", "") for cell in row] for row in table.get("data", [])]
+        if len(rows) > 1:   # header row plus at least one data row
+            df = pd.DataFrame(rows[1:], columns=rows[0])
+            tables.setdefault(table.get("page_number", page_numbers[0]), []).append(df.to_string(index=False))
+    return tables
+
+
+def _extract_range_task(filepath, page_numbers, file_hash, cache_dir):
+    return list(extract_pdf_page_range(filepath, page_numbers, file_hash, cache_dir))
+
+
+def iter_pdf_pages(filepath: str, file_hash: str = None, page_workers: int = PDF_PAGE_WORKERS,
+                   pages_per_task: int = PDF_PAGES_PER_TASK, cache_dir=PDF_PAGE_CACHE_DIR):
+    """Yield the pages of a PDF in order, extracting page ranges in parallel if asked."""
+    file_hash = file_hash or file_fingerprint(filepath)
+    pages = list(range(1, pdf_page_count(filepath) + 1))
+    if page_workers <= 1 or len(pages) <= pages_per_task:
+        yield from extract_pdf_page_range(filepath, pages, file_hash, cache_dir)
+        return
+    ranges = [pages[i:i + pages_per_task] for i in range(0, len(pages), pages_per_task)]
+    with ProcessPoolExecutor(max_workers=page_workers) as pool:
+        futures = [pool.submit(_extract_range_task, filepath, r, file_hash, cache_dir) for r in ranges]
+        for fut in futures:
+            yield from fut.result()
+
+
+def extract_text_with_pages(filepath: str, file_hash: str = None):
     """Extract text with page-like splits (PDF vs DOCX)."""
     ext = Path(filepath).suffix.lower()
 
     if ext == ".pdf":
-        text = pdf_extract_text(filepath)
-        # Store all pages as one string, but keep page mapping for metadata
-        pages = text.split("\f") if text else []
-        full_text = "\n".join(pages)
+        # One text record per page plus one record per table, all with real page numbers
         results = []
-        if full_text:
-            results.append((full_text, {"pages": list(range(1, len(pages)+1))}))
-        # Extract tables using tabula-py
-        try:
-            tables = tabula.read_pdf(filepath, pages="all", multiple_tables=True)
-            for idx, table in enumerate(tables):
-                if not table.empty:
-                    table_text = table.to_string(index=False)
-                    results.append((table_text, {
-                        "type": "table",
-                        "pages": "all",  # tabula does not always give page info
-                        "table_index": idx
-                    }))
-        except Exception as e:
-            print(f"Table extraction failed for PDF {filepath}: {e}")
+        for page in iter_pdf_pages(filepath, file_hash):
+            n = page["page"]
+            if page["text"].strip():
+                results.append((page["text"], {"page": n, "pages": [n]}))
+            for idx, table_text in enumerate(page["tables"]):
+                results.append((table_text, {
+                    "type": "table",
+                    "page": n,
+                    "pages": [n],
+                    "table_index": idx
+                }))
         return results
 
     elif ext == ".docx":
@@ -81,16 +252,18 @@ def extract_text_with_pages(filepath: str):
     else:
         raise ValueError(f"Unsupported file type: {ext}")
 
-def process_document(filepath: str):
+def process_document(filepath: str, file_hash: str = None):
     """Process PDF or DOCX into LlamaIndex Documents with metadata."""
     records = []
-    chunks = extract_text_with_pages(filepath)
-    for chunk_text, extra_meta in chunks:
+    file_hash = file_hash or file_fingerprint(filepath)
+    chunks = extract_text_with_pages(filepath, file_hash)
+    for idx, (chunk_text, extra_meta) in enumerate(chunks):
         if not chunk_text.strip():
             continue
         meta = {
-            "doc_id": str(uuid.uuid4()),
+            "doc_id": record_id(file_hash, idx),
             "file_name": os.path.basename(filepath),
+            "file_hash": file_hash,
             "title": Path(filepath).stem,
         }
         meta.update(extra_meta)
@@ -103,9 +276,10 @@ def process_document(filepath: str):
 
 
 
-def process_html(filepath: str):
+def process_html(filepath: str, file_hash: str = None):
     """Extract text from HTML, split by paragraphs (<p>, <div>, <section>)."""
     records = []
+    file_hash = file_hash or file_fingerprint(filepath)
     with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
         soup = BeautifulSoup(f, "html.parser")
 
@@ -115,8 +289,9 @@ def process_html(filepath: str):
 
     # Save as a single record, similar to DOCX
     records.append({
-        "id": str(uuid.uuid4()),
+        "id": record_id(file_hash, 0),
         "source": os.path.basename(filepath),
+        "file_hash": file_hash,
         "source_url": URL_MAP.get(os.path.basename(filepath), ""),
         "title": soup.title.string if soup.title else Path(filepath).stem,
         "page": None,
@@ -125,9 +300,10 @@ def process_html(filepath: str):
     })
     return records
 
-def process_markdown(filepath: str):
+def process_markdown(filepath: str, file_hash: str = None):
     """Extract text from Markdown and split by headings/paragraphs."""
     records = []
+    file_hash = file_hash or file_fingerprint(filepath)
     with open(filepath, "r", encoding="utf-8", errors="ignore") as f:
         md_content = f.read()
 
@@ -138,8 +314,9 @@ def process_markdown(filepath: str):
 
     # Save as a single record, similar to HTML and DOCX
     records.append({
-        "id": str(uuid.uuid4()),
+        "id": record_id(file_hash, 0),
         "source": os.path.basename(filepath),
+        "file_hash": file_hash,
         "source_url": URL_MAP.get(os.path.basename(filepath), ""),
         "title": Path(filepath).stem,
         "page": None,
@@ -149,32 +326,236 @@ def process_markdown(filepath: str):
     return records
 
 
-def ingest(data_dir: str, out_file: str):
-    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
-    all_records = []
-
-    for file in Path(data_dir).glob("*"):
-        if file.suffix.lower() in [".pdf",".docx"]:
-            recs = process_document(str(file))
-        elif file.suffix.lower() in [".html", ".htm"]:
-            recs = process_html(str(file))
-        elif file.suffix.lower() in [".md", ".markdown"]:
-            recs = process_markdown(str(file))
-        else:
-            print(f"Skipping unsupported file type: {file}")
+SUPPORTED_SUFFIXES = [".pdf", ".docx", ".html", ".htm", ".md", ".markdown"]
+
+
+def process_file(filepath: str, file_hash: str = None):
+    """Dispatch a file to the right extractor by suffix."""
+    suffix = Path(filepath).suffix.lower()
+    if suffix in [".pdf", ".docx"]:
+        return process_document(filepath, file_hash)
+    elif suffix in [".html", ".htm"]:
+        return process_html(filepath, file_hash)
+    elif suffix in [".md", ".markdown"]:
+        return process_markdown(filepath, file_hash)
+    raise ValueError(f"Unsupported file type: {suffix}")
+
+
+def record_to_json(rec) -> str:
+    """One JSONL line for a record (LlamaIndex Document or plain dict)."""
+    if isinstance(rec, Document):
+        return json.dumps({"text": rec.text, "metadata": rec.metadata}, ensure_ascii=False)
+    return json.dumps(rec, ensure_ascii=False)
+
+
+def load_previous_records(out_file: str):
+    """Index records of a previous ingestion run by (source, file_hash).
+
+    Only byte offsets are kept; reused lines are re-read when written out.
+    """
+    previous = {}
+    if not os.path.exists(out_file):
+        return previous
+    with open(out_file, "rb") as f:
+        offset = 0
+        for line in f:
+            rec = json.loads(line)
+            key = (record_source(rec), record_file_hash(rec))
+            previous.setdefault(key, []).append(offset)
+            offset += len(line)
+    return previous
+
+
+def _ingest_worker(filepath: str, file_hash: str, conn):
+    """Run in a child process: extract one file and send back its JSONL lines.
+
+    The worker leads its own process group, so a timeout also kills the
+    page-range pool a large PDF may start (see _kill_worker).
+    """
+    if hasattr(os, "setpgrp"):
+        os.setpgrp()
+    try:
+        conn.send(("ok", [record_to_json(rec) for rec in process_file(filepath, file_hash)]))
+    except Exception as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def _kill_worker(proc):
+    """Kill a worker and every process it started (its process group, where supported)."""
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (AttributeError, ProcessLookupError, PermissionError):
+        proc.kill()   # no process groups, or the worker had not created its group yet
+    proc.join()
+
+
+def _run_parallel(jobs, workers: int, timeout: float):
+    """Extract files in worker processes, yielding (file, status, lines_or_error) as they finish.
+
+    One process per file keeps failures isolated: a crash or exception only
+    affects that file, and a file that exceeds `timeout` seconds is killed
+    along with any processes its worker started.
+    """
+    pending = list(jobs)
+    active = {}  # conn -> (process, file, deadline, started)
+    try:
+        yield from _drive_workers(pending, active, workers, timeout)
+    finally:
+        # Consumer stopped early (or failed): don't leave workers running
+        for conn, (proc, _, _, _) in active.items():
+            _kill_worker(proc)
+            conn.close()
+
+
+def _drive_workers(pending, active, workers, timeout):
+    while pending or active:
+        while pending and len(active) < workers:
+            file, file_hash = pending.pop(0)
+            parent_conn, child_conn = MP_CONTEXT.Pipe(duplex=False)
+            # Not a daemon: large PDFs may start their own page-range pool (killed with its group)
+            proc = MP_CONTEXT.Process(target=_ingest_worker, args=(str(file), file_hash, child_conn))
+            proc.start()
+            child_conn.close()
+            started = time.monotonic()
+            active[parent_conn] = (proc, file, started + timeout if timeout else None, started)
+
+        deadlines = [d for _, _, d, _ in active.values() if d is not None]
+        wait_for = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+        for conn in mp_connection.wait(list(active), timeout=wait_for):
+            proc, file, _, started = active.pop(conn)
+            try:
+                status, payload = conn.recv()
+            except EOFError:
+                status, payload = "error", "worker process died"
+            conn.close()
+            proc.join()
+            # Spans in the worker stay in its process; time the file from here instead
+            METRICS.observe("stage_seconds", time.monotonic() - started, stage="ingest.file")
+            yield file, status, payload
+
+        now = time.monotonic()
+        for conn, (proc, file, deadline, _) in list(active.items()):
+            if deadline is not None and now >= deadline:
+                _kill_worker(proc)
+                conn.close()
+                del active[conn]
+                yield file, "error", f"timed out after {timeout}s"
+
+
+def _run_serial(jobs):
+    for file, file_hash in jobs:
+        try:
+            with span("ingest.file", file=file.name):
+                lines = [record_to_json(rec) for rec in process_file(str(file), file_hash)]
+        except Exception as e:
+            yield file, "error", f"{type(e).__name__}: {e}"
             continue
+        yield file, "ok", lines
+
+
+def iter_records(data_dir: str, workers: int = 1, timeout: float = None, failures: list = None):
+    """Yield ingested records (as JSON dicts) file by file, as extraction finishes.
+
+    Failed files are printed, appended to `failures` if given, and skipped.
+    """
+    jobs = [(file, file_fingerprint(str(file))) for file in sorted(Path(data_dir).glob("*"))
+            if file.suffix.lower() in SUPPORTED_SUFFIXES]
+    if workers > 1 or timeout:
+        results = _run_parallel(jobs, max(1, workers), timeout)
+    else:
+        results = _run_serial(jobs)
+    try:
+        for file, status, payload in results:
+            if status != "ok":
+                print(f"❌ Failed to ingest {file}: {payload}")
+                METRICS.inc("ingest_failures")
+                if failures is not None:
+                    failures.append({"file": str(file), "error": payload})
+                continue
+            print(f"Ingested {len(payload)} records from {file}")
+            METRICS.inc("files_ingested")
+            METRICS.inc("records_ingested", len(payload))
+            for line in payload:
+                yield json.loads(line)
+    finally:
+        results.close()   # stops (and kills) any workers still running if we were closed early
+    prune_page_cache()
 
-        print(f"Ingested {len(recs)} records from {file}")
-        all_records.extend(recs)
 
-    with open(out_file, "w", encoding="utf-8") as f:
-        for rec in all_records:
-            if isinstance(rec, Document):
-                f.write(json.dumps({"text": rec.text, "metadata": rec.metadata}, ensure_ascii=False) + "\n")
-            else:
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+def ingest(data_dir: str, out_file: str, incremental: bool = False, workers: int = 1,
+           timeout: float = None):
+    """Ingest every supported file in data_dir into out_file (JSONL).
+
+    With workers > 1 (or a timeout) files are extracted in separate worker
+    processes. Records are streamed to disk as each file finishes; files that
+    fail or time out are skipped and listed in <out_file>.failures.jsonl.
+    """
+    with span("ingest", data_dir=str(data_dir)) as attrs:
+        attrs["records"] = _ingest(data_dir, out_file, incremental, workers, timeout)
+
+
+def _ingest(data_dir, out_file, incremental, workers, timeout):
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    previous = load_previous_records(out_file) if incremental else {}
+    tmp_file = f"{out_file}.tmp"
+    failures_file = f"{out_file}.failures.jsonl"
+    n_records = skipped = 0
+    failures = []
+
+    with open(tmp_file, "w", encoding="utf-8") as out:
+        jobs = []
+        with open(out_file, "rb") if previous else open(os.devnull, "rb") as old:
+            for file in sorted(Path(data_dir).glob("*")):
+                if file.suffix.lower() not in SUPPORTED_SUFFIXES:
+                    print(f"Skipping unsupported file type: {file}")
+                    continue
+
+                file_hash = file_fingerprint(str(file))
+                offsets = previous.get((file.name, file_hash))
+                if offsets:
+                    # Unchanged since the last run: copy its records as-is
+                    for offset in offsets:
+                        old.seek(offset)
+                        out.write(old.readline().decode("utf-8"))
+                    n_records += len(offsets)
+                    skipped += 1
+                    continue
+                jobs.append((file, file_hash))
+
+        if workers > 1 or timeout:
+            results = _run_parallel(jobs, max(1, workers), timeout)
+        else:
+            results = _run_serial(jobs)
+        for file, status, payload in results:
+            if status != "ok":
+                print(f"❌ Failed to ingest {file}: {payload}")
+                METRICS.inc("ingest_failures")
+                failures.append({"file": str(file), "error": payload})
+                continue
+            for line in payload:
+                out.write(line + "\n")
+            out.flush()
+            n_records += len(payload)
+            METRICS.inc("files_ingested")
+            METRICS.inc("records_ingested", len(payload))
+            print(f"Ingested {len(payload)} records from {file}")
+
+    os.replace(tmp_file, out_file)
+    prune_page_cache()
+    if failures:
+        with open(failures_file, "w", encoding="utf-8") as f:
+            for fail in failures:
+                f.write(json.dumps(fail, ensure_ascii=False) + "\n")
+        print(f"⚠️ {len(failures)} files failed, see {failures_file}")
+    elif os.path.exists(failures_file):
+        os.remove(failures_file)
 
-    print(f"✅ Saved {len(all_records)} records to {out_file}")
+    if incremental:
+        print(f"♻️ Reused records for {skipped} unchanged files")
+    print(f"✅ Saved {n_records} records to {out_file}")
+    return n_records
 
 
 # -------- Fixed paths --------
@@ -185,6 +566,11 @@ def ingest(data_dir: str, out_file: str):
 # ingest(INPUT_DIR, OUTPUT_FILE)
 INPUT_DIR = "input"
 OUTPUT_FILE = "ing_out_split_in/docs.jsonl"
+INCREMENTAL = True  # reuse records of files whose content hash is unchanged
+WORKERS = os.cpu_count() or 1  # files extracted in parallel (1 = in-process, serial)
+FILE_TIMEOUT = 300             # seconds per file before its worker is killed (parallel mode)
 
 # Run ingestion directly
-ingest(INPUT_DIR, OUTPUT_FILE)
\ No newline at end of file
+if __name__ == "__main__":
+    ingest(INPUT_DIR, OUTPUT_FILE, incremental=INCREMENTAL, workers=WORKERS, timeout=FILE_TIMEOUT)
+    print_summary()
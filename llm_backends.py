@@ -0,0 +1,100 @@
+import os
+import time
+
+# Generation backends. Anything with these two methods can be passed as
+# `backend=` to generator.generate_answer / stream_answer / astream_answer:
+#   generate(prompt, model_name) -> str            full answer in one call
+#   stream(prompt, model_name)   -> iterator[str]  answer pieces as they arrive
+# An optional `name` attribute identifies the backend in answer-cache keys
+# (the class name is used otherwise).
+
+
+class GeminiBackend:
+    """Google Gemini via google.generativeai.
+
+    Nothing is imported or configured until the first call, which reads
+    GEMINI_API_KEY (from the environment or .env) and raises if it is missing.
+    """
+
+    name = "gemini"
+
+    def __init__(self):
+        self._models = {}
+        self._genai = None
+
+    def _client(self):
+        if self._genai is None:
+            import google.generativeai as genai
+            from dotenv import load_dotenv
+            load_dotenv()
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("❌ GEMINI_API_KEY not found in .env")
+            genai.configure(api_key=api_key)
+            self._genai = genai
+        return self._genai
+
+    def _model(self, model_name):
+        model = self._models.get(model_name)
+        if model is None:
+            model = self._models[model_name] = self._client().GenerativeModel(model_name)
+        return model
+
+    def generate(self, prompt, model_name):
+        return self._model(model_name).generate_content(prompt).text
+
+    def stream(self, prompt, model_name):
+        for part in self._model(model_name).generate_content(prompt, stream=True):
+            text = _part_text(part)
+            if text:
+                yield text
+
+
+def _part_text(part):
+    """Text of one streamed response part, or "" for a part without text.
+
+    `.text` raises (ValueError) on blocked or safety-filtered parts, which
+    carry no candidate text.
+    """
+    try:
+        return getattr(part, "text", "") or ""
+    except ValueError:
+        return ""
+
+
+class FakeStreamingBackend:
+    """Offline stand-in for tests and benchmarks: no network, deterministic output.
+
+    Streams `answer` (default: an echo of the query line of the prompt)
+    word by word after `first_token_delay` seconds, then one word every
+    `token_delay` seconds. `calls` counts backend invocations.
+    """
+
+    name = "fake"
+
+    def __init__(self, answer=None, first_token_delay=0.2, token_delay=0.01):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.calls = 0
+
+    def _answer(self, prompt):
+        if self.answer is not None:
+            return self.answer
+        query = next((line[len("Query:"):].strip() for line in prompt.splitlines()
+                      if line.startswith("Query:")), "")
+        return f"Stub answer to: {query} [1]"
+
+    def stream(self, prompt, model_name):
+        self.calls += 1
+        time.sleep(self.first_token_delay)
+        words = self._answer(prompt).split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_delay)
+            yield word if i == len(words) - 1 else word + " "
+
+    def generate(self, prompt, model_name):
+        self.calls += 1
+        time.sleep(self.first_token_delay + self.token_delay * len(self._answer(prompt).split(" ")))
+        return self._answer(prompt)
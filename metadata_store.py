@@ -0,0 +1,372 @@
+import json
+import os
+import pickle
+import shutil
+import threading
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+
+# Layout of <gen_dir>/meta/ (every array is opened with mmap, nothing is read up front):
+#   ids.npy              sorted int64 vector ids; row i describes ids[i]
+#   text.bin             utf-8 chunk texts back to back
+#   text_offsets.npy     int64 [n+1] byte offsets into text.bin
+#   extra.bin            one small JSON object per row (page, chunk_id, pages, ...)
+#   extra_offsets.npy    int64 [n+1] byte offsets into extra.bin
+#   <field>.codes.npy    int32 dictionary codes of the categorical fields (-1 = None)
+#   vocab.json           code → value for each categorical field
+#   page.npy             int32 page number per row (-1 = None), for filtering
+STORE_DIR = "meta"
+CATEGORICAL_FIELDS = ("source", "source_url", "title", "strategy", "type")
+# Fields search(filters=...) accepts; file_type is the source's extension ("pdf", "md", ...)
+FILTER_FIELDS = CATEGORICAL_FIELDS + ("page", "file_type")
+MASK_CACHE_ENTRIES = 256   # (field, value) row masks kept per store, least recently used evicted
+BITMAP_CACHE_ENTRIES = 64  # filter id bitmaps (one per distinct filter set) kept per store, LRU
+
+
+def file_type(source):
+    return Path(source).suffix.lower().lstrip(".") if source else None
+
+
+def normalize_filters(filters):
+    """Hashable canonical form of {field: value or [values]}; None/empty means no filter.
+
+    Within a field the values are OR-ed, across fields AND-ed. page values
+    must be integers (or digit strings), the other fields' values strings;
+    anything else raises ValueError.
+    """
+    if not filters:
+        return None
+    out = []
+    for field, values in filters.items():
+        if field not in FILTER_FIELDS:
+            raise ValueError(f"Cannot filter on {field!r}; expected one of {FILTER_FIELDS}")
+        if values is None or values == [] or values == ():
+            continue
+        if not isinstance(values, (list, tuple, set, frozenset)):
+            values = [values]
+        values = [_filter_value(field, v) for v in values]
+        out.append((field, tuple(sorted(set(values), key=str))))
+    return tuple(sorted(out)) or None
+
+
+def _filter_value(field, value):
+    if field == "page":
+        if isinstance(value, str) and value.strip().lstrip("-").isdigit():
+            return int(value)
+        if isinstance(value, int) and not isinstance(value, bool):
+            return value
+        raise ValueError(f"page filter values must be integers, got {value!r}")
+    if not isinstance(value, str):
+        raise ValueError(f"{field} filter values must be strings, got {value!r}")
+    return value
+
+
+def matches(entry, filters):
+    """Python-side check of one metadata entry against normalize_filters() output."""
+    for field, values in filters:
+        value = file_type(entry.get("source")) if field == "file_type" else entry.get(field)
+        if value not in values:
+            return False
+    return True
+
+
+def _open_bytes(path):
+    """Memory-map a byte blob (np.memmap cannot map an empty file)."""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype="uint8")
+    return np.memmap(path, dtype="uint8", mode="r")
+
+
+class MetadataWriter:
+    """Append rows to a new metadata store without holding the texts in memory.
+
+    Rows must be added in increasing id order. Only the offsets, codes and
+    ids (a few bytes per row) stay in memory; texts go straight to disk.
+    The store is written to <gen_dir>/meta, where gen_dir is a generation
+    that readers only see once its manifest is committed
+    (embed_index.save_index_files), so it needs no swap of its own.
+    """
+
+    def __init__(self, gen_dir):
+        self.root = Path(gen_dir) / STORE_DIR
+        shutil.rmtree(self.root, ignore_errors=True)
+        self.root.mkdir(parents=True)
+        self._text = open(self.root / "text.bin", "wb")
+        self._extra = open(self.root / "extra.bin", "wb")
+        self.ids = array("q")
+        self.text_offsets = array("q", [0])
+        self.extra_offsets = array("q", [0])
+        self.codes = {f: array("i") for f in CATEGORICAL_FIELDS}
+        self.vocab = {f: {} for f in CATEGORICAL_FIELDS}
+        self.pages = array("i")
+
+    def add(self, vid, entry):
+        if self.ids and vid <= self.ids[-1]:
+            raise ValueError(f"ids must be added in increasing order ({vid} after {self.ids[-1]})")
+        self.ids.append(vid)
+        text = entry["text"].encode("utf-8")
+        self._text.write(text)
+        self.text_offsets.append(self.text_offsets[-1] + len(text))
+        for field in CATEGORICAL_FIELDS:
+            value = entry.get(field)
+            values = self.vocab[field]
+            self.codes[field].append(-1 if value is None else values.setdefault(value, len(values)))
+        page = entry.get("page")
+        self.pages.append(page if isinstance(page, int) else -1)
+        skip = set(CATEGORICAL_FIELDS) | {"text"}
+        extra = json.dumps({k: v for k, v in entry.items() if k not in skip}, ensure_ascii=False).encode("utf-8")
+        self._extra.write(extra)
+        self.extra_offsets.append(self.extra_offsets[-1] + len(extra))
+
+    def close(self):
+        self._text.close()
+        self._extra.close()
+        np.save(self.root / "ids.npy", np.frombuffer(self.ids, dtype="int64"))
+        np.save(self.root / "text_offsets.npy", np.frombuffer(self.text_offsets, dtype="int64"))
+        np.save(self.root / "extra_offsets.npy", np.frombuffer(self.extra_offsets, dtype="int64"))
+        for field in CATEGORICAL_FIELDS:
+            np.save(self.root / f"{field}.codes.npy", np.frombuffer(self.codes[field], dtype="int32"))
+        np.save(self.root / "page.npy", np.frombuffer(self.pages, dtype="int32"))
+        with open(self.root / "vocab.json", "w", encoding="utf-8") as f:
+            json.dump({field: list(values) for field, values in self.vocab.items()}, f, ensure_ascii=False)
+
+
+def write_metadata_store(metadata, gen_dir):
+    """Write {vector id → entry} as the columnar store in <gen_dir>/meta."""
+    writer = MetadataWriter(gen_dir)
+    for vid in sorted(metadata):
+        writer.add(int(vid), metadata[vid])
+    writer.close()
+
+
+class MetadataStore:
+    """Read-only, memory-mapped view of the metadata written by write_metadata_store.
+
+    Behaves like the old {vector id → entry} dict for lookups (store[idx],
+    idx in store, len(store), store.get(idx)), but only the rows that are
+    actually requested are decoded. Opening is O(1) in corpus size apart
+    from the small categorical vocabularies, and the OS shares the mapped
+    pages between all processes that serve the same index.
+    """
+
+    def __init__(self, index_dir):
+        root = Path(index_dir) / STORE_DIR
+        self.root = root
+        self.ids = np.load(root / "ids.npy", mmap_mode="r")
+        self._text = _open_bytes(root / "text.bin")
+        self._text_offsets = np.load(root / "text_offsets.npy", mmap_mode="r")
+        self._extra = _open_bytes(root / "extra.bin")
+        self._extra_offsets = np.load(root / "extra_offsets.npy", mmap_mode="r")
+        self.codes = {f: np.load(root / f"{f}.codes.npy", mmap_mode="r") for f in CATEGORICAL_FIELDS}
+        with open(root / "vocab.json", "r", encoding="utf-8") as f:
+            self.vocab = json.load(f)
+        self._pages = None
+        self._masks = OrderedDict()     # (field, value) → bool row mask, LRU of MASK_CACHE_ENTRIES
+        self._bitmaps = OrderedDict()   # normalized filters → packed id bitmap, LRU of BITMAP_CACHE_ENTRIES
+        self._cache_lock = threading.Lock()   # both caches are shared by concurrent requests
+
+    def __len__(self):
+        return len(self.ids)
+
+    def row_of(self, vid):
+        """Row position of a vector id, or -1 if it is not in the store."""
+        pos = int(np.searchsorted(self.ids, vid))
+        if pos < len(self.ids) and self.ids[pos] == vid:
+            return pos
+        return -1
+
+    def __contains__(self, vid):
+        return self.row_of(vid) >= 0
+
+    def __getitem__(self, vid):
+        row = self.row_of(vid)
+        if row < 0:
+            raise KeyError(vid)
+        return self.row(row)
+
+    def get(self, vid, default=None):
+        row = self.row_of(vid)
+        return self.row(row) if row >= 0 else default
+
+    def text(self, row):
+        a, b = self._text_offsets[row], self._text_offsets[row + 1]
+        return self._text[a:b].tobytes().decode("utf-8")
+
+    def row(self, row):
+        """Decode one row into the entry dict used by search()."""
+        a, b = self._extra_offsets[row], self._extra_offsets[row + 1]
+        entry = {"text": self.text(row)}
+        for field in CATEGORICAL_FIELDS:
+            code = int(self.codes[field][row])
+            entry[field] = self.vocab[field][code] if code >= 0 else None
+        entry.update(json.loads(self._extra[a:b].tobytes().decode("utf-8")))
+        if entry.get("strategy") != "table_whole":
+            entry.pop("type", None)  # only table chunks carry a type
+        return entry
+
+    @property
+    def pages(self):
+        if self._pages is None:
+            path = self.root / "page.npy"
+            if path.exists():
+                self._pages = np.load(path, mmap_mode="r")
+            else:  # stores written before page.npy existed
+                pages = [self.row(r).get("page") for r in range(len(self))]
+                self._pages = np.array([p if isinstance(p, int) else -1 for p in pages], dtype="int32")
+        return self._pages
+
+    def _value_mask(self, field, value):
+        key = (field, value)
+        with self._cache_lock:
+            mask = self._masks.get(key)
+            if mask is not None:
+                self._masks.move_to_end(key)
+                return mask
+        if field == "page":
+            mask = np.asarray(self.pages) == int(value)
+        elif field == "file_type":
+            codes = [c for c, v in enumerate(self.vocab["source"]) if file_type(v) == value]
+            mask = np.isin(self.codes["source"], codes)
+        elif value in self.vocab[field]:
+            mask = np.asarray(self.codes[field]) == self.vocab[field].index(value)
+        else:
+            mask = np.zeros(len(self), dtype=bool)
+        with self._cache_lock:
+            self._masks[key] = mask
+            while len(self._masks) > MASK_CACHE_ENTRIES:
+                self._masks.popitem(last=False)
+        return mask
+
+    def mask(self, filters):
+        """Boolean row mask for normalize_filters() output (None → all rows)."""
+        result = np.ones(len(self), dtype=bool)
+        for field, values in filters or ():
+            any_of = np.zeros(len(self), dtype=bool)
+            for value in values:
+                any_of |= self._value_mask(field, value)
+            result &= any_of
+        return result
+
+    def filter_bitmap(self, filters):
+        """Packed little-endian bitmap over vector ids (bit id set = row matches), cached."""
+        with self._cache_lock:
+            bitmap = self._bitmaps.get(filters)
+            if bitmap is not None:
+                self._bitmaps.move_to_end(filters)
+                return bitmap
+        n = int(self.ids[-1]) + 1 if len(self.ids) else 0
+        bits = np.zeros(n, dtype=bool)
+        bits[np.asarray(self.ids)[self.mask(filters)]] = True
+        bitmap = np.packbits(bits, bitorder="little")
+        with self._cache_lock:
+            self._bitmaps[filters] = bitmap
+            while len(self._bitmaps) > BITMAP_CACHE_ENTRIES:
+                self._bitmaps.popitem(last=False)
+        return bitmap
+
+    def field_values(self, field):
+        """Distinct values of a filterable field (for UI pickers)."""
+        if field == "page":
+            return sorted(int(p) for p in np.unique(self.pages) if p >= 0)
+        if field == "file_type":
+            return sorted({file_type(v) for v in self.vocab["source"] if file_type(v)})
+        return sorted(v for v in self.vocab[field] if v is not None)
+
+    def get_many(self, vids):
+        """Entries for several ids at once (missing ids → None)."""
+        ids = np.asarray(vids, dtype="int64")
+        if len(self.ids) == 0:
+            return [None] * len(ids)
+        rows = np.minimum(np.searchsorted(self.ids, ids), len(self.ids) - 1)
+        found = self.ids[rows] == ids
+        return [self.row(int(r)) if ok else None for r, ok in zip(rows, found)]
+
+    def keys(self):
+        return (int(i) for i in self.ids)
+
+    def items(self):
+        for row, vid in enumerate(self.ids):
+            yield int(vid), self.row(row)
+
+    def to_dict(self):
+        """Materialize everything (offline tools only, e.g. incremental rebuilds)."""
+        return dict(self.items())
+
+
+def lookup_many(metadata, ids):
+    """{id → entry} for the non-negative ids of a FAISS result matrix, in one lookup.
+
+    Works with a MetadataStore (one vectorized searchsorted) and with the
+    legacy dict.
+    """
+    uniq = np.unique(np.asarray(ids, dtype="int64"))
+    uniq = uniq[uniq >= 0]
+    if hasattr(metadata, "get_many"):
+        return {int(i): entry for i, entry in zip(uniq, metadata.get_many(uniq))}
+    return {int(i): metadata[int(i)] for i in uniq}
+
+
+def format_hits(scores, ids, metadata):
+    """Result dicts for one row of FAISS output.
+
+    ids of -1 are skipped, and so are ids with no metadata row (e.g. a
+    vector whose row was removed), rather than failing the whole result.
+    """
+    results = []
+    for rank, idx in enumerate(ids):
+        if idx == -1:
+            continue
+        meta = metadata.get(int(idx))
+        if meta is None:
+            continue
+
+        # ✅ Prefer URL if available, fallback to local source
+        source_link = meta.get("source_url") or meta.get("source")
+
+        result = {
+            "rank": rank + 1,
+            "score": float(scores[rank]),
+            "text": meta["text"],
+            "source": source_link,   # unified source field
+            "title": meta.get("title"),
+            "page": meta.get("page"),
+            "paragraph_id": meta.get("paragraph_id"),
+            "parent_id": meta.get("parent_id"),
+            "chunk_id": meta.get("chunk_id"),
+            "strategy": meta.get("strategy")
+        }
+        # Add table metadata if present
+        if meta.get("strategy") == "table_whole":
+            result["type"] = meta.get("type")
+            result["table_index"] = meta.get("table_index")
+            result["section"] = meta.get("section")
+            result["pages"] = meta.get("pages")
+        results.append(result)
+    return results
+
+
+def filter_bitmap(metadata, filters):
+    """filter_bitmap for either a MetadataStore or a legacy {id: entry} dict."""
+    if hasattr(metadata, "filter_bitmap"):
+        return metadata.filter_bitmap(filters)
+    ids = [vid for vid, entry in metadata.items() if matches(entry, filters)]
+    bits = np.zeros(max(metadata, default=-1) + 1, dtype=bool)
+    bits[ids] = True
+    return np.packbits(bits, bitorder="little")
+
+
+def row_mask(metadata, filters):
+    """Row mask aligned with the store's sorted ids (what the BM25 index uses)."""
+    if hasattr(metadata, "mask"):
+        return metadata.mask(filters)
+    return np.array([matches(metadata[vid], filters) for vid in sorted(metadata)], dtype=bool)
+
+
+def load_metadata(index_dir):
+    """Open the metadata in a data dir (embed_index.data_dir): mmap store if present, else legacy metadata.pkl."""
+    if (Path(index_dir) / STORE_DIR / "ids.npy").exists():
+        return MetadataStore(index_dir)
+    with open(f"{index_dir}/metadata.pkl", "rb") as f:
+        return pickle.load(f)
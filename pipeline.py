@@ -0,0 +1,173 @@
+import json
+import queue
+import threading
+import time
+from itertools import islice
+from pathlib import Path
+import numpy as np
+
+from embed_cache import load_embed_model
+from embed_index import IndexBuilder
+from ingest import iter_records
+from splitter import iter_chunks
+from telemetry import METRICS, print_summary, span
+
+
+# ---------- Streaming helpers ----------
+def batched(iterable, n):
+    """Yield lists of up to n items."""
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+def prefetch(iterable, depth=4):
+    """Run an iterator in a background thread, keeping at most `depth` items buffered.
+
+    The bounded queue gives backpressure (the producer blocks when the
+    consumer falls behind) while letting both sides work at the same time.
+    Exceptions raised by the producer are re-raised in the consumer. If the
+    consumer stops early, the producer stops too and closes `iterable`
+    (for iter_records, that shuts down its worker processes).
+    """
+    q = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        it = iter(iterable)
+        try:
+            for item in it:
+                if not put(item):
+                    break
+        except BaseException as e:
+            put(e)
+        else:
+            put(done)
+        finally:
+            if hasattr(it, "close"):
+                it.close()
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item = q.get()
+            if item is done:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def tee_jsonl(iterable, path):
+    """Pass items through while writing each one to a JSONL checkpoint file."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for item in iterable:
+            # Pooled chunk vectors (splitter reuse_vectors) only live in the stream
+            f.write(json.dumps({k: v for k, v in item.items() if k != "embedding"}, ensure_ascii=False) + "\n")
+            yield item
+
+
+def read_jsonl(path):
+    """Stream records/chunks back from a checkpoint file."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+
+# ---------- Pipeline ----------
+def run_pipeline(data_dir, out_dir, embed_model_name, chunk_size=800, batch_size=64, workers=1,
+                 timeout=None, index_type="flat", metric="cosine", index_opts=None,
+                 ingest_checkpoint=None, split_checkpoint=None, queue_depth=4, split_opts=None):
+    """ingest → split → embed → index as a chain of generators over bounded queues.
+
+    Ingestion (worker processes, see ingest.MP_CONTEXT) and splitting (a
+    background thread) run ahead of embedding, so batch N is embedded while
+    batch N+1 is being split. No stage materializes its whole input: records and chunks flow
+    through in fixed-size batches and metadata is written to disk as it
+    arrives; only the FAISS index grows with the corpus. Pass
+    ingest_checkpoint / split_checkpoint to also write the usual JSONL
+    hand-off files. split_opts go to splitter.iter_chunks (strategy, overlap,
+    pdf_chunk_size, pdf_overlap, reuse_vectors). Always builds a fresh index
+    (use the stage scripts for incremental updates).
+    """
+    t0 = time.perf_counter()
+    embed_model = load_embed_model(embed_model_name, embed_batch_size=batch_size)
+
+    records = iter_records(data_dir, workers=workers, timeout=timeout)
+    if ingest_checkpoint:
+        records = tee_jsonl(records, ingest_checkpoint)
+    records = prefetch(records, queue_depth)
+
+    chunks = iter_chunks(records, chunk_size, embed_model=embed_model, **(split_opts or {}))
+    if split_checkpoint:
+        chunks = tee_jsonl(chunks, split_checkpoint)
+    batches = prefetch(batched(chunks, batch_size), queue_depth)
+
+    builder = IndexBuilder(out_dir, embed_model_name, index_type=index_type, metric=metric,
+                           **(index_opts or {}))
+    n_chunks = 0
+    try:
+        while True:
+            # Time spent here means ingestion/splitting, not embedding, is the bottleneck
+            with span("pipeline.wait"):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            # Chunks that already carry a pooled sentence vector skip the encoder
+            missing = [c["text"] for c in batch if "embedding" not in c]
+            with span("embed", chunks=len(missing)):
+                fresh = iter(embed_model.get_text_embedding_batch(missing) if missing else [])
+            METRICS.inc("chunks_embedded", len(missing))
+            vectors = np.asarray([c["embedding"] if "embedding" in c else next(fresh) for c in batch],
+                                 dtype="float32")
+            with span("index.add", vectors=len(batch)):
+                builder.add(batch, vectors)
+            n_chunks += len(batch)
+    finally:
+        batches.close()   # on failure, stops the upstream threads and ingest workers
+    with span("index.finish"):
+        builder.finish()
+
+    elapsed = time.perf_counter() - t0
+    print(f"✅ Pipeline indexed {n_chunks} chunks in {elapsed:.1f}s ({n_chunks / max(elapsed, 1e-9):.1f} chunks/sec)")
+
+
+# Configuration + direct execution
+INPUT_DIR = "ingestion_input"
+OUTPUT_DIR = "emd_out_retr_in"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+CHUNK_SIZE = 800
+BATCH_SIZE = 64
+INGEST_WORKERS = 4
+FILE_TIMEOUT = 300
+INGEST_CHECKPOINT = "ing_out_split_in/docs.jsonl"   # None to skip the hand-off files
+SPLIT_CHECKPOINT = "split_out_emd_in/docs.jsonl"
+SPLIT_OPTS = {"strategy": "semantic", "pdf_chunk_size": 800, "pdf_overlap": 200, "reuse_vectors": False}
+
+if __name__ == "__main__":
+    run_pipeline(
+        INPUT_DIR,
+        OUTPUT_DIR,
+        EMBED_MODEL,
+        chunk_size=CHUNK_SIZE,
+        batch_size=BATCH_SIZE,
+        workers=INGEST_WORKERS,
+        timeout=FILE_TIMEOUT,
+        ingest_checkpoint=INGEST_CHECKPOINT,
+        split_checkpoint=SPLIT_CHECKPOINT,
+        split_opts=SPLIT_OPTS,
+    )
+    print_summary()
@@ -0,0 +1,143 @@
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+
+# Fixed configuration
+QUERY_CACHE_MAX_BYTES = 64 * 1024 * 1024   # shared by both levels
+QUERY_CACHE_TTL = 600                      # seconds a cached result list stays valid (None = forever)
+
+
+def normalize_query(query):
+    """Canonical form used as cache key: NFKC, trimmed, single spaces."""
+    return " ".join(unicodedata.normalize("NFKC", query).split())
+
+
+def results_nbytes(results):
+    """Rough memory footprint of a result list (texts dominate)."""
+    return sum(200 + len(r.get("text") or "") for r in results)
+
+
+class LRUCache:
+    """Thread-safe in-memory LRU map bounded by total bytes, with optional TTL.
+
+    Each entry carries the byte size given to put(); the least recently used
+    entries are dropped once the total exceeds max_bytes. Entries older than
+    ttl seconds count as misses and are removed on access.
+    """
+
+    def __init__(self, max_bytes, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._data = OrderedDict()   # key → (value, nbytes, stored_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[2] > self.ttl:
+                self._drop(key)
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key, value, nbytes):
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (value, nbytes, time.monotonic())
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._drop(next(iter(self._data)))
+                self.evictions += 1
+
+    def _drop(self, key):
+        _, nbytes, _ = self._data.pop(key)
+        self.nbytes -= nbytes
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+class QueryCache:
+    """Two-level cache in front of search().
+
+    Level 1: (model, normalized query) → query vector, so a repeated query
+    never reaches the transformer. Level 2: (index snapshot, query, k,
+    search params) → result list. The snapshot key names the save the
+    searched index was opened from (IndexSnapshot.cache_key), so results
+    of an older index are never served for a newer one; they simply age
+    out of the LRU.
+    """
+
+    def __init__(self, max_bytes=QUERY_CACHE_MAX_BYTES, ttl=QUERY_CACHE_TTL):
+        # Vectors are small and do not depend on the index: no TTL
+        self.embeddings = LRUCache(max_bytes // 4)
+        self.results = LRUCache(max_bytes - max_bytes // 4, ttl=ttl)
+
+    def query_embedding(self, embed_model, query):
+        """float32 query vector, computed once per (model, normalized query)."""
+        key = (getattr(embed_model, "model_name", None), normalize_query(query))
+        vec = self.embeddings.get(key)
+        if vec is None:
+            vec = np.asarray(embed_model.get_text_embedding(key[1]), dtype="float32")
+            self.embeddings.put(key, vec, vec.nbytes + 100 + len(key[1]))
+        return vec
+
+    def query_embeddings(self, embed_model, queries):
+        """[n, d] float32 query matrix; only uncached queries go to the model, in one batch."""
+        model_name = getattr(embed_model, "model_name", None)
+        texts = [normalize_query(q) for q in queries]
+        vecs = [self.embeddings.get((model_name, t)) for t in texts]
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vecs) if v is None))
+        if missing:
+            fresh = dict(zip(missing, np.asarray(embed_model.get_text_embedding_batch(missing), dtype="float32")))
+            for t, vec in fresh.items():
+                self.embeddings.put((model_name, t), vec, vec.nbytes + 100 + len(t))
+            vecs = [fresh[t] if v is None else v for t, v in zip(texts, vecs)]
+        return np.stack(vecs)
+
+    def get_results(self, key):
+        hit = self.results.get(key)
+        return None if hit is None else [dict(r) for r in hit]   # callers may mutate
+
+    def put_results(self, key, results):
+        self.results.put(key, [dict(r) for r in results], results_nbytes(results))
+
+    def clear(self):
+        self.embeddings.clear()
+        self.results.clear()
+
+    def stats(self):
+        return {"embeddings": self.embeddings.stats(), "results": self.results.stats()}
+
+
+# Process-wide cache shared by generator.search / retriver.search
+QUERY_CACHE = QueryCache()
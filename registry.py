@@ -0,0 +1,157 @@
+import threading
+import time
+import faiss
+
+from embed_index import (LEGACY_MANIFEST, data_dir, index_version, is_compressed, load_embed_model,
+                         load_full_vectors, load_manifest)
+from llm_backends import GeminiBackend
+from metadata_store import load_metadata
+from sharded_index import is_sharded, load_sharded_index
+from sparse_index import load_sparse_index
+
+# Fixed configuration
+INDEX_DIR = "emd_out_retr_in"
+EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+LOAD_SHARDS = None   # sharded indexes only: e.g. [0, 1] to serve a subset of the shards
+INDEX_CHECK_INTERVAL = 1.0   # seconds between checks for a newly saved index (None = never reload)
+
+
+class IndexSnapshot:
+    """Everything a search reads from one saved index, opened together.
+
+    index and metadata are what search() takes; manifest, sparse (BM25
+    index or None) and full_vectors (re-scoring vectors of compressed
+    indexes or None) are used with them, so a search never mixes files of
+    two saves. version is the index_version the snapshot was opened at
+    (None for indexes not opened from a directory). For a sharded index,
+    index is the ShardedIndex and the rest is per shard.
+    """
+
+    def __init__(self, index, metadata, manifest=None, sparse=None, full_vectors=None, version=None,
+                 index_dir=None):
+        self.index = index
+        self.metadata = metadata
+        self.manifest = manifest
+        self.sparse = sparse
+        self.full_vectors = full_vectors
+        self.version = version
+        self.index_dir = index_dir
+
+    @property
+    def cache_key(self):
+        """Identifies the save this snapshot was opened from, for result caches (None: do not cache)."""
+        if self.version is None:
+            return None
+        return self.index_dir, self.version, (self.manifest or {}).get("generation")
+
+
+def open_index(index_dir, shards=None):
+    """IndexSnapshot of index_dir.
+
+    The manifest is read once and every file comes from the generation it
+    names (embed_index.data_dir), all of them written before that manifest.
+    """
+    version = index_version(index_dir)
+    if is_sharded(index_dir):
+        return IndexSnapshot(load_sharded_index(index_dir, shards), None, version=version, index_dir=index_dir)
+    manifest = load_manifest(index_dir) or LEGACY_MANIFEST
+    root = data_dir(index_dir, manifest)
+    full_vectors = None
+    if is_compressed(manifest.get("index_type", "flat"), manifest.get("index_opts", {})):
+        full_vectors = load_full_vectors(root, manifest["dim"])
+    return IndexSnapshot(
+        faiss.read_index(str(root / "faiss.index")),
+        load_metadata(root),  # memory-mapped, rows decoded on access
+        manifest,
+        load_sparse_index(root),
+        full_vectors,
+        version,
+        index_dir,
+    )
+
+
+class Registry:
+    """Process-wide resources, each loaded on first use and shared by every caller.
+
+    Importing the modules that use it costs nothing; the embedding model,
+    the index and the LLM client are created the first time they are asked
+    for (once, even under concurrent first requests). The index is reloaded
+    when a newer one has been saved to index_dir: a new IndexSnapshot is
+    opened off to the side and swapped in with one assignment. A request
+    that searches one snapshot (snapshot(), passed to search_batch) sees
+    only files of one save, even if a newer index is swapped in meanwhile.
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, embed_model_name=EMBED_MODEL, shards=LOAD_SHARDS,
+                 check_interval=INDEX_CHECK_INTERVAL):
+        self.index_dir = index_dir
+        self.embed_model_name = embed_model_name
+        self.shards = shards
+        self.check_interval = check_interval
+        self.llm = GeminiBackend()   # connects on first generate/stream
+        self._embed_model = None
+        self._loaded = None          # IndexSnapshot, replaced as a whole
+        self._checked_at = 0.0
+        self._model_lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self.index_loads = 0
+
+    @property
+    def embed_model(self):
+        if self._embed_model is None:
+            with self._model_lock:
+                if self._embed_model is None:
+                    self._embed_model = load_embed_model(self.embed_model_name)
+        return self._embed_model
+
+    def snapshot(self):
+        """Current IndexSnapshot, reloading it if a newer index was saved."""
+        loaded = self._loaded
+        if loaded is None or self._stale(loaded):
+            loaded = self.reload_index(loaded)
+        return loaded
+
+    def index(self):
+        """(index, metadata) of the current snapshot."""
+        snap = self.snapshot()
+        return snap.index, snap.metadata
+
+    def snapshot_of(self, index, metadata):
+        """The loaded snapshot if index and metadata are its objects, else None."""
+        snap = self._loaded
+        if snap is not None and snap.index is index and snap.metadata is metadata:
+            return snap
+        return None
+
+    def _stale(self, loaded):
+        if self.check_interval is None or time.monotonic() - self._checked_at < self.check_interval:
+            return False
+        self._checked_at = time.monotonic()
+        return index_version(self.index_dir) != loaded.version
+
+    def reload_index(self, seen=None):
+        """Load index_dir and swap it in (one loader at a time; others wait and reuse its result)."""
+        with self._index_lock:
+            if self._loaded is not seen:
+                return self._loaded   # another thread already swapped in a newer index
+            self._loaded = open_index(self.index_dir, self.shards)
+            self._checked_at = time.monotonic()
+            self.index_loads += 1
+            return self._loaded
+
+    def warm_up(self):
+        """Load the model and index now (e.g. at service startup) instead of on the first query."""
+        self.embed_model
+        self.index()
+
+    def stats(self):
+        return {
+            "embed_model_loaded": self._embed_model is not None,
+            "index_loaded": self._loaded is not None,
+            "index_version": self._loaded.version if self._loaded else None,
+            "index_loads": self.index_loads,
+        }
+
+
+# Shared by the UI, the HTTP service and the CLIs
+REGISTRY = Registry()
@@ -0,0 +1,124 @@
+import hashlib
+import threading
+import time
+
+from query_cache import LRUCache, normalize_query
+from telemetry import record
+
+# Fixed configuration
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"   # ~22M params, fine on CPU
+RERANK_CANDIDATES = 20      # FAISS candidates fetched per query before reranking
+RERANK_BATCH_SIZE = 16      # (query, chunk) pairs scored per forward pass
+RERANK_BUDGET_MS = 300      # per-request time budget (None = no limit)
+RERANK_CACHE_MAX_BYTES = 8 * 1024 * 1024
+
+
+class CrossEncoderReranker:
+    """Re-score search candidates with a cross-encoder and keep the best k.
+
+    Pair scores are cached by (model, normalized query, chunk text hash), so
+    a repeated query or a chunk seen again with the same query costs
+    nothing. Pairs are scored in batches, and a batch is only started if
+    the time left covers the last observed batch time; if the budget runs
+    out before all candidates are scored, the original (FAISS) order is kept
+    for that request. `model` may be any object with predict(pairs) -> scores;
+    by default the sentence-transformers CrossEncoder is loaded by warm_up(),
+    or, for a request with a budget, in the background (that request keeps
+    the FAISS order).
+    """
+
+    def __init__(self, model_name=RERANK_MODEL, batch_size=RERANK_BATCH_SIZE, model=None,
+                 cache_max_bytes=RERANK_CACHE_MAX_BYTES):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self._model = model
+        self._load_lock = threading.Lock()
+        self._loading = None
+        self._batch_sec = 0.0   # duration of the last scored batch
+        self.cache = LRUCache(cache_max_bytes)
+        self._stats_lock = threading.Lock()   # counters are updated by concurrent requests
+        self.requests = 0
+        self.timeouts = 0
+        self.pairs_scored = 0
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._load_lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def warm_up(self):
+        """Load the model and run one forward pass now (e.g. at service startup)."""
+        self.model.predict([("warm up", "model load")])
+
+    def _load_in_background(self):
+        with self._load_lock:
+            if self._loading is None:
+                self._loading = threading.Thread(target=lambda: self.model, daemon=True)
+                self._loading.start()
+
+    def _key(self, query, text):
+        return (self.model_name, query, hashlib.sha1(text.encode("utf-8")).hexdigest())
+
+    def rerank(self, query, candidates, k, budget_ms=RERANK_BUDGET_MS, timings=None):
+        """Best k of candidates (search() result dicts) by cross-encoder score.
+
+        Returned dicts keep the retrieval "score" and gain "rerank_score";
+        "rank" is renumbered. On a budget overrun the first k candidates are
+        returned unchanged. If `timings` is a dict it receives rerank_sec,
+        pairs_scored and timed_out.
+        """
+        t0 = time.perf_counter()
+        deadline = t0 + budget_ms / 1000 if budget_ms is not None else None
+        cache_query = normalize_query(query)   # cache key only; the model scores the raw query
+        keys = [self._key(cache_query, c["text"]) for c in candidates]
+        scores = [self.cache.get(key) for key in keys]
+        todo = [i for i, s in enumerate(scores) if s is None]
+
+        timed_out = False
+        scored = 0
+        if todo and deadline is not None and self._model is None:
+            # A cold model load alone takes far longer than a request budget
+            self._load_in_background()
+            todo, timed_out = [], True
+        for start in range(0, len(todo), self.batch_size):
+            tb = time.perf_counter()
+            if deadline is not None and tb + self._batch_sec > deadline:
+                timed_out = True
+                break
+            batch = todo[start:start + self.batch_size]
+            batch_scores = self.model.predict([(query, candidates[i]["text"]) for i in batch])
+            for i, s in zip(batch, batch_scores):
+                scores[i] = float(s)
+                self.cache.put(keys[i], scores[i], 200)
+            scored += len(batch)
+            self._batch_sec = time.perf_counter() - tb
+        with self._stats_lock:
+            self.requests += 1
+            self.timeouts += timed_out
+            self.pairs_scored += scored
+
+        elapsed = time.perf_counter() - t0
+        record("rerank", elapsed, t0, candidates=len(candidates), pairs_scored=scored, timed_out=timed_out)
+        if timings is not None:
+            timings.update(rerank_sec=elapsed, pairs_scored=scored, timed_out=timed_out)
+        if timed_out:
+            return [dict(c) for c in candidates[:k]]
+        order = sorted(range(len(candidates)), key=lambda i: -scores[i])[:k]
+        return [{**candidates[i], "rank": rank, "rerank_score": scores[i]} for rank, i in enumerate(order, start=1)]
+
+    def stats(self):
+        with self._stats_lock:
+            counts = {"requests": self.requests, "timeouts": self.timeouts, "pairs_scored": self.pairs_scored}
+        return {
+            **counts,
+            "model_loaded": self._model is not None,
+            "cache": self.cache.stats(),
+        }
+
+
+# Process-wide reranker (the model loads at warm_up, or on first use)
+RERANKER = CrossEncoderReranker()
@@ -0,0 +1,248 @@
+import asyncio
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Literal, Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+from generator import search_batch, generate_answer, astream_answer, DEFAULT_MODEL
+from registry import REGISTRY
+from answer_cache import ANSWER_CACHE
+from query_cache import QUERY_CACHE
+from metadata_store import normalize_filters
+from llm_backends import FakeStreamingBackend
+from reranker import RERANKER, RERANK_CANDIDATES, RERANK_BUDGET_MS
+from telemetry import METRICS, SIZE_BUCKETS
+
+# Fixed configuration
+HOST = "0.0.0.0"
+PORT = 8000
+MAX_BATCH_SIZE = 32     # queries embedded + searched together
+MAX_WAIT_MS = 5         # how long the first query of a batch waits for company
+LLM_BACKEND = os.getenv("RAG_LLM_BACKEND", "gemini")   # "fake" for offline load tests
+
+
+# ---------- Micro-batching ----------
+class MicroBatcher:
+    """Collect concurrent requests into batches for one blocking call.
+
+    submit() enqueues an item and awaits its result. A single background
+    task takes the first waiting item, keeps collecting for up to
+    max_wait_ms or until max_batch_size items are queued, then runs
+    fn(items) -> results in a worker thread. The next batch fills up while
+    the current one runs. A result that is an exception fails only its own
+    request; an exception raised by fn fails the whole batch.
+    """
+
+    def __init__(self, fn, max_batch_size=MAX_BATCH_SIZE, max_wait_ms=MAX_WAIT_MS):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.batches = 0
+        self.items = 0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    async def submit(self, item):
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, fut))
+        return await fut
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            self.batches += 1
+            self.items += len(batch)
+            METRICS.observe("batch_size", len(batch), SIZE_BUCKETS)
+            try:
+                results = await loop.run_in_executor(None, self.fn, [item for item, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+            for (_, fut), result in zip(batch, results):
+                if fut.done():  # the client may have gone away
+                    continue
+                if isinstance(result, Exception):
+                    fut.set_exception(result)
+                else:
+                    fut.set_result(result)
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "queries": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
+
+
+def search_items(items):
+    """Batch function: items are (query, k, nprobe, ef_search, mode, filters) tuples.
+
+    Queries with the same search params share one search_batch call at the
+    largest k in the group; each result list is then cut to its own k. If a
+    group fails, its items get the exception and the other groups still
+    get their results.
+    """
+    out = [None] * len(items)
+    snapshot = REGISTRY.snapshot()   # one snapshot per batch, even if a new index is swapped in
+    groups = {}
+    for i, (_, _, nprobe, ef_search, mode, filters) in enumerate(items):
+        groups.setdefault((nprobe, ef_search, mode, filters), []).append(i)
+    for (nprobe, ef_search, mode, filters), rows in groups.items():
+        k = max(items[i][1] for i in rows)
+        try:
+            results = search_batch([items[i][0] for i in rows], snapshot, snapshot.metadata, REGISTRY.embed_model,
+                                   k=k, nprobe=nprobe, ef_search=ef_search, mode=mode, filters=dict(filters or ()))
+        except Exception as e:
+            for i in rows:
+                out[i] = e
+            continue
+        for i, hits in zip(rows, results):
+            out[i] = [h for h in hits if h["rank"] <= items[i][1]]
+    return out
+
+
+# ---------- API ----------
+class SearchRequest(BaseModel):
+    query: str
+    k: int = Field(5, gt=0)
+    nprobe: Optional[int] = Field(None, gt=0)
+    ef_search: Optional[int] = Field(None, gt=0)
+    mode: Literal["dense", "hybrid"] = "dense"     # hybrid = dense + BM25, RRF-fused
+    filters: Optional[dict] = None   # e.g. {"strategy": "table_whole", "file_type": ["pdf"]}
+    rerank: bool = False    # cross-encoder over RERANK_CANDIDATES candidates
+    rerank_budget_ms: Optional[float] = RERANK_BUDGET_MS
+
+
+class AnswerRequest(SearchRequest):
+    model: str = DEFAULT_MODEL
+    stream: bool = False
+
+
+async def retrieve(req):
+    """Micro-batched search, then the optional rerank stage (in a worker thread)."""
+    k = max(req.k, RERANK_CANDIDATES) if req.rerank else req.k
+    results = await batcher.submit((req.query, k, req.nprobe, req.ef_search, req.mode,
+                                    parse_filters(req.filters)))
+    if req.rerank:
+        results = await asyncio.to_thread(RERANKER.rerank, req.query, results, req.k, req.rerank_budget_ms)
+    return results
+
+
+def parse_filters(filters):
+    try:
+        return normalize_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def observe_request(endpoint, t0):
+    elapsed = time.perf_counter() - t0
+    METRICS.observe("request_seconds", elapsed, endpoint=endpoint)
+    return elapsed * 1000
+
+
+BACKENDS = {"gemini": REGISTRY.llm, "fake": FakeStreamingBackend()}
+
+
+def llm_backend(name):
+    """The generation backend called `name` (RAG_LLM_BACKEND); ValueError if there is none."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown RAG_LLM_BACKEND={name!r} (expected one of {', '.join(BACKENDS)})")
+    return BACKENDS[name]
+
+
+LLM = llm_backend(LLM_BACKEND)   # checked at startup rather than on the first /answer
+batcher = MicroBatcher(search_items)
+
+# Cache and batching stats are exported as gauges on /metrics
+METRICS.register("batcher", batcher.stats)
+METRICS.register("query_cache", QUERY_CACHE.stats)
+METRICS.register("answer_cache", ANSWER_CACHE.stats)
+METRICS.register("reranker", RERANKER.stats)
+METRICS.register("registry", REGISTRY.stats)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Load the models and index before taking traffic rather than on the first request
+    await asyncio.to_thread(REGISTRY.warm_up)
+    await asyncio.to_thread(RERANKER.warm_up)
+    batcher.start()
+    yield
+    await batcher.stop()
+
+
+app = FastAPI(title="RAG docs service", lifespan=lifespan)
+
+
+@app.post("/search")
+async def search_endpoint(req: SearchRequest):
+    t0 = time.perf_counter()
+    results = await retrieve(req)
+    return {"results": results, "latency_ms": observe_request("/search", t0)}
+
+
+@app.post("/answer")
+async def answer_endpoint(req: AnswerRequest):
+    t0 = time.perf_counter()
+    retrieved = await retrieve(req)
+    if req.stream:
+        # Time to headers only; llm_ttft_seconds and the llm.stream stage cover the body
+        observe_request("/answer?stream", t0)
+        return StreamingResponse(astream_answer(req.query, retrieved, req.model, LLM),
+                                 media_type="text/plain; charset=utf-8")
+    context = {}
+    answer, citation_map = await asyncio.to_thread(generate_answer, req.query, retrieved, req.model, LLM,
+                                                   report=context)
+    return {"answer": answer, "citations": citation_map, "context": context,
+            "latency_ms": observe_request("/answer", t0)}
+
+
+@app.get("/stats")
+async def stats_endpoint():
+    return {"batcher": batcher.stats(), "query_cache": QUERY_CACHE.stats(), "answer_cache": ANSWER_CACHE.stats(),
+            "reranker": RERANKER.stats(),
+            "registry": REGISTRY.stats(), "metrics": METRICS.snapshot()}
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus scrape target: counters, per-stage latency histograms, cache gauges."""
+    return PlainTextResponse(METRICS.prometheus(), media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,163 @@
+import heapq
+import json
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+import faiss
+import numpy as np
+
+from embed_index import (SHARDS_FILE, data_dir, filter_selector, hybrid_depth, is_compressed, load_full_vectors,
+                         load_manifest, search_vectors)
+from metadata_store import format_hits, load_metadata, lookup_many, normalize_filters, row_mask
+from sparse_index import load_sparse_index, reciprocal_rank_fusion, tokenize
+from telemetry import span
+
+
+def is_sharded(index_dir):
+    return (Path(index_dir) / SHARDS_FILE).exists()
+
+
+class Shard:
+    """One shard: a regular index dir (manifest.json naming a generation with faiss.index, meta/, bm25/)."""
+
+    def __init__(self, shard_dir):
+        self.dir = str(shard_dir)
+        self.name = Path(shard_dir).name
+        self.manifest = load_manifest(shard_dir)
+        root = data_dir(shard_dir, self.manifest)
+        self.index = faiss.read_index(str(root / "faiss.index"))
+        self.metadata = load_metadata(root)
+        # Opened with the index, so a shard keeps searching one save until it is reloaded
+        self.sparse = load_sparse_index(root)
+        self.full_vectors = None
+        if is_compressed(self.manifest["index_type"], self.manifest.get("index_opts", {})):
+            self.full_vectors = load_full_vectors(root, self.manifest["dim"])
+
+    def dense(self, query_vectors, k, nprobe=None, ef_search=None, filters=None):
+        sel = filter_selector(self.metadata, filters) if filters else None
+        return search_vectors(self.index, query_vectors, k, self.manifest, nprobe=nprobe, ef_search=ef_search,
+                              sel=sel, full_vectors=self.full_vectors)
+
+    def lexical(self, query_texts, k, filters=None, corpus=None):
+        """BM25 (D, I) of the shard, -1 padded like FAISS output; corpus as in SparseIndex.search_many."""
+        mask = row_mask(self.metadata, filters) if filters else None
+        D = np.zeros((len(query_texts), k), dtype="float32")
+        I = np.full((len(query_texts), k), -1, dtype="int64")
+        for row, (scores, ids) in enumerate(self.sparse.search_many(query_texts, k, mask, corpus)):
+            D[row, :len(ids)] = scores
+            I[row, :len(ids)] = ids
+        return D, I
+
+
+def _row_hits(D, I, q, shard):
+    return ((float(D[q, j]), shard, int(I[q, j])) for j in range(I.shape[1]) if I[q, j] != -1)
+
+
+def merge_topk(per_shard, k, higher_is_better=True):
+    """Heap-based k-way merge of per-shard (D, I) results.
+
+    Each shard's rows are already sorted, so heapq.merge only touches about
+    k entries per query. Returns per query a list of (score, shard number, id).
+    """
+    n_queries = per_shard[0][0].shape[0] if per_shard else 0
+    key = (lambda hit: -hit[0]) if higher_is_better else (lambda hit: hit[0])
+    return [
+        list(islice(heapq.merge(*(_row_hits(D, I, q, s) for s, (D, I) in enumerate(per_shard)), key=key), k))
+        for q in range(n_queries)
+    ]
+
+
+class ShardedIndex:
+    """A subset (or all) of the shards written by embed_index.build_sharded_index.
+
+    Each query batch is searched on every loaded shard concurrently in a
+    thread pool (FAISS releases the GIL), then the per-shard top-k lists are
+    merged into the global top-k. Loading only some shards lets several
+    processes split one large corpus between them. BM25 statistics (IDF,
+    average document length) are taken over all loaded shards, so lexical
+    scores of different shards are comparable.
+    """
+
+    def __init__(self, index_dir, shards=None, threads=None):
+        with open(Path(index_dir) / SHARDS_FILE, "r", encoding="utf-8") as f:
+            self.info = json.load(f)
+        names = self.info["shards"] if shards is None else [
+            s if isinstance(s, str) else f"shard_{s:03d}" for s in shards
+        ]
+        self.shards = [Shard(Path(index_dir) / name) for name in names]
+        self.metric = self.info["metric"]
+        self.hybrid = all(s.sparse is not None for s in self.shards)
+        if self.hybrid:
+            n_docs = sum(len(s.sparse) for s in self.shards)
+            avgdl = sum(float(s.sparse.doc_len.sum()) for s in self.shards) / max(n_docs, 1)
+            for s in self.shards:
+                s.sparse.set_avgdl(avgdl)
+        self._pool = ThreadPoolExecutor(max_workers=threads or len(self.shards), thread_name_prefix="shard")
+
+    @property
+    def ntotal(self):
+        return sum(s.index.ntotal for s in self.shards)
+
+    def corpus_stats(self, query_texts):
+        """Per query (n_docs, {term: doc freq}) over all loaded shards, for SparseIndex.search."""
+        n_docs = sum(len(s.sparse) for s in self.shards)
+        return [(n_docs, {t: sum(s.sparse.doc_freq(t) for s in self.shards) for t in set(tokenize(q))})
+                for q in query_texts]
+
+    def search_vectors(self, query_vectors, query_texts, k, nprobe=None, ef_search=None, mode="dense",
+                       filters=None):
+        """Fan out to all loaded shards and merge: per query a list of (score, shard number, id).
+
+        In hybrid mode the dense and the BM25 candidates of all shards are
+        first merged into one global ranking each, which are then fused once
+        with reciprocal-rank fusion (as hybrid_search does for one index).
+        """
+        filters = normalize_filters(filters)
+        hybrid = mode == "hybrid" and self.hybrid
+        depth = hybrid_depth(k) if hybrid else k
+        dense = [self._pool.submit(s.dense, query_vectors, depth, nprobe, ef_search, filters) for s in self.shards]
+        if hybrid:
+            corpus = self.corpus_stats(query_texts)
+            lexical = [self._pool.submit(s.lexical, query_texts, depth, filters, corpus) for s in self.shards]
+        dense_hits = merge_topk([f.result() for f in dense], depth, self.metric == "cosine")
+        if not hybrid:
+            return dense_hits
+        lexical_hits = merge_topk([f.result() for f in lexical], depth)
+        out = []
+        for d, b in zip(dense_hits, lexical_hits):
+            scores, keys = reciprocal_rank_fusion([[(s, vid) for _, s, vid in d], [(s, vid) for _, s, vid in b]], k)
+            out.append([(score, s, vid) for score, (s, vid) in zip(scores, keys)])
+        return out
+
+    def search_batch(self, queries, embed_model, k=5, nprobe=None, ef_search=None, mode="dense", filters=None,
+                     cache=None):
+        """Result dicts (same fields as generator.search, plus "shard") per query.
+
+        `cache` only supplies query embeddings here: result lists are cached
+        by generator.search_batch, keyed by the snapshot the shards were
+        loaded in, as for a single index.
+        """
+        with span("search.embed", queries=len(queries)):
+            if cache is not None:
+                query_embs = cache.query_embeddings(embed_model, queries)
+            else:
+                query_embs = np.asarray(embed_model.get_text_embedding_batch(list(queries)), dtype="float32")
+        with span("search.faiss", mode=mode, shards=len(self.shards)):
+            merged = self.search_vectors(query_embs, list(queries), k, nprobe, ef_search, mode, filters)
+        with span("search.metadata"):
+            # every hit of the batch decoded with one lookup per shard
+            rows = [lookup_many(shard.metadata, [vid for hits in merged for _, s, vid in hits if s == n])
+                    for n, shard in enumerate(self.shards)]
+            out = []
+            for hits in merged:
+                entries = {j: rows[s].get(vid) for j, (_, s, vid) in enumerate(hits)}
+                results = format_hits([score for score, _, _ in hits], range(len(hits)), entries)
+                for result in results:
+                    result["shard"] = self.shards[hits[result["rank"] - 1][1]].name
+                out.append(results)
+            return out
+
+
+def load_sharded_index(index_dir, shards=None, threads=None):
+    """Open a sharded index; shards=[0, 2] or ["shard_000"] loads only those."""
+    return ShardedIndex(index_dir, shards, threads)
@@ -0,0 +1,227 @@
+import json
+import re
+import shutil
+from array import array
+from collections import Counter
+from pathlib import Path
+import numpy as np
+
+from metadata_store import MetadataStore
+
+# Layout of <gen_dir>/bm25/ (arrays opened with mmap):
+#   terms.json        sorted vocabulary; term i owns postings[offsets[i]:offsets[i+1]]
+#   offsets.npy       int64 [T+1]
+#   doc_rows.npy      int32 postings: row of each document containing the term
+#   tfs.npy           uint16 term frequency in that document
+#   ids.npy           int64 row → vector id (same ids as faiss.index)
+#   doc_len.npy       int32 tokens per document
+#   stats.json        k1, b, avgdl
+SPARSE_DIR = "bm25"
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words plus dotted / underscored identifiers and numbers kept whole
+# ("pandas.read_csv", "3.5", "v2.1"), so exact names and figures match.
+TOKEN_RE = re.compile(r"\w+(?:[._]\w+)*")
+
+
+def tokenize(text):
+    """Lowercased terms; compound tokens also contribute their dotted suffixes and parts.
+
+    "pandas.read_csv" → pandas.read_csv, read_csv, pandas, read, csv
+    """
+    terms = []
+    for tok in TOKEN_RE.findall(text.lower()):
+        terms.append(tok)
+        if "." in tok or "_" in tok:
+            dotted = tok.split(".")
+            extra = [".".join(dotted[i:]) for i in range(1, len(dotted))] + re.split(r"[._]", tok)
+            terms.extend(p for p in dict.fromkeys(extra) if p)
+    return terms
+
+
+def _postings(store, rows):
+    """(vocab, term ids, rows, tfs, doc lengths) of the given metadata store rows, tokenized."""
+    vocab = {}
+    term_ids, post_rows, tfs = array("i"), array("i"), array("H")
+    doc_len = array("i")
+    for row in rows:
+        counts = Counter(tokenize(store.text(row)))
+        doc_len.append(sum(counts.values()))
+        for term, tf in counts.items():
+            term_ids.append(vocab.setdefault(term, len(vocab)))
+            post_rows.append(row)
+            tfs.append(min(tf, 65535))
+    return (vocab, np.frombuffer(term_ids, dtype="int32").astype("int64"), np.frombuffer(post_rows, dtype="int32"),
+            np.frombuffer(tfs, dtype="uint16"), np.frombuffer(doc_len, dtype="int32"))
+
+
+def _write_sparse(gen_dir, terms, tid, rows, tfs, ids, doc_len, k1, b):
+    """Group postings by term id (one stable sort, so rows stay ascending within a term) and save them.
+
+    gen_dir is an uncommitted generation (see embed_index.save_index_files), so files are written in place.
+    """
+    order = np.argsort(tid, kind="stable")
+    offsets = np.zeros(len(terms) + 1, dtype="int64")
+    np.cumsum(np.bincount(tid, minlength=len(terms)), out=offsets[1:])
+    root = Path(gen_dir) / SPARSE_DIR
+    shutil.rmtree(root, ignore_errors=True)
+    root.mkdir(parents=True)
+    with open(root / "terms.json", "w", encoding="utf-8") as f:
+        json.dump(terms, f, ensure_ascii=False)
+    np.save(root / "offsets.npy", offsets)
+    np.save(root / "doc_rows.npy", np.asarray(rows, dtype="int32")[order])
+    np.save(root / "tfs.npy", np.asarray(tfs, dtype="uint16")[order])
+    np.save(root / "ids.npy", np.asarray(ids, dtype="int64"))
+    np.save(root / "doc_len.npy", np.asarray(doc_len, dtype="int32"))
+    with open(root / "stats.json", "w", encoding="utf-8") as f:
+        json.dump({"k1": k1, "b": b, "avgdl": float(np.mean(doc_len)) if len(doc_len) else 0.0}, f)
+
+
+def build_sparse_index(gen_dir, k1=BM25_K1, b=BM25_B):
+    """Build the BM25 inverted index of <gen_dir> from its metadata store.
+
+    Postings are grouped by term with one stable sort over flat arrays, so
+    memory is a few bytes per (term, document) pair.
+    """
+    store = MetadataStore(gen_dir)
+    vocab, tid, rows, tfs, doc_len = _postings(store, range(len(store)))
+    # Renumber terms in sorted order
+    terms = sorted(vocab)
+    new_id = np.empty(len(vocab), dtype="int64")
+    new_id[[vocab[t] for t in terms]] = np.arange(len(terms))
+    _write_sparse(gen_dir, terms, new_id[tid], rows, tfs, store.ids, doc_len, k1, b)
+
+
+def update_sparse_index(base_dir, gen_dir):
+    """BM25 index of <gen_dir> derived from the one in <base_dir> (the previous generation).
+
+    Postings of documents that are no longer in gen_dir's metadata store are
+    dropped and only the added documents are tokenized; everything else is
+    array work on the existing postings. Added ids must come after the kept
+    ones (incremental updates only append ids), otherwise, or without a
+    previous BM25 index, it falls back to build_sparse_index.
+    """
+    old = load_sparse_index(base_dir)
+    if old is None:
+        return build_sparse_index(gen_dir)
+    store = MetadataStore(gen_dir)
+    new_ids, old_ids = np.asarray(store.ids), np.asarray(old.ids)
+    keep = np.isin(old_ids, new_ids)
+    n_kept = int(keep.sum())
+    if not np.array_equal(new_ids[:n_kept], old_ids[keep]):
+        return build_sparse_index(gen_dir, old.k1, old.b)
+
+    # Surviving postings, renumbered to their rows in the new store
+    new_row = np.cumsum(keep) - 1
+    old_terms = list(old.term_ids)
+    old_tid = np.repeat(np.arange(len(old_terms)), np.diff(old.offsets))
+    live = keep[old.doc_rows]
+    vocab, add_tid, add_rows, add_tfs, add_len = _postings(store, range(n_kept, len(store)))
+
+    terms = sorted(set(old_terms).union(vocab))
+    pos = {t: i for i, t in enumerate(terms)}
+    old_map = np.array([pos[t] for t in old_terms], dtype="int64")
+    add_map = np.empty(len(vocab), dtype="int64")
+    add_map[list(vocab.values())] = [pos[t] for t in vocab]
+    tid = np.concatenate([old_map[old_tid[live]], add_map[add_tid]])
+    rows = np.concatenate([new_row[old.doc_rows[live]], add_rows])
+    tfs = np.concatenate([old.tfs[live], add_tfs])
+    doc_len = np.concatenate([old.doc_len[keep].astype("int32"), add_len])
+
+    # Drop terms whose documents were all removed
+    used = np.bincount(tid, minlength=len(terms)) > 0
+    remap = np.cumsum(used) - 1
+    terms = [t for t, u in zip(terms, used) if u]
+    _write_sparse(gen_dir, terms, remap[tid], rows, tfs, new_ids, doc_len, old.k1, old.b)
+
+
+class SparseIndex:
+    """Memory-mapped BM25 index written by build_sparse_index."""
+
+    def __init__(self, index_dir):
+        root = Path(index_dir) / SPARSE_DIR
+        with open(root / "terms.json", "r", encoding="utf-8") as f:
+            self.term_ids = {t: i for i, t in enumerate(json.load(f))}
+        with open(root / "stats.json", "r", encoding="utf-8") as f:
+            stats = json.load(f)
+        self.offsets = np.load(root / "offsets.npy", mmap_mode="r")
+        self.doc_rows = np.load(root / "doc_rows.npy", mmap_mode="r")
+        self.tfs = np.load(root / "tfs.npy", mmap_mode="r")
+        self.ids = np.load(root / "ids.npy", mmap_mode="r")
+        self.k1, self.b = stats["k1"], stats["b"]
+        self.doc_len = np.load(root / "doc_len.npy").astype("float32")
+        self.set_avgdl(stats["avgdl"])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def set_avgdl(self, avgdl):
+        """Length normalization against avgdl (e.g. the average over all shards of a corpus)."""
+        # Per-document part of the BM25 denominator, computed once
+        self._norm = self.k1 * (1 - self.b + self.b * self.doc_len / max(avgdl, 1e-9))
+
+    def doc_freq(self, term):
+        t = self.term_ids.get(term)
+        return 0 if t is None else int(self.offsets[t + 1] - self.offsets[t])
+
+    def search(self, query, k, row_mask=None, corpus=None):
+        """(scores, vector ids) of the top-k documents for one query, best first.
+
+        row_mask (bool per row, same order as ids) drops non-matching documents.
+        corpus = (n_docs, {term: doc freq}) computes IDF over a larger corpus
+        than this index (all shards of a sharded index), so scores of
+        different shards are comparable.
+        """
+        n = len(self.ids)
+        n_docs, dfs = corpus if corpus is not None else (n, None)
+        acc = np.zeros(n, dtype="float32")
+        touched = []
+        for term in set(tokenize(query)):
+            t = self.term_ids.get(term)
+            if t is None:
+                continue
+            a, b = self.offsets[t], self.offsets[t + 1]
+            rows = self.doc_rows[a:b]
+            tf = self.tfs[a:b].astype("float32")
+            df = dfs[term] if dfs is not None else b - a
+            idf = np.log1p((n_docs - df + 0.5) / (df + 0.5))
+            acc[rows] += idf * tf * (self.k1 + 1) / (tf + self._norm[rows])  # rows are unique per term
+            touched.append(rows)
+        if not touched:
+            return np.empty(0, dtype="float32"), np.empty(0, dtype="int64")
+        cand = np.unique(np.concatenate(touched))
+        if row_mask is not None:
+            cand = cand[row_mask[cand]]
+        scores = acc[cand]
+        if len(cand) > k:
+            top = np.argpartition(-scores, k)[:k]
+            cand, scores = cand[top], scores[top]
+        order = np.argsort(-scores, kind="stable")
+        return scores[order], np.asarray(self.ids[cand[order]], dtype="int64")
+
+    def search_many(self, queries, k, row_mask=None, corpus=None):
+        return [self.search(q, k, row_mask, corpus[i] if corpus is not None else None)
+                for i, q in enumerate(queries)]
+
+
+def load_sparse_index(index_dir):
+    """SparseIndex of index_dir, or None for indexes built before BM25 support."""
+    if not (Path(index_dir) / SPARSE_DIR / "terms.json").exists():
+        return None
+    return SparseIndex(index_dir)
+
+
+def reciprocal_rank_fusion(rankings, k, rrf_k=60):
+    """Fuse ranked id lists: score(id) = Σ 1 / (rrf_k + rank). Returns (scores, ids), best first.
+
+    ids are vector ids (-1 = padding) or any other hashable, e.g. (shard, id) pairs.
+    """
+    fused = {}
+    for ids in rankings:
+        for rank, vid in enumerate(ids, start=1):
+            key = vid if isinstance(vid, tuple) else int(vid)
+            if key != -1:
+                fused[key] = fused.get(key, 0.0) + 1.0 / (rrf_k + rank)
+    best = sorted(fused.items(), key=lambda item: -item[1])[:k]
+    return [s for _, s in best], [vid for vid, _ in best]
@@ -1,8 +1,11 @@
+import re
 import json
+import hashlib
 from pathlib import Path
-from llama_index.core.node_parser import SentenceWindowNodeParser, SemanticSplitterNodeParser
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
-from llama_index.core.schema import Document
+import numpy as np
+from context_packer import count_tokens
+from embed_cache import load_embed_model
+from telemetry import METRICS, print_summary, span
 
 
 def load_docs(jsonl_file):
@@ -19,72 +22,302 @@ def save_chunks(chunks, out_file):
     Path(out_file).parent.mkdir(parents=True, exist_ok=True)
     with open(out_file, "w", encoding="utf-8") as f:
         for ch in chunks:
+            ch = {k: v for k, v in ch.items() if k != "embedding"}
             f.write(json.dumps(ch, ensure_ascii=False) + "\n")
 
+def text_hash(text):
+    """Content hash of a chunk's text (lets the indexer skip unchanged chunks)."""
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
 
 
-def chunk_all_docs(docs, chunk_size=800):
-    """Use SemanticSplitterNodeParser for all text chunks, keep table chunks whole."""
-    embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-    splitter = SemanticSplitterNodeParser(embed_model=embed_model, chunk_size=chunk_size)
+def get_field(doc, key):
+    """Read a record field that may be top-level (HTML/MD) or in metadata (PDF/DOCX)."""
+    if doc.get(key) is not None:
+        return doc[key]
+    return doc.get("metadata", {}).get(key)
+
+
+def split_key(chunk):
+    """(strategy, chunk_size, overlap) a chunk was split with; its chunks are reused only for the same key."""
+    return chunk.get("strategy"), chunk.get("chunk_size"), chunk.get("overlap")
+
+
+def group_by_parent(chunks):
+    """Map parent record id -> its chunks (from a previous splitter run)."""
+    grouped = {}
+    for ch in chunks:
+        if ch.get("parent_id"):
+            grouped.setdefault(ch["parent_id"], []).append(ch)
+    return grouped
+
+
+# ---------- Splitting strategies ----------
+STRATEGIES = ("semantic", "sentence_window", "structure")
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+HEADING_RE = re.compile(r"^(?:#{1,6}\s.*|[A-Z][A-Z0-9 ,:&()/-]{3,80})$")
+
+
+def split_sentences(text):
+    return [s.strip() for s in SENTENCE_RE.split(text) if s and s.strip()]
+
+
+def _split_long(sentence, chunk_size):
+    """Hard-split a single sentence that is longer than the token budget."""
+    words = sentence.split()
+    step = max(1, chunk_size * len(words) // max(count_tokens(sentence), 1))
+    return [" ".join(words[i:i + step]) for i in range(0, len(words), step)]
+
+
+def pack_sentences(sentences, chunk_size, overlap=0):
+    """Greedily pack sentences into chunks of at most chunk_size tokens.
+
+    Each new chunk starts with the trailing sentences of the previous one
+    that fit in `overlap` tokens.
+    """
+    units = []
+    for sent in sentences:
+        units.extend(_split_long(sent, chunk_size) if count_tokens(sent) > chunk_size else [sent])
+    chunks, current, tokens = [], [], 0
+    for sent in units:
+        n = count_tokens(sent)
+        if current and tokens + n > chunk_size:
+            chunks.append(" ".join(current))
+            tail, tail_tokens = [], 0
+            for prev in reversed(current):
+                prev_tokens = count_tokens(prev)
+                if tail_tokens + prev_tokens > overlap or tail_tokens + prev_tokens + n > chunk_size:
+                    break
+                tail.insert(0, prev)
+                tail_tokens += prev_tokens
+            current, tokens = tail, tail_tokens
+        current.append(sent)
+        tokens += n
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
+
+
+def sentence_window_split(text, chunk_size, overlap=0):
+    """Token-budget splitter: sentences packed up to chunk_size with overlap."""
+    return pack_sentences(split_sentences(text), chunk_size, overlap)
+
+
+def structure_split(text, chunk_size, overlap=0):
+    """Structure-aware splitter: breaks at page breaks and headings, packs paragraphs.
+
+    A section is only merged into the current chunk when that chunk is still
+    small (< 1/4 of the budget); oversized paragraphs fall back to sentence
+    packing. Text without any structure behaves like sentence_window_split.
+    """
+    sections, current = [], []
+    for page in text.split("\f"):
+        for line in page.split("\n"):
+            if HEADING_RE.match(line.strip()) and current:
+                sections.append("\n".join(current))
+                current = []
+            current.append(line)
+        sections.append("\n".join(current))
+        current = []
+
     chunks = []
+    for section in sections:
+        paragraphs = [p.strip() for p in re.split(r"\n\s*\n", section) if p.strip()]
+        units = []
+        for para in paragraphs:
+            if count_tokens(para) > chunk_size:
+                units.extend(split_sentences(para))
+            else:
+                units.append(para)
+        for chunk in pack_sentences(units, chunk_size, overlap):
+            if chunks and count_tokens(chunks[-1]) < chunk_size // 4 \
+                    and count_tokens(chunks[-1]) + count_tokens(chunk) <= chunk_size:
+                chunks[-1] = f"{chunks[-1]}\n{chunk}"
+            else:
+                chunks.append(chunk)
+    return [" ".join(c.split()) for c in chunks]
+
+
+def semantic_split(text, embed_model, chunk_size, overlap=0, buffer_size=1, breakpoint_percentile=95):
+    """Semantic splitter returning (chunk_text, pooled_vector) pairs.
+
+    Every sentence is embedded together with its `buffer_size` neighbours in
+    one batched call (cache-backed when embed_model is a CachedEmbedding); a
+    chunk boundary is placed where the cosine distance between consecutive
+    windows exceeds the given percentile, or where the chunk would exceed
+    chunk_size tokens. Like pack_sentences, each chunk then starts with the
+    trailing sentences of the previous one that fit in `overlap` tokens
+    (and in chunk_size). The pooled vector is the normalized mean of the
+    chunk's sentence vectors and can stand in for a chunk embedding.
+    """
+    sentences = []
+    for sent in split_sentences(text):
+        sentences.extend(_split_long(sent, chunk_size) if count_tokens(sent) > chunk_size else [sent])
+    if not sentences:
+        return []
+    windows = [" ".join(sentences[max(0, i - buffer_size):i + buffer_size + 1]) for i in range(len(sentences))]
+    vectors = np.asarray(embed_model.get_text_embedding_batch(windows), dtype="float32")
+    vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+    distances = 1.0 - (vectors[:-1] * vectors[1:]).sum(axis=1)
+    threshold = np.percentile(distances, breakpoint_percentile) if len(distances) else 1.0
+
+    results, start, tokens = [], 0, 0
+    for i, sent in enumerate(sentences):
+        n = count_tokens(sent)
+        if i > start and tokens + n > chunk_size:
+            results.append((start, i))
+            start, tokens = i, 0
+        tokens += n
+        if i < len(distances) and distances[i] > threshold:
+            results.append((start, i + 1))
+            start, tokens = i + 1, 0
+    if start < len(sentences):
+        results.append((start, len(sentences)))
+
+    counts = [count_tokens(sent) for sent in sentences]
+    out = []
+    for a, b in results:
+        tokens, tail = sum(counts[a:b]), 0
+        while a > 0 and tail + counts[a - 1] <= overlap and tokens + counts[a - 1] <= chunk_size:
+            tail += counts[a - 1]
+            tokens += counts[a - 1]
+            a -= 1
+        pooled = vectors[a:b].mean(axis=0)
+        pooled /= max(np.linalg.norm(pooled), 1e-12)
+        out.append((" ".join(sentences[a:b]), pooled))
+    return out
+
+
+def split_text(text, strategy, chunk_size, overlap=0, embed_model=None):
+    """Split one record's text; returns (chunk_text, pooled_vector or None) pairs."""
+    if strategy == "semantic":
+        return semantic_split(text, embed_model, chunk_size, overlap)
+    if strategy == "sentence_window":
+        return [(c, None) for c in sentence_window_split(text, chunk_size, overlap)]
+    if strategy == "structure":
+        return [(c, None) for c in structure_split(text, chunk_size, overlap)]
+    raise ValueError(f"Unknown splitting strategy: {strategy} (expected one of {STRATEGIES})")
+
+
+def chunk_all_docs(docs, chunk_size=800, previous=None, embed_model=None, **kwargs):
+    """Split text records with the chosen strategy, keep table chunks whole.
+
+    previous maps parent id -> chunks of an earlier run; record ids are derived
+    from the source file hash, so a known id means the record is unchanged and
+    its chunks are reused without re-splitting, as long as they were split
+    with the same strategy, chunk size and overlap (see split_key).
+    See iter_chunks for kwargs.
+    """
+    with span("chunk") as attrs:
+        chunks = list(iter_chunks(docs, chunk_size, previous, embed_model, **kwargs))
+        attrs["chunks"] = len(chunks)
+    return chunks
+
+
+def iter_chunks(docs, chunk_size=800, previous=None, embed_model=None, strategy="semantic", overlap=0,
+                pdf_chunk_size=None, pdf_overlap=None, reuse_vectors=False):
+    """Generator version of chunk_all_docs: yields chunks record by record.
+
+    chunk_size / overlap (tokens) apply to all records; PDF records use
+    pdf_chunk_size / pdf_overlap when given. With strategy="semantic" and
+    reuse_vectors=True each chunk carries an "embedding" pooled from its
+    sentence vectors, which the streaming pipeline indexes without
+    re-encoding the chunk (it is never written to the JSONL checkpoints).
+    """
+    previous = previous or {}
+    if strategy == "semantic":
+        embed_model = embed_model or load_embed_model("sentence-transformers/all-MiniLM-L6-v2")
     for rec in docs:
         meta = rec.get("metadata", {})
+        parent_id = get_field(rec, "id") or meta.get("doc_id")
+        is_pdf = get_source(rec).lower().endswith(".pdf")
+        size = (pdf_chunk_size or chunk_size) if is_pdf else chunk_size
+        ov = (pdf_overlap if pdf_overlap is not None else overlap) if is_pdf else overlap
+        if parent_id in previous and all(ch.get("strategy") == "table_whole"
+                                         or split_key(ch) == (strategy, size, ov)
+                                         for ch in previous[parent_id]):
+            METRICS.inc("chunks_reused", len(previous[parent_id]))
+            yield from previous[parent_id]
+            continue
         # Table chunk: keep whole
         if meta.get("type") == "table":
             node_meta = meta.copy()
             node_meta.update({
-                "parent_id": rec.get("id"),
-                "source": rec.get("source"),
+                "parent_id": parent_id,
+                "source": get_source(rec),
                 "source_url": rec.get("source_url"),
-                "title": rec.get("title"),
+                "title": get_field(rec, "title"),
+                "file_hash": get_field(rec, "file_hash"),
                 "chunk_id": 0,
                 "strategy": "table_whole"
             })
-            chunks.append({
+            METRICS.inc("chunks_created")
+            yield {
                 **node_meta,
-                "text": rec["text"]
-            })
+                "text": rec["text"],
+                "text_hash": text_hash(rec["text"])
+            }
         else:
-            doc = Document(text=rec["text"], metadata=meta)
-            nodes = splitter.get_nodes_from_documents([doc])
-            for idx, node in enumerate(nodes):
-                node_meta = doc.metadata.copy() if hasattr(doc, 'metadata') else {}
+            with span("chunk.split", strategy=strategy):
+                pieces = split_text(rec["text"], strategy, size, ov, embed_model)
+            METRICS.inc("chunks_created", len(pieces))
+            for idx, (text, vector) in enumerate(pieces):
+                node_meta = meta.copy()
                 node_meta.update({
-                    "parent_id": rec.get("id"),
-                    "source": rec.get("source"),
+                    "parent_id": parent_id,
+                    "source": get_source(rec),
                     "source_url": rec.get("source_url"),
-                    "title": rec.get("title"),
-                    "page": rec.get("page"),
-                    "paragraph_id": rec.get("paragraph_id"),
+                    "title": get_field(rec, "title"),
+                    "file_hash": get_field(rec, "file_hash"),
+                    "page": get_field(rec, "page"),
+                    "paragraph_id": get_field(rec, "paragraph_id"),
                     "chunk_id": idx,
-                    "strategy": "semantic"
+                    "strategy": strategy,
+                    "chunk_size": size,
+                    "overlap": ov
                 })
-                chunks.append({
+                chunk = {
                     **node_meta,
-                    "text": node.get_content()
-                })
-    return chunks
+                    "text": text,
+                    "text_hash": text_hash(text)
+                }
+                if reuse_vectors and vector is not None:
+                    chunk["embedding"] = vector.tolist()
+                yield chunk
 
 # Fixed configuration
 INPUT_FILE = "ing_out_split_in/docs.jsonl"
 OUTPUT_FILE = "split_out_emd_in/docs.jsonl"
-PDF_CHUNK_SIZE = 800
-PDF_OVERLAP = 200
-OTHER_CHUNK_SIZE = 800
+STRATEGY = "semantic"   # semantic | sentence_window | structure (see benchmarks/bench_split.py)
+PDF_CHUNK_SIZE = 800    # token budget for PDF records
+PDF_OVERLAP = 200       # tokens repeated between consecutive PDF chunks
+OTHER_CHUNK_SIZE = 800  # token budget for HTML/Markdown/DOCX records
+INCREMENTAL = True  # reuse chunks of records that are unchanged since the last run
 
-# Load and process documents
-docs = load_docs(INPUT_FILE)
 
 def get_source(doc):
     if "source" in doc:
         return doc["source"]
-    return doc.get("metadata", {}).get("source", "")
+    return doc.get("metadata", {}).get("source") or doc.get("metadata", {}).get("file_name", "")
+
+
+if __name__ == "__main__":
+    # Load and process documents
+    docs = load_docs(INPUT_FILE)
 
+    previous = {}
+    if INCREMENTAL and Path(OUTPUT_FILE).exists():
+        previous = group_by_parent(load_docs(OUTPUT_FILE))
 
-# Single logic for all docs
-chunks = chunk_all_docs(docs, PDF_CHUNK_SIZE)
+    chunks = chunk_all_docs(
+        docs,
+        OTHER_CHUNK_SIZE,
+        previous=previous,
+        strategy=STRATEGY,
+        pdf_chunk_size=PDF_CHUNK_SIZE,
+        pdf_overlap=PDF_OVERLAP,
+    )
 
-print(f"✅ Created {len(chunks)} chunks.")
+    print(f"✅ Created {len(chunks)} chunks.")
 
-save_chunks(chunks, OUTPUT_FILE)
+    save_chunks(chunks, OUTPUT_FILE)
+    print_summary()
@@ -0,0 +1,243 @@
+import cProfile
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+import numpy as np
+
+# Fixed configuration
+TRACE_LOG_FILE = os.getenv("RAG_TRACE_LOG")       # JSON line per span (None = no log)
+PROFILE_STAGES = os.getenv("RAG_PROFILE", "")     # comma-separated stages to cProfile, "*" = all
+PROFILE_DIR = "profiles"                          # <stage>-<timestamp>.prof (snakeviz / pstats)
+HISTOGRAM_WINDOW = 4096                           # recent samples kept per histogram for p50/p95/p99
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)   # seconds
+SIZE_BUCKETS = (1, 10, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)                 # tokens, items
+
+log = logging.getLogger("rag.trace")
+if TRACE_LOG_FILE:
+    _handler = logging.FileHandler(TRACE_LOG_FILE, encoding="utf-8")
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    log.addHandler(_handler)
+    log.setLevel(logging.INFO)
+    log.propagate = False
+
+
+class Histogram:
+    """Cumulative Prometheus buckets plus a window of recent samples for percentiles."""
+
+    def __init__(self, buckets=BUCKETS, window=HISTOGRAM_WINDOW):
+        self.buckets = buckets
+        self.bucket_counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def summary(self):
+        if not self.recent:
+            return {"count": 0}
+        p50, p95, p99 = np.percentile(list(self.recent), [50, 95, 99])
+        return {"count": self.count, "sum": self.sum, "p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+class Metrics:
+    """Process-wide counters and histograms, keyed by (name, sorted labels)."""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.sources = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, buckets=BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram(buckets)
+            hist.observe(value)
+
+    def snapshot(self):
+        """JSON-friendly view: counters and p50/p95/p99 per histogram."""
+        def name_of(name, labels):
+            return name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+
+        with self._lock:
+            return {
+                "counters": {name_of(*key): value for key, value in sorted(self.counters.items())},
+                "histograms": {name_of(*key): h.summary() for key, h in sorted(self.histograms.items())},
+                "gauges": self.gauges(),
+            }
+
+    def prometheus(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        def fmt(labels, extra=()):
+            items = list(labels) + list(extra)
+            return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}" if items else ""
+
+        lines = []
+        for name, value in sorted(self.gauges().items()):
+            lines.append(f"# TYPE rag_{name} gauge")
+            lines.append(f"rag_{name} {value}")
+        with self._lock:
+            for name in sorted({n for n, _ in self.counters}):
+                lines.append(f"# TYPE rag_{name} counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name:
+                        lines.append(f"rag_{name}{fmt(labels)} {value}")
+            for name in sorted({n for n, _ in self.histograms}):
+                lines.append(f"# TYPE rag_{name} histogram")
+                for (n, labels), h in sorted(self.histograms.items()):
+                    if n != name:
+                        continue
+                    for bound, count in zip(h.buckets, h.bucket_counts):
+                        lines.append(f"rag_{name}_bucket{fmt(labels, [('le', bound)])} {count}")
+                    lines.append(f"rag_{name}_bucket{fmt(labels, [('le', '+Inf')])} {h.count}")
+                    lines.append(f"rag_{name}_sum{fmt(labels)} {h.sum}")
+                    lines.append(f"rag_{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+    def register(self, name, stats):
+        """Export the numbers in stats() (e.g. a cache's stats method) as gauges rag_<name>_<key>.
+
+        Nested dicts become rag_<name>_<key>_<subkey>; other values are skipped.
+        """
+        self.sources[name] = stats
+
+    def gauges(self):
+        out = {}
+
+        def flatten(prefix, value):
+            if isinstance(value, dict):
+                for key, sub in value.items():
+                    flatten(f"{prefix}_{key}", sub)
+            elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                out[prefix] = value
+
+        for name, stats in list(self.sources.items()):
+            flatten(name, stats())
+        return out
+
+
+METRICS = Metrics()
+_trace = contextvars.ContextVar("rag_trace", default=None)
+_depth = contextvars.ContextVar("rag_span_depth", default=0)
+_profiling = threading.local()
+
+
+def _should_profile(stage):
+    # One profiler per thread at a time: a nested profiled span is covered by the outer one
+    if getattr(_profiling, "active", False):
+        return False
+    return PROFILE_STAGES == "*" or stage in PROFILE_STAGES.split(",")
+
+
+@contextmanager
+def span(stage, **attrs):
+    """Time one stage: histogram stage_seconds{stage=...}, trace entry, JSON log line.
+
+    attrs are added to the trace entry and log line (and may be updated via
+    the yielded dict while the span is open, e.g. a result count). Stages
+    listed in RAG_PROFILE are also run under cProfile; otherwise a span
+    only reads the clock, so sampling profilers such as py-spy see the
+    traced code's own stacks.
+    """
+    token = _depth.set(_depth.get() + 1)
+    profiler = cProfile.Profile() if _should_profile(stage) else None
+    if profiler is not None:
+        _profiling.active = True
+        profiler.enable()
+    t0 = time.perf_counter()
+    try:
+        yield attrs
+    finally:
+        elapsed = time.perf_counter() - t0
+        if profiler is not None:
+            profiler.disable()
+            _profiling.active = False
+            Path(PROFILE_DIR).mkdir(exist_ok=True)
+            profiler.dump_stats(f"{PROFILE_DIR}/{stage}-{time.time_ns()}.prof")
+        _depth.reset(token)
+        record(stage, elapsed, t0, **attrs)
+
+
+def record(stage, elapsed, started=None, **attrs):
+    """Report a stage timed by the caller (e.g. across a generator's yields, where a span can't stay open)."""
+    METRICS.observe("stage_seconds", elapsed, stage=stage)
+    entry = {"stage": stage, "sec": elapsed, "depth": _depth.get(), **attrs}
+    spans = _trace.get()
+    if spans is not None:
+        spans.append((started if started is not None else time.perf_counter() - elapsed, entry))
+    if log.handlers:
+        log.info(json.dumps({"ts": time.time(), **entry}, default=str))
+
+
+def traced(stage):
+    """Decorator form of span() for whole functions."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+@contextmanager
+def trace():
+    """Collect the spans finished inside this block (same thread / task).
+
+    Yields a list of (start time, span entry) pairs; see breakdown().
+    """
+    spans = []
+    token = _trace.set(spans)
+    try:
+        yield spans
+    finally:
+        _trace.reset(token)
+
+
+def print_summary(prefix=""):
+    """Per-stage p50/p95/p99 of this process (for the offline scripts), plus counters."""
+    snap = METRICS.snapshot()
+    rows = [(name, h) for name, h in snap["histograms"].items() if name.startswith(f"stage_seconds{{stage={prefix}")]
+    if rows:
+        print(f"{'stage':<28}{'count':>7}{'total s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for name, h in rows:
+            stage = name[len("stage_seconds{stage="):-1]
+            print(f"{stage:<28}{h['count']:>7}{h['sum']:>10.2f}"
+                  f"{h['p50'] * 1000:>10.1f}{h['p95'] * 1000:>10.1f}{h['p99'] * 1000:>10.1f}")
+    for name, value in snap["counters"].items():
+        print(f"{name}: {value}")
+
+
+def breakdown(spans):
+    """Spans of a trace() in start order, indented by nesting, e.g. for a debug panel table."""
+    return [
+        {"stage": "  " * s["depth"] + s["stage"], "ms": round(s["sec"] * 1000, 2),
+         **{k: v for k, v in s.items() if k not in ("stage", "sec", "depth")}}
+        for _, s in sorted(spans, key=lambda pair: pair[0])
+    ]
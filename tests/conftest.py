@@ -0,0 +1,76 @@
+import hashlib
+import zlib
+
+import numpy as np
+import pytest
+
+import embed_index
+from metadata_store import write_metadata_store
+
+ENTRIES = {
+    0: {"text": "FAISS builds an inverted file index.", "source": "faiss.pdf", "title": "FAISS", "page": 1,
+        "strategy": "semantic", "chunk_id": 0, "parent_id": "p1"},
+    1: {"text": "Call pandas.read_csv to load a CSV file.", "source": "pandas.md", "title": "pandas", "page": None,
+        "strategy": "semantic", "chunk_id": 0, "parent_id": "p2"},
+    3: {"text": "IVF indexes are trained on a sample, then vectors are added.", "source": "faiss.pdf",
+        "title": "FAISS", "page": 2, "strategy": "semantic", "chunk_id": 1, "parent_id": "p1"},
+    7: {"text": "name | value\nnprobe | 8", "source": "faiss.pdf", "title": "FAISS", "page": 2,
+        "strategy": "table_whole", "type": "table", "table_index": 0, "pages": [2]},
+}
+
+
+@pytest.fixture
+def entries():
+    return {vid: dict(entry) for vid, entry in ENTRIES.items()}
+
+
+@pytest.fixture
+def gen_dir(tmp_path, entries):
+    """A generation directory holding the metadata store of ENTRIES."""
+    write_metadata_store(entries, tmp_path)
+    return tmp_path
+
+
+# ---------- Fake embedding model (embed_index / sharded index tests) ----------
+DIM = 16
+
+
+def fake_vector(text):
+    """Deterministic pseudo-embedding of a text."""
+    return np.random.default_rng(zlib.crc32(text.encode("utf-8"))).standard_normal(DIM).astype("float32")
+
+
+class FakeEmbedder:
+    """Stands in for the embedding model; records every text it embeds."""
+    model_name = "fake-embedder"
+
+    def __init__(self):
+        self.embedded = []
+
+    def get_text_embedding_batch(self, texts):
+        self.embedded.extend(texts)
+        return [fake_vector(t) for t in texts]
+
+
+@pytest.fixture
+def fake_embedder(monkeypatch):
+    """Route embed_index's model loading to one FakeEmbedder (backend "torch")."""
+    model = FakeEmbedder()
+    monkeypatch.setattr(embed_index, "load_embed_model", lambda *args, **kwargs: model)
+    monkeypatch.setattr(embed_index, "embed_backend", lambda: "torch")
+    return model
+
+
+def make_chunks(docs):
+    """Splitter-style chunks of {source: [chunk texts]}, fingerprinted by content like ingest.py."""
+    chunks = []
+    for source, texts in docs.items():
+        file_hash = hashlib.sha256("\0".join(texts).encode("utf-8")).hexdigest()
+        for i, text in enumerate(texts):
+            chunks.append({"text": text, "source": source, "title": source, "file_hash": file_hash,
+                           "parent_id": f"{file_hash[:16]}-0", "chunk_id": i, "strategy": "semantic"})
+    return chunks
+
+
+def corpus_text(doc, i):
+    return f"document {doc} chunk {i} about topic{i % 5} and term{(i * 7) % 11}"
@@ -0,0 +1,83 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from answer_cache import AnswerCache, prompt_key
+
+N = 8
+
+
+class BlockingBackend:
+    """Fake LLM: counts calls and holds each one until `release` is set."""
+    name = "blocking"
+
+    def __init__(self, fail_first=False):
+        self.calls = 0
+        self.release = threading.Event()
+        self.fail_first = fail_first
+        self._lock = threading.Lock()
+
+    def generate(self, prompt, model_name):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+        self.release.wait(5)
+        if self.fail_first and calls == 1:
+            raise RuntimeError("backend down")
+        return f"answer {calls} to {prompt}"
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def run_concurrently(cache, backend):
+    """N identical requests, released once all but the leader are waiting on it."""
+    with ThreadPoolExecutor(max_workers=N) as pool:
+        futures = [pool.submit(cache.get_or_generate, "prompt", "model", backend) for _ in range(N)]
+        wait_for(lambda: cache.flight.coalesced == N - 1)
+        backend.release.set()
+        return [f.exception() or f.result() for f in futures]
+
+
+def test_concurrent_identical_misses_make_one_call():
+    cache, backend = AnswerCache(), BlockingBackend()
+    results = run_concurrently(cache, backend)
+    assert backend.calls == 1
+    assert results == ["answer 1 to prompt"] * N
+    assert cache.stats()["backend_calls"] == 1
+    assert cache.get_or_generate("prompt", "model", backend) == "answer 1 to prompt"   # now cached
+    assert backend.calls == 1
+
+
+def test_leader_error_reaches_every_waiter_and_is_not_cached():
+    cache, backend = AnswerCache(), BlockingBackend(fail_first=True)
+    results = run_concurrently(cache, backend)
+    assert backend.calls == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.lookup("prompt", "model", backend) is None
+    assert cache.get_or_generate("prompt", "model", backend) == "answer 2 to prompt"   # retried, not poisoned
+
+
+def test_answers_are_keyed_per_backend_and_model():
+    cache = AnswerCache()
+    a, b = BlockingBackend(), BlockingBackend()
+    b.name = "other"
+    for backend in (a, b):
+        backend.release.set()
+    assert cache.get_or_generate("prompt", "model", a) == "answer 1 to prompt"
+    assert cache.get_or_generate("prompt", "model", b) == "answer 1 to prompt"
+    assert (a.calls, b.calls) == (1, 1)
+    assert prompt_key("prompt", "model", a) != prompt_key("prompt", "other-model", a)
+
+
+def test_single_flight_runs_separate_keys_independently():
+    cache, backend = AnswerCache(), BlockingBackend()
+    backend.release.set()
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda p: cache.get_or_generate(p, "model", backend), ["a", "b", "c", "d"]))
+    assert backend.calls == 4 and len(set(results)) == 4
+    assert cache.flight.coalesced == 0
@@ -0,0 +1,73 @@
+from context_packer import (count_tokens, cut_to_tokens, is_duplicate, join_overlapping, merge_adjacent, pack_context,
+                            shingles, truncate_table)
+
+
+def chunk(text, parent="p1", chunk_id=0, **extra):
+    return {"text": text, "parent_id": parent, "chunk_id": chunk_id, "strategy": "semantic", **extra}
+
+
+def words(prefix, n):
+    return " ".join(f"{prefix}{i}" for i in range(n))
+
+
+def test_join_overlapping_drops_repeated_words():
+    assert join_overlapping("a b c d", "c d e f") == "a b c d e f"
+    assert join_overlapping("a b", "x y") == "a b x y"
+
+
+def test_is_duplicate_on_jaccard_and_containment():
+    text = words("w", 40)
+    assert is_duplicate(shingles(text), shingles(text + " extra tail"))
+    assert is_duplicate(shingles(text), shingles(words("w", 20)))   # contained
+    assert not is_duplicate(shingles(text), shingles(words("v", 40)))
+    assert not is_duplicate(set(), shingles(text))
+
+
+def test_merge_adjacent_keeps_best_rank_position_and_document_order():
+    chunks = [chunk("c2 c3 c4", chunk_id=1), chunk("other", parent="p2"), chunk("c0 c1 c2", chunk_id=0),
+              chunk("c9", chunk_id=5)]
+    blocks, merged = merge_adjacent(chunks)
+    assert merged == 1
+    assert [b["text"] for b in blocks] == ["c0 c1 c2 c3 c4", "other", "c9"]
+    assert blocks[0]["chunk_ids"] == [0, 1]
+
+
+def test_tables_are_not_merged():
+    chunks = [chunk("a | b", chunk_id=0, strategy="table_whole"), chunk("c | d", chunk_id=1, strategy="table_whole")]
+    assert merge_adjacent(chunks) == (chunks, 0)
+
+
+def test_truncate_table_keeps_header_and_relevant_rows():
+    rows = [f"row{i} | filler text {i}" for i in range(200)]
+    table = "\n".join(["name | value", *rows[:100], "nprobe | eight", *rows[100:]])
+    text, truncated = truncate_table(table, "what is nprobe", max_tokens=60)
+    assert truncated
+    lines = text.splitlines()
+    assert lines[0] == "name | value"
+    assert "nprobe | eight" in lines
+    assert lines[-1].startswith("... (") and "of 201 rows omitted" in lines[-1]
+    assert count_tokens(text) <= 60
+    assert truncate_table("name | value\na | 1", "q") == ("name | value\na | 1", False)
+
+
+def test_cut_to_tokens():
+    out = cut_to_tokens(words("w", 100), 20)
+    assert out.endswith(" ...") and count_tokens(out) <= 20
+
+
+def test_pack_context_respects_budget_and_reports():
+    chunks = [chunk(words("a", 100), parent="p1"), chunk(words("a", 100), parent="p2"),
+              chunk(words("b", 300), parent="p3"), chunk(words("c", 300), parent="p4")]
+    report = {}
+    packed = pack_context("query", chunks, token_budget=250, report=report)
+    assert [c["parent_id"] for c in packed] == ["p1", "p3"]   # p2 duplicates p1; p3 is cut to fit
+    assert packed[1]["truncated"]
+    assert report["duplicates"] == 1
+    assert report["tokens_out"] <= 250
+    assert report["tokens_saved"] == report["tokens_in"] - report["tokens_out"]
+    assert report["chunks_out"] == 2 and report["cut"] == 1
+
+
+def test_pack_context_without_budget_keeps_everything_distinct():
+    chunks = [chunk(words("a", 50), parent="p1"), chunk(words("b", 50), parent="p2")]
+    assert pack_context("q", chunks, token_budget=None) == chunks
@@ -0,0 +1,255 @@
+import numpy as np
+import pytest
+
+import embed_index
+from conftest import corpus_text, make_chunks
+from embed_index import load_doc_state, load_manifest, update_faiss_index
+from generator import search_batch
+from registry import open_index
+
+QUERIES = [corpus_text("b", 2), "topic3 term5", corpus_text("d", 0), "document a chunk 7"]
+
+
+def corpus(**changes):
+    """Three documents of ten chunks; changes maps a source to its new chunk texts (None removes it)."""
+    docs = {f"{name}.md": [corpus_text(name, i) for i in range(10)] for name in "abc"}
+    docs.update(changes)
+    return make_chunks({source: texts for source, texts in docs.items() if texts is not None})
+
+
+def results(index_dir, model, k=5):
+    """(text, score) top-k of QUERIES through generator.search_batch on a fresh snapshot."""
+    hits = search_batch(QUERIES, open_index(index_dir), None, model, k=k, cache=None)
+    return [[(h["text"], round(h["score"], 5)) for h in row] for row in hits]
+
+
+def update(chunks, out_dir, **opts):
+    update_faiss_index(chunks, "fake-embedder", str(out_dir), **opts)
+
+
+def test_first_update_is_a_full_build(tmp_path, fake_embedder):
+    chunks = corpus()
+    update(chunks, tmp_path)
+    assert sorted(fake_embedder.embedded) == sorted(ch["text"] for ch in chunks)
+    assert load_manifest(tmp_path)["next_id"] == len(chunks)
+
+
+def test_update_embeds_only_changed_chunks_and_matches_a_full_rebuild(tmp_path, fake_embedder):
+    update(corpus(), tmp_path / "inc")
+    b = [corpus_text("b", i) for i in range(10)]
+    b[3] = "a rewritten chunk of document b about topic3"
+    changed = corpus(**{"b.md": b, "c.md": None, "d.md": [corpus_text("d", i) for i in range(4)]})
+
+    fake_embedder.embedded.clear()
+    update(changed, tmp_path / "inc")
+    # b's other chunks reuse their vectors, a is untouched, c is dropped
+    assert sorted(fake_embedder.embedded) == sorted([b[3]] + [corpus_text("d", i) for i in range(4)])
+    assert set(load_doc_state(tmp_path / "inc")) == {"a.md", "b.md", "d.md"}
+
+    update(changed, tmp_path / "full")
+    assert results(tmp_path / "inc", fake_embedder) == results(tmp_path / "full", fake_embedder)
+
+
+def test_unchanged_corpus_embeds_nothing(tmp_path, fake_embedder):
+    update(corpus(), tmp_path)
+    before = results(tmp_path, fake_embedder)
+    fake_embedder.embedded.clear()
+    update(corpus(), tmp_path)
+    assert fake_embedder.embedded == []
+    assert results(tmp_path, fake_embedder) == before
+
+
+@pytest.mark.parametrize("change", [
+    {"metric": "l2"},
+    {"index_type": "ivf_flat", "nlist": 2},
+    {"hnsw_m": 16},   # same type, other index_opts
+])
+def test_changed_settings_fall_back_to_a_full_build(tmp_path, fake_embedder, change):
+    chunks = corpus()
+    update(chunks, tmp_path, index_type="hnsw" if "hnsw_m" in change else "flat")
+    fake_embedder.embedded.clear()
+    opts = {"index_type": "hnsw", **change} if "hnsw_m" in change else change
+    update(chunks, tmp_path, **opts)
+    assert sorted(fake_embedder.embedded) == sorted(ch["text"] for ch in chunks)
+    manifest = load_manifest(tmp_path)
+    assert manifest["metric"] == change.get("metric", "cosine")
+    assert manifest["index_type"] == opts.get("index_type", "flat")
+
+
+def test_changed_embedding_backend_falls_back_to_a_full_build(tmp_path, fake_embedder, monkeypatch):
+    chunks = corpus()
+    update(chunks, tmp_path)
+    fake_embedder.embedded.clear()
+    monkeypatch.setattr(embed_index, "embed_backend", lambda: "int8")
+    update(chunks, tmp_path)
+    assert len(fake_embedder.embedded) == len(chunks)
+    assert load_manifest(tmp_path)["embed_backend"] == "int8"
+
+
+def test_hnsw_rebuilds_on_removal_but_appends_additions(tmp_path, fake_embedder):
+    update(corpus(), tmp_path, index_type="hnsw")
+    added = corpus(**{"d.md": [corpus_text("d", i) for i in range(3)]})
+    fake_embedder.embedded.clear()
+    update(added, tmp_path, index_type="hnsw")
+    assert sorted(fake_embedder.embedded) == sorted(corpus_text("d", i) for i in range(3))
+
+    removed = corpus(**{"a.md": None})
+    fake_embedder.embedded.clear()
+    update(removed, tmp_path, index_type="hnsw")   # HNSW cannot remove vectors: full build
+    assert sorted(fake_embedder.embedded) == sorted(ch["text"] for ch in removed)
+    assert open_index(tmp_path).index.ntotal == len(removed)
+
+
+def test_compressed_update_carries_float32_vectors_by_hard_link(tmp_path, fake_embedder):
+    update(corpus(), tmp_path / "inc", storage="sq8")
+    old_dir = embed_index.data_dir(tmp_path / "inc", load_manifest(tmp_path / "inc"))
+    old_rows = np.fromfile(old_dir / embed_index.FULL_VECTORS_FILE, dtype="float32").reshape(-1, 16).copy()
+
+    changed = corpus(**{"b.md": None, "d.md": [corpus_text("d", i) for i in range(5)]})
+    update(changed, tmp_path / "inc", storage="sq8")
+    manifest = load_manifest(tmp_path / "inc")
+    new_file = embed_index.data_dir(tmp_path / "inc", manifest) / embed_index.FULL_VECTORS_FILE
+    assert new_file.stat().st_ino == (old_dir / embed_index.FULL_VECTORS_FILE).stat().st_ino
+    rows = np.fromfile(new_file, dtype="float32").reshape(-1, 16)
+    assert len(rows) == manifest["next_id"]
+    np.testing.assert_array_equal(rows[:len(old_rows)], old_rows)   # committed rows are never rewritten
+
+    update(changed, tmp_path / "full", storage="sq8")
+    assert results(tmp_path / "inc", fake_embedder) == results(tmp_path / "full", fake_embedder)
+
+
+# ---------- Generations: manifest.json is the commit marker ----------
+def generations(index_dir):
+    return sorted(p.name for p in index_dir.glob(f"{embed_index.GENERATION_PREFIX}*"))
+
+
+def assert_complete(index_dir):
+    manifest = load_manifest(index_dir)
+    gen_dir = index_dir / manifest["generation"]
+    for name in ("faiss.index", "doc_state.json", "meta/ids.npy", "bm25"):
+        assert (gen_dir / name).exists(), name
+    assert open_index(index_dir).index.ntotal == sum(len(d["ids"]) for d in load_doc_state(index_dir).values())
+
+
+def test_every_save_commits_a_complete_generation(tmp_path, fake_embedder):
+    seen = []
+    for chunks in (corpus(), corpus(**{"d.md": ["one more document"]}), corpus(**{"a.md": None})):
+        update(chunks, tmp_path)
+        assert_complete(tmp_path)
+        seen.append(load_manifest(tmp_path)["generation"])
+        assert seen[-1] in generations(tmp_path)
+    assert len(set(seen)) == 3
+    assert generations(tmp_path) == sorted(seen[-2:])   # the committed one and its predecessor
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+@pytest.mark.parametrize("fail", ["update_sparse_index", "replace"])
+def test_failed_save_keeps_the_committed_index(tmp_path, fake_embedder, monkeypatch, fail):
+    update(corpus(), tmp_path)
+    committed = load_manifest(tmp_path)
+    before = results(tmp_path, fake_embedder)
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+
+    replace = embed_index.os.replace
+
+    def crash_on_manifest(src, dst):
+        if str(dst).endswith("manifest.json"):
+            crash()
+        replace(src, dst)
+
+    with monkeypatch.context() as m:
+        if fail == "replace":
+            m.setattr(embed_index.os, "replace", crash_on_manifest)   # dies while switching the manifest
+        else:
+            m.setattr(embed_index, fail, crash)            # dies halfway through writing the generation
+        with pytest.raises(OSError):
+            update(corpus(**{"d.md": ["one more document"]}), tmp_path)
+
+    assert load_manifest(tmp_path) == committed
+    assert_complete(tmp_path)
+    assert results(tmp_path, fake_embedder) == before
+    update(corpus(**{"d.md": ["one more document"]}), tmp_path)   # the abandoned generation is pruned
+    assert generations(tmp_path) == sorted([committed["generation"], load_manifest(tmp_path)["generation"]])
+
+
+def test_reader_of_the_previous_generation_survives_one_save(tmp_path, fake_embedder):
+    update(corpus(), tmp_path)
+    reader_manifest = load_manifest(tmp_path)   # a reader resolved the manifest, has not opened files yet
+    reader_dir = embed_index.data_dir(tmp_path, reader_manifest)
+    snapshot = open_index(tmp_path)
+
+    update(corpus(**{"b.md": None}), tmp_path)
+    assert reader_dir.is_dir()
+    assert len(embed_index.load_metadata(reader_dir)) == len(corpus())   # still opens the save it resolved
+    assert embed_index.load_sparse_index(reader_dir) is not None
+    old_hits = search_batch(QUERIES, snapshot, None, fake_embedder, k=3, cache=None)
+    assert any(h["source"] == "b.md" for row in old_hits for h in row)   # the held snapshot still serves
+
+    update(corpus(**{"b.md": None, "c.md": None}), tmp_path)
+    assert not reader_dir.exists()   # pruned once it is two saves old
+
+
+# ---------- Compressed indexes: candidates re-scored against vectors.f32 ----------
+def near_duplicates(n_queries=10, dim=32, seed=0):
+    """Queries, plus vectors holding five ever farther copies of each query among random background.
+
+    The true top-5 always falls within the k * RESCORE_FACTOR candidates,
+    but its order is too fine for 8-bit or PQ codes to get right alone.
+    """
+    rng = np.random.default_rng(seed)
+    queries = rng.standard_normal((n_queries, dim)).astype("float32")
+    near = [queries + 0.05 * (j + 1) * rng.standard_normal((n_queries, dim)) for j in range(5)]
+    vectors = np.concatenate([rng.standard_normal((350, dim))] + near).astype("float32")
+    return queries, vectors[rng.permutation(len(vectors))]
+
+
+def build_from_vectors(out_dir, vectors, index_type="flat", metric="cosine", **opts):
+    chunks = make_chunks({"random.md": [f"vector {i}" for i in range(len(vectors))]})
+    embed_index.build_index_from_vectors(chunks, vectors.copy(), "fake-embedder", str(out_dir), index_type, metric,
+                                         **opts)
+    return open_index(out_dir)
+
+
+def search_snapshot(snapshot, queries, k, full_vectors=None):
+    nprobe = 4 if snapshot.manifest["index_type"].startswith("ivf") else None   # every list: only codes are lossy
+    return embed_index.search_vectors(snapshot.index, queries, k, snapshot.manifest, nprobe=nprobe,
+                                      full_vectors=full_vectors)
+
+
+@pytest.mark.parametrize("metric", ["cosine", "l2"])
+@pytest.mark.parametrize("index_type, opts", [
+    ("flat", {"storage": "sq8"}),
+    ("flat", {"storage": "pq", "pq_m": 8}),
+    ("ivf_flat", {"storage": "sq8", "nlist": 4}),
+    ("ivf_pq", {"nlist": 4, "pq_m": 8}),
+    ("hnsw", {"storage": "pq", "pq_m": 8}),
+])
+def test_rescored_candidates_match_exact_flat_ranking(tmp_path, fake_embedder, metric, index_type, opts):
+    queries, vectors = near_duplicates()
+    exact = build_from_vectors(tmp_path / "exact", vectors, metric=metric)
+    compressed = build_from_vectors(tmp_path / "compressed", vectors, index_type, metric, **opts)
+    assert exact.full_vectors is None and compressed.full_vectors is not None
+
+    D_exact, I_exact = search_snapshot(exact, queries, 5)
+    D, I = search_snapshot(compressed, queries, 5, compressed.full_vectors)
+    np.testing.assert_array_equal(I, I_exact)
+    np.testing.assert_allclose(D, D_exact, rtol=1e-5, atol=1e-5)
+    if opts.get("storage") == "pq" or index_type == "ivf_pq":
+        _, I_codes = search_snapshot(compressed, queries, 5)
+        assert (I_codes != I_exact).any()   # the PQ codes alone get the order wrong
+
+
+def test_compressed_index_without_float32_vectors_searches_its_codes(tmp_path, fake_embedder):
+    update(corpus(), tmp_path, storage="sq8")
+    rescored = results(tmp_path, fake_embedder)
+    (embed_index.data_dir(tmp_path, load_manifest(tmp_path)) / embed_index.FULL_VECTORS_FILE).unlink()
+
+    snapshot = open_index(tmp_path)
+    assert snapshot.full_vectors is None   # no re-scoring: scores come from the 8-bit codes
+    plain = results(tmp_path, fake_embedder)
+    assert [len(row) for row in plain] == [5] * len(QUERIES)
+    assert [row[0][0] for row in plain] == [row[0][0] for row in rescored]
+    for row, exact_row in zip(plain, rescored):
+        assert [score for _, score in row] == pytest.approx([score for _, score in exact_row], abs=0.05)
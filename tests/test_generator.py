@@ -0,0 +1,52 @@
+import zlib
+
+import numpy as np
+import pytest
+
+from embed_index import make_index, prepare_vectors
+from generator import search, search_batch, search_many
+from metadata_store import load_metadata
+from registry import IndexSnapshot
+
+MANIFEST = {"metric": "cosine", "normalized": True, "index_type": "flat"}
+
+
+class HashModel:
+    """Deterministic stand-in for the embedding model: a random vector per text."""
+    model_name = "hash-model"
+
+    def get_text_embedding_batch(self, texts):
+        return [np.random.default_rng(zlib.crc32(t.encode())).standard_normal(8).tolist() for t in texts]
+
+
+@pytest.fixture
+def snapshot(gen_dir, entries):
+    ids = np.array(sorted(entries), dtype="int64")
+    index = make_index(8, "flat", metric="cosine")
+    vectors = HashModel().get_text_embedding_batch([entries[i]["text"] for i in ids])
+    index.add_with_ids(prepare_vectors(vectors, MANIFEST), ids)
+    return IndexSnapshot(index, load_metadata(gen_dir), MANIFEST)
+
+
+def test_search_returns_the_matching_chunk_first(snapshot, entries):
+    hits = search(entries[3]["text"], snapshot, None, HashModel(), k=2, cache=None)
+    assert len(hits) == 2
+    assert hits[0]["text"] == entries[3]["text"] and hits[0]["score"] == pytest.approx(1.0)
+
+
+def test_use_cosine_is_deprecated_and_ignored(snapshot, entries):
+    query = entries[1]["text"]
+    expected = search(query, snapshot, None, HashModel(), k=3, cache=None)
+    with pytest.warns(DeprecationWarning, match="use_cosine"):
+        hits = search(query, snapshot, None, HashModel(), k=3, cache=None, use_cosine=False)
+    assert hits == expected
+
+
+def test_positional_use_cosine_fails_loudly(snapshot):
+    model = HashModel()
+    with pytest.raises(TypeError, match="use_cosine"):
+        search("faiss", snapshot, None, model, 3, True)
+    with pytest.raises(TypeError):
+        search_batch(["faiss"], snapshot, None, model, 3, False)
+    with pytest.raises(TypeError):
+        search_many(["faiss"], snapshot, None, model, 3, 256, True)
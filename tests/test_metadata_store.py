@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import metadata_store
+from metadata_store import (MetadataStore, MetadataWriter, filter_bitmap, format_hits, load_metadata, lookup_many,
+                            normalize_filters, row_mask)
+
+
+def test_store_reads_back_entries(gen_dir, entries):
+    store = load_metadata(gen_dir)
+    assert isinstance(store, MetadataStore)
+    assert len(store) == len(entries)
+    assert list(store.keys()) == sorted(entries)
+    assert [store[vid]["text"] for vid in sorted(entries)] == [entries[vid]["text"] for vid in sorted(entries)]
+    assert 2 not in store
+    assert store.get(2) is None
+    with pytest.raises(KeyError):
+        store[2]
+
+
+def test_store_round_trips_every_field(gen_dir, entries):
+    store = MetadataStore(gen_dir)
+    for vid, entry in entries.items():
+        row = store[vid]
+        for key, value in entry.items():
+            assert row[key] == value
+    assert "type" not in store[0]   # only table chunks carry a type
+
+
+def test_writer_requires_increasing_ids(tmp_path):
+    writer = MetadataWriter(tmp_path)
+    writer.add(5, {"text": "a"})
+    with pytest.raises(ValueError):
+        writer.add(5, {"text": "b"})
+
+
+def test_get_many_and_lookup_many(gen_dir, entries):
+    store = MetadataStore(gen_dir)
+    rows = store.get_many([3, 2, 0, 99])
+    assert rows[0]["text"] == entries[3]["text"]
+    assert rows[1] is None and rows[3] is None
+    found = lookup_many(store, np.array([[7, -1, 0], [0, 3, -1]]))
+    assert sorted(found) == [0, 3, 7]
+    assert lookup_many(entries, np.array([[1, -1]])) == {1: entries[1]}
+
+
+def test_normalize_filters_canonical_form():
+    assert normalize_filters(None) is None
+    assert normalize_filters({"source": []}) is None
+    a = normalize_filters({"source": ["b.md", "a.pdf"], "page": "2"})
+    b = normalize_filters({"page": [2], "source": ("a.pdf", "b.md", "a.pdf")})
+    assert a == b == (("page", (2,)), ("source", ("a.pdf", "b.md")))
+    hash(a)
+
+
+@pytest.mark.parametrize("filters", [
+    {"author": "x"},          # not a filterable field
+    {"page": "two"},
+    {"page": True},
+    {"source": 3},
+])
+def test_normalize_filters_rejects_bad_input(filters):
+    with pytest.raises(ValueError):
+        normalize_filters(filters)
+
+
+def test_masks_and_bitmaps_match_legacy_dict(gen_dir, entries):
+    store = MetadataStore(gen_dir)
+    for filters in ({"source": "faiss.pdf"}, {"page": 2}, {"file_type": "md"},
+                    {"strategy": "table_whole", "source": ["faiss.pdf", "pandas.md"]}, {"title": "missing"}):
+        norm = normalize_filters(filters)
+        assert row_mask(store, norm).tolist() == row_mask(entries, norm).tolist()
+        assert np.array_equal(filter_bitmap(store, norm), filter_bitmap(entries, norm))
+    assert row_mask(store, normalize_filters({"page": 2})).tolist() == [False, False, True, True]
+
+
+def test_mask_cache_is_bounded(gen_dir, monkeypatch):
+    monkeypatch.setattr(metadata_store, "MASK_CACHE_ENTRIES", 2)
+    store = MetadataStore(gen_dir)
+    for page in range(5):
+        store.mask(normalize_filters({"page": page}))
+    assert list(store._masks) == [("page", 3), ("page", 4)]
+
+
+def test_bitmap_cache_is_bounded_lru(gen_dir, monkeypatch):
+    monkeypatch.setattr(metadata_store, "BITMAP_CACHE_ENTRIES", 2)
+    store = MetadataStore(gen_dir)
+    first, second, third = (normalize_filters({"page": page}) for page in (1, 2, 3))
+    store.filter_bitmap(first)
+    store.filter_bitmap(second)
+    store.filter_bitmap(first)   # refreshed: second is now the least recently used
+    store.filter_bitmap(third)
+    assert list(store._bitmaps) == [first, third]
+
+
+def test_bitmap_cache_under_concurrent_requests(gen_dir, entries, monkeypatch):
+    monkeypatch.setattr(metadata_store, "BITMAP_CACHE_ENTRIES", 4)
+    store = MetadataStore(gen_dir)
+    filters = [normalize_filters({"page": page}) for page in range(12)]
+    expected = {f: filter_bitmap(entries, f).tobytes() for f in filters}
+
+    def worker(seed):
+        rng = np.random.default_rng(seed)
+        for i in rng.integers(0, len(filters), 300):
+            assert store.filter_bitmap(filters[i]).tobytes() == expected[filters[i]]
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(worker, range(8)))   # re-raises any worker error
+    assert len(store._bitmaps) <= 4
+
+
+def test_field_values(gen_dir):
+    store = MetadataStore(gen_dir)
+    assert store.field_values("page") == [1, 2]
+    assert store.field_values("file_type") == ["md", "pdf"]
+    assert store.field_values("source") == ["faiss.pdf", "pandas.md"]
+
+
+def test_format_hits_skips_padding_and_missing_rows(gen_dir):
+    store = MetadataStore(gen_dir)
+    hits = format_hits(np.array([0.9, 0.8, 0.7, 0.6]), np.array([7, -1, 2, 0]), store)
+    assert [h["rank"] for h in hits] == [1, 4]
+    assert hits[0]["pages"] == [2] and hits[0]["type"] == "table"
+    assert hits[1]["source"] == "faiss.pdf" and hits[1]["score"] == pytest.approx(0.6)
@@ -0,0 +1,83 @@
+import numpy as np
+
+from query_cache import LRUCache, QueryCache, normalize_query
+
+
+class CountingModel:
+    model_name = "test-model"
+
+    def __init__(self):
+        self.calls = []
+
+    def get_text_embedding(self, text):
+        self.calls.append([text])
+        return [float(len(text)), 1.0]
+
+    def get_text_embedding_batch(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_normalize_query():
+    assert normalize_query("  what\tis FAISS ") == "what is FAISS"
+    assert normalize_query("ｆｕｌｌ width") == "full width"
+
+
+def test_lru_evicts_least_recently_used_by_bytes():
+    cache = LRUCache(max_bytes=30)
+    cache.put("a", 1, 10)
+    cache.put("b", 2, 10)
+    cache.put("c", 3, 10)
+    assert cache.get("a") == 1          # a is now the most recent
+    cache.put("d", 4, 10)
+    assert cache.get("b") is None
+    assert [cache.get(k) for k in "acd"] == [1, 3, 4]
+    assert cache.nbytes == 30 and cache.evictions == 1
+    cache.put("huge", 5, 31)            # larger than the whole cache: not stored
+    assert cache.get("huge") is None and len(cache) == 3
+
+
+def test_lru_replacing_a_key_updates_bytes():
+    cache = LRUCache(max_bytes=100)
+    cache.put("a", 1, 40)
+    cache.put("a", 2, 10)
+    assert cache.get("a") == 2 and cache.nbytes == 10
+
+
+def test_lru_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("query_cache.time.monotonic", lambda: now[0])
+    cache = LRUCache(max_bytes=100, ttl=5)
+    cache.put("a", 1, 10)
+    now[0] += 4
+    assert cache.get("a") == 1
+    now[0] += 2
+    assert cache.get("a") is None and cache.nbytes == 0
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1) and stats["hit_rate"] == 0.5
+
+
+def test_query_embeddings_batches_only_missing_queries():
+    cache, model = QueryCache(), CountingModel()
+    first = cache.query_embeddings(model, ["alpha", "beta", " alpha "])
+    assert model.calls == [["alpha", "beta"]]           # normalized duplicates embedded once
+    assert first.shape == (3, 2) and first.dtype == np.float32
+    assert np.array_equal(first[0], first[2])
+    cache.query_embeddings(model, ["beta", "gamma"])
+    assert model.calls[-1] == ["gamma"]
+    assert np.array_equal(cache.query_embedding(model, "alpha"), first[0])
+    assert len(model.calls) == 2
+
+
+def test_results_are_copied_in_and_out():
+    cache = QueryCache()
+    results = [{"rank": 1, "text": "t"}]
+    cache.put_results(("snap", "q", 5), results)
+    results[0]["rank"] = 9
+    got = cache.get_results(("snap", "q", 5))
+    assert got == [{"rank": 1, "text": "t"}]
+    got[0]["rank"] = 7
+    assert cache.get_results(("snap", "q", 5))[0]["rank"] == 1
+    assert cache.get_results(("other", "q", 5)) is None
+    cache.clear()
+    assert cache.stats()["results"]["entries"] == 0
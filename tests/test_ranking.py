@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from embed_index import make_index, prepare_vectors, search_vectors, train_index
+
+DIM = 32
+N = 2000
+K = 10
+
+
+def reference(xb, queries, metric):
+    """Brute-force top-k in NumPy: cosine similarity or squared L2 distance."""
+    if metric == "cosine":
+        xn = xb / np.linalg.norm(xb, axis=1, keepdims=True)
+        qn = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        scores = qn @ xn.T
+        order = np.argsort(-scores, axis=1, kind="stable")[:, :K]
+    else:
+        scores = ((queries[:, None, :] - xb[None, :, :]) ** 2).sum(-1)
+        order = np.argsort(scores, axis=1, kind="stable")[:, :K]
+    return np.take_along_axis(scores, order, axis=1), order
+
+
+@pytest.mark.parametrize("metric", ["cosine", "l2"])
+@pytest.mark.parametrize("index_type, search_kwargs, exact", [
+    ("flat", {}, True),
+    ("ivf_flat", {"nprobe": 4096}, True),   # every list probed: exact
+    ("hnsw", {"ef_search": 512}, False),
+])
+def test_ranking_matches_numpy(index_type, search_kwargs, exact, metric):
+    rng = np.random.default_rng(42)
+    # Varied norms: this is what made L2 over raw vectors disagree with cosine
+    xb = (rng.standard_normal((N, DIM)) * rng.uniform(0.2, 5.0, (N, 1))).astype("float32")
+    queries = rng.standard_normal((20, DIM)).astype("float32") * 3
+    manifest = {"metric": metric, "normalized": metric == "cosine", "index_type": index_type}
+
+    # Built the way build_faiss_index does it, searched the way generator.search does
+    index = make_index(DIM, index_type, n_vectors=N, metric=metric)
+    vectors = prepare_vectors(xb, manifest)
+    train_index(index, vectors)
+    ids = np.arange(1000, 1000 + N, dtype="int64")   # external ids differ from row numbers
+    index.add_with_ids(vectors, ids)
+    D, I = search_vectors(index, queries, K, manifest, **search_kwargs)
+
+    ref_scores, ref_order = reference(xb.astype("float64"), queries.astype("float64"), metric)
+    ref_ids = ids[ref_order]
+    if exact:
+        np.testing.assert_array_equal(I, ref_ids)
+        np.testing.assert_allclose(D, ref_scores, rtol=1e-4, atol=1e-4)
+    else:
+        recall = np.mean([len(set(a) & set(b)) / K for a, b in zip(I, ref_ids)])
+        assert recall >= 0.95
@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from reranker import CrossEncoderReranker
+
+
+class SlowCrossEncoder:
+    """Fake cross-encoder: scores a pair by the number in its text, `delay` seconds per batch."""
+
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.batches = 0
+
+    def predict(self, pairs):
+        self.batches += 1
+        time.sleep(self.delay)
+        return [float(text.split()[-1]) for _, text in pairs]
+
+
+def candidates(n=10):
+    # FAISS order is ascending in the fake score, so a full rerank reverses it
+    return [{"text": f"chunk {i}", "rank": i + 1, "score": 1.0 - i / 100} for i in range(n)]
+
+
+def test_rerank_orders_by_cross_encoder_score():
+    reranker = CrossEncoderReranker(model=SlowCrossEncoder(), batch_size=4)
+    timings = {}
+    top = reranker.rerank("query", candidates(), 3, budget_ms=None, timings=timings)
+    assert [c["text"] for c in top] == ["chunk 9", "chunk 8", "chunk 7"]
+    assert [c["rank"] for c in top] == [1, 2, 3]
+    assert top[0]["rerank_score"] == 9.0 and top[0]["score"] == candidates()[9]["score"]
+    assert timings["pairs_scored"] == 10 and not timings["timed_out"]
+
+
+def test_budget_overrun_keeps_first_stage_order():
+    model = SlowCrossEncoder(delay=0.05)
+    reranker = CrossEncoderReranker(model=model, batch_size=2)
+    timings = {}
+    top = reranker.rerank("query", candidates(), 3, budget_ms=60, timings=timings)
+    assert top == candidates()[:3]   # unchanged: no rerank_score, FAISS ranks
+    assert timings["timed_out"] and timings["pairs_scored"] < 10
+    assert model.batches < 5   # stopped before running out the budget on every batch
+    assert reranker.stats()["timeouts"] == 1
+
+
+def test_counters_under_concurrent_requests():
+    reranker = CrossEncoderReranker(model=SlowCrossEncoder(), batch_size=4)
+
+    def worker(thread):
+        for i in range(50):
+            reranker.rerank(f"query {thread} {i}", candidates(4), 2, budget_ms=None)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(worker, range(8)))
+    stats = reranker.stats()
+    assert stats["requests"] == 400 and stats["pairs_scored"] == 1600 and stats["timeouts"] == 0
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+import service
+from llm_backends import FakeStreamingBackend
+from service import MicroBatcher, llm_backend
+
+
+def run_batcher(fn, items, delays=None, **opts):
+    """Submit items to a fresh MicroBatcher (item i after delays[i] s); its batches and results."""
+    calls = []
+
+    def record(batch):
+        calls.append(list(batch))
+        return fn(batch)
+
+    async def main():
+        batcher = MicroBatcher(record, **opts)
+        batcher.start()
+
+        async def submit(i, item):
+            await asyncio.sleep(delays[i] if delays else 0)
+            return await batcher.submit(item)
+
+        try:
+            return await asyncio.gather(*(submit(i, item) for i, item in enumerate(items)),
+                                        return_exceptions=True)
+        finally:
+            await batcher.stop()
+
+    return calls, asyncio.run(main())
+
+
+def generate_all(prompts):
+    backend = FakeStreamingBackend(first_token_delay=0, token_delay=0)
+    return [backend.generate(f"Query: {p}", "model") for p in prompts]
+
+
+def test_flushes_when_the_batch_is_full():
+    calls, results = run_batcher(generate_all, list("abcde"), max_batch_size=2, max_wait_ms=500)
+    assert [len(batch) for batch in calls] == [2, 2, 1]
+    assert results == [f"Stub answer to: {p} [1]" for p in "abcde"]
+
+
+def test_flushes_after_max_wait():
+    t0 = time.perf_counter()
+    calls, results = run_batcher(generate_all, ["a", "b", "c"], delays=[0, 0, 0.3], max_batch_size=32,
+                                 max_wait_ms=50)
+    assert calls == [["a", "b"], ["c"]]   # the first batch did not wait for the late request
+    assert results == [f"Stub answer to: {p} [1]" for p in "abc"]
+    assert time.perf_counter() - t0 < 2
+
+
+def test_batch_failure_reaches_every_waiting_request():
+    def fail(batch):
+        raise RuntimeError("index unavailable")
+
+    calls, results = run_batcher(fail, ["a", "b", "c"], max_batch_size=32, max_wait_ms=50)
+    assert len(calls) == 1
+    assert all(isinstance(r, RuntimeError) and str(r) == "index unavailable" for r in results)
+
+
+def test_item_failure_fails_only_its_request():
+    def some_fail(batch):
+        return [ValueError(p) if p == "bad" else p.upper() for p in batch]
+
+    _, results = run_batcher(some_fail, ["a", "bad", "c"], max_batch_size=32, max_wait_ms=50)
+    assert results[0] == "A" and results[2] == "C"
+    assert isinstance(results[1], ValueError)
+
+
+def test_unknown_llm_backend_is_rejected():
+    assert llm_backend("fake") is service.BACKENDS["fake"]
+    with pytest.raises(ValueError, match="RAG_LLM_BACKEND"):
+        llm_backend("gpt")
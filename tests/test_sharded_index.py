@@ -0,0 +1,67 @@
+import json
+
+import pytest
+
+import embed_index
+from conftest import corpus_text, make_chunks
+from embed_index import SHARDS_FILE, build_faiss_index, build_sharded_index
+from generator import search_batch
+from query_cache import QueryCache
+from registry import open_index
+
+QUERIES = ["topic1 term3", corpus_text("e", 4), "document b chunk 9", "term10 about topic0"]
+CHUNKS = make_chunks({f"{name}.md": [corpus_text(name, i) for i in range(8)] for name in "abcdefgh"})
+
+
+def top_k(index_dir, model, k=6, **opts):
+    hits = search_batch(QUERIES, open_index(index_dir), None, model, k=k, cache=None, **opts)
+    return [[(h["text"], round(h["score"], 5)) for h in row] for row in hits]
+
+
+@pytest.mark.parametrize("metric", ["cosine", "l2"])
+@pytest.mark.parametrize("filters", [None, {"source": ["a.md", "c.md", "f.md"]}])
+def test_sharded_top_k_matches_unsharded(tmp_path, fake_embedder, metric, filters):
+    # dense only: BM25 statistics are per shard, so hybrid scores differ by design
+    build_faiss_index(CHUNKS, "fake-embedder", str(tmp_path / "single"), metric=metric)
+    build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path / "sharded"), n_shards=3, metric=metric)
+    sharded = open_index(tmp_path / "sharded").index
+    assert len(sharded.shards) == 3 and sharded.ntotal == len(CHUNKS)
+    assert top_k(tmp_path / "sharded", fake_embedder, filters=filters) == top_k(tmp_path / "single", fake_embedder,
+                                                                                filters=filters)
+
+
+def test_rebuild_with_fewer_shards_removes_stale_shards(tmp_path, fake_embedder):
+    build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path), n_shards=4)
+    assert len(list(tmp_path.glob("shard_*"))) == 4
+    build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path), n_shards=2)
+    layout = json.loads((tmp_path / SHARDS_FILE).read_text())
+    assert sorted(p.name for p in tmp_path.glob("shard_*")) == layout["shards"] == ["shard_000", "shard_001"]
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_failed_layout_write_keeps_the_previous_layout(tmp_path, fake_embedder, monkeypatch):
+    build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path), n_shards=4)
+    before = (tmp_path / SHARDS_FILE).read_text()
+    replace = embed_index.os.replace
+
+    def crash_on_layout(src, dst):
+        if str(dst).endswith(SHARDS_FILE):
+            raise OSError("disk full")
+        replace(src, dst)
+
+    monkeypatch.setattr(embed_index.os, "replace", crash_on_layout)
+    with pytest.raises(OSError):
+        build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path), n_shards=2)
+    assert (tmp_path / SHARDS_FILE).read_text() == before   # never truncated or half-written
+    assert len(list(tmp_path.glob("shard_*"))) == 4         # nothing the layout names was removed
+    assert len(open_index(tmp_path).index.shards) == 4
+
+
+def test_sharded_results_are_cached_per_snapshot(tmp_path, fake_embedder):
+    build_sharded_index(CHUNKS, "fake-embedder", str(tmp_path), n_shards=3)
+    snapshot, cache = open_index(tmp_path), QueryCache()
+    first = search_batch(QUERIES, snapshot, None, fake_embedder, k=4, cache=cache)
+    fake_embedder.embedded.clear()
+    assert search_batch(QUERIES, snapshot, None, fake_embedder, k=4, cache=cache) == first
+    assert fake_embedder.embedded == []   # answered from the results cache, not the shards
+    assert cache.stats()["results"]["hits"] == len(QUERIES)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from metadata_store import write_metadata_store
+from sparse_index import (build_sparse_index, load_sparse_index, reciprocal_rank_fusion, tokenize,
+                          update_sparse_index)
+
+
+def test_tokenize_keeps_compound_names_and_their_parts():
+    assert tokenize("Use pandas.read_csv") == ["use", "pandas.read_csv", "read_csv", "pandas", "read", "csv"]
+    assert tokenize("v2.1 costs 3.5") == ["v2.1", "1", "v2", "costs", "3.5", "5", "3"]
+
+
+def test_no_bm25_dir_means_no_sparse_index(tmp_path):
+    assert load_sparse_index(tmp_path) is None
+
+
+def test_search_ranks_exact_terms_first(gen_dir):
+    build_sparse_index(gen_dir)
+    sparse = load_sparse_index(gen_dir)
+    assert len(sparse) == 4
+    scores, ids = sparse.search("pandas.read_csv", k=3)
+    assert ids.tolist() == [1]
+    scores, ids = sparse.search("faiss ivf index", k=2)
+    assert len(ids) == 2 and ids[0] in (0, 3)
+    assert np.all(np.diff(scores) <= 0)
+    assert sparse.search("no such words", k=3)[1].size == 0
+
+
+def test_search_applies_row_mask(gen_dir):
+    build_sparse_index(gen_dir)
+    sparse = load_sparse_index(gen_dir)
+    mask = np.array([False, True, True, True])   # rows follow the sorted ids 0, 1, 3, 7
+    _, ids = sparse.search("faiss index", k=5, row_mask=mask)
+    assert 0 not in ids.tolist()
+
+
+def test_doc_freq(gen_dir):
+    build_sparse_index(gen_dir)
+    sparse = load_sparse_index(gen_dir)
+    assert sparse.doc_freq("faiss") == 1
+    assert sparse.doc_freq("index") == 1
+    assert sparse.doc_freq("missing") == 0
+
+
+def _arrays(index_dir):
+    sparse = load_sparse_index(index_dir)
+    return (sorted(sparse.term_ids, key=sparse.term_ids.get), np.asarray(sparse.offsets),
+            np.asarray(sparse.doc_rows), np.asarray(sparse.tfs), np.asarray(sparse.ids), sparse.doc_len)
+
+
+def test_incremental_update_matches_full_build(tmp_path, entries):
+    base, gen, full = tmp_path / "base", tmp_path / "gen", tmp_path / "full"
+    write_metadata_store(entries, base)
+    build_sparse_index(base)
+    updated = {vid: e for vid, e in entries.items() if vid != 1}   # one removed, one added
+    updated[9] = {"text": "HNSW graphs cannot remove vectors.", "source": "faiss.pdf", "page": 3}
+    for d in (gen, full):
+        write_metadata_store(updated, d)
+    update_sparse_index(base, gen)
+    build_sparse_index(full)
+    for got, want in zip(_arrays(gen), _arrays(full)):
+        assert np.array_equal(got, want) if isinstance(want, np.ndarray) else got == want
+    assert "pandas" not in load_sparse_index(gen).term_ids
+
+
+def test_reciprocal_rank_fusion():
+    scores, ids = reciprocal_rank_fusion([[1, 2, -1], [2, 3]], k=2, rrf_k=60)
+    assert ids == [2, 1]
+    assert scores[0] == pytest.approx(1 / 62 + 1 / 61)
+    _, ids = reciprocal_rank_fusion([[(0, 5), (1, 5)], [(1, 5)]], k=3)
+    assert ids == [(1, 5), (0, 5)]
@@ -0,0 +1,83 @@
+import pytest
+
+import telemetry
+from telemetry import Histogram, Metrics, breakdown, record, span, trace, traced
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    m = Metrics()
+    monkeypatch.setattr(telemetry, "METRICS", m)
+    return m
+
+
+def test_histogram_buckets_and_percentiles():
+    h = Histogram(buckets=(1, 10))
+    for value in (0.5, 2, 20):
+        h.observe(value)
+    assert h.bucket_counts == [1, 2] and h.count == 3 and h.sum == pytest.approx(22.5)
+    assert h.summary()["p50"] == pytest.approx(2)
+    assert Histogram().summary() == {"count": 0}
+
+
+def test_counters_are_keyed_by_labels():
+    m = Metrics()
+    m.inc("queries")
+    m.inc("queries", 2)
+    m.inc("errors", stage="embed")
+    counters = m.snapshot()["counters"]
+    assert counters == {"errors{stage=embed}": 1, "queries": 3}
+
+
+def test_prometheus_exposition():
+    m = Metrics()
+    m.inc("files_ingested", 2)
+    m.observe("stage_seconds", 0.02, stage="search")
+    m.register("cache", lambda: {"hits": 3, "nested": {"bytes": 10}, "label": "x", "flag": True})
+    text = m.prometheus()
+    assert "# TYPE rag_files_ingested counter\nrag_files_ingested 2\n" in text
+    assert 'rag_stage_seconds_bucket{stage="search",le="0.025"} 1' in text
+    assert 'rag_stage_seconds_bucket{stage="search",le="0.01"} 0' in text
+    assert 'rag_stage_seconds_count{stage="search"} 1' in text
+    assert "rag_cache_hits 3" in text and "rag_cache_nested_bytes 10" in text
+    assert "label" not in text and "flag" not in text
+
+
+def test_span_records_histogram_and_trace(metrics):
+    with trace() as spans:
+        with span("outer", n=1) as attrs:
+            with span("inner"):
+                pass
+            attrs["results"] = 5
+    assert [entry["stage"] for _, entry in spans] == ["inner", "outer"]
+    assert spans[1][1]["results"] == 5 and spans[1][1]["n"] == 1
+    rows = breakdown(spans)
+    assert [r["stage"] for r in rows] == ["outer", "  inner"]   # start order, indented by depth
+    assert set(metrics.snapshot()["histograms"]) == {"stage_seconds{stage=inner}", "stage_seconds{stage=outer}"}
+
+
+def test_span_records_even_when_the_block_raises(metrics):
+    with pytest.raises(RuntimeError):
+        with span("failing"):
+            raise RuntimeError("boom")
+    assert metrics.snapshot()["histograms"]["stage_seconds{stage=failing}"]["count"] == 1
+
+
+def test_traced_and_record(metrics):
+    @traced("work")
+    def work(x):
+        return x * 2
+
+    assert work(21) == 42
+    record("llm.stream", 0.5, model="m")
+    hist = metrics.snapshot()["histograms"]
+    assert hist["stage_seconds{stage=work}"]["count"] == 1
+    assert hist["stage_seconds{stage=llm.stream}"]["sum"] == pytest.approx(0.5)
+
+
+def test_spans_outside_trace_are_not_collected(metrics):
+    with span("untraced"):
+        pass
+    with trace() as spans:
+        pass
+    assert spans == []